@@ -5,6 +5,8 @@ import sys
 import logging
 import logging.config
 import autologging
+from collections import OrderedDict
+from collections.abc import Mapping
 import astropy.units as u
 from PIL import Image
 from astropy.time import Time
@@ -12,10 +14,13 @@ from poliastro.constants import J2000_TDB
 from poliastro.bodies import *
 from poliastro.frames.fixed import *
 from poliastro.frames.fixed import MoonFixed as LunaFixed
-from vispy.util.quaternion import Quaternion
 from poliastro.core.fixed import *
-from vispy.geometry.meshdata import MeshData
-from viz_functs import get_tex_data
+try:
+    from vispy.util.quaternion import Quaternion
+    from vispy.geometry.meshdata import MeshData
+    from viz_functs import get_tex_data
+except ImportError:         # the model can be run headless (sim_bench, sim_batch) without vispy
+    Quaternion = MeshData = get_tex_data = None
 
 SNS_SOURCE_PATH = os.curdir + '/'      # "c:\\_Projects\\sns2\\src\\"
 os.chdir(SNS_SOURCE_PATH)
@@ -27,10 +32,13 @@ logging.basicConfig(filename=SNS_SOURCE_PATH + "../logs/sns_defs.log",
 DEF_UNITS = u.km
 DEF_EPOCH0 = J2000_TDB
 DEF_TEX_FNAME = "../resources/textures/2k_5earth_daymap.png"
+DEF_TEX_CACHE_BYTES = 256 * 1024 * 1024     # upper limit on the decoded texture images held in memory
+DEF_TEX_CACHE_DIR = "../cache/textures/"    # where the downsampled texture levels are kept
+TEX_PYRAMID_WIDTHS = (2048, 1024, 512, 256, 128)
 vec_type = type(np.zeros((3,), dtype=np.float64))
 DEF_CAM_STATE = {'center': (-8.0e+08, 0.0, 0.0),
                  'scale_factor': 0.5e+08,
-                 'rotation1': Quaternion(-0.5, +0.5, -0.5, -0.5),
+                 'rotation1': Quaternion(-0.5, +0.5, -0.5, -0.5) if Quaternion else None,
                  }
 
 
@@ -98,7 +106,7 @@ def toTD(epoch=None):
 def earth_rot_elements_at_epoch(T=None, d=None):
     """"""
     _T = T
-    return 0, 90 - 23.5, (d - math.floor(d)) * 360.0
+    return 0, 90 - 23.5, (d - np.floor(d)) * 360.0
 
 
 def t_since_ref(epoch=None, ref=J2000_TDB):
@@ -286,6 +294,148 @@ def to_quat_str(quat):
         return quat_str
 
 
+def tex_pyramid_levels(fname, cache_dir=DEF_TEX_CACHE_DIR, widths=TEX_PYRAMID_WIDTHS):
+    """
+        Lists the levels of the texture pyramid of an image, without generating any of them.
+        Only the header of the full resolution image is read.
+    Parameters
+    ----------
+    fname       : str               path of the full resolution texture
+    cache_dir   : str               directory of the generated levels
+    widths      : tuple of int      widths of the levels below the full resolution image
+
+    Returns
+    -------
+    list of (int, str)  : the width and path of each level, the full resolution image first
+    """
+    with Image.open(fname) as im:
+        src_width = im.width
+    stem = os.path.splitext(os.path.basename(fname))[0]
+
+    return [(src_width, fname)] + [(w, os.path.join(cache_dir, f"{stem}_{w}.png"))
+                                   for w in widths if w < src_width]
+
+
+def build_tex_level(levels, width):
+    """
+        Generates one level of a texture pyramid, unless it is already on disk and newer than
+        the full resolution image.  It is resampled from the smallest valid level above it, so
+        that the full resolution image is only read when no such level exists.
+    Parameters
+    ----------
+    levels      : list of (int, str)    as returned by tex_pyramid_levels()
+    width       : int                   the width of the level
+
+    Returns
+    -------
+    str         : the path of the level
+    """
+    src_fname = levels[0][1]
+    src_mtime = os.path.getmtime(src_fname)
+    paths = dict(levels)
+    level_fname = paths[width]
+
+    def is_valid(path):
+        return path == src_fname or (os.path.exists(path) and os.path.getmtime(path) >= src_mtime)
+
+    if not is_valid(level_fname):
+        above = [(w, f) for w, f in levels if w > width and is_valid(f)]
+        with Image.open(above[-1][1]) as im:
+            image = im.resize((width, max(1, width * im.height // im.width)), Image.LANCZOS)
+        os.makedirs(os.path.dirname(level_fname), exist_ok=True)
+        image.save(level_fname)
+        logging.debug("Generated texture level %s from %s", level_fname, above[-1][1])
+
+    return level_fname
+
+
+class TextureCache:
+    """
+        A least-recently-used cache of decoded texture images, keyed by filename.
+        Images are decoded on first use and the least recently used are dropped
+        once the total size of the decoded pixel data exceeds max_bytes.
+    """
+    def __init__(self, max_bytes=DEF_TEX_CACHE_BYTES):
+        self._max_bytes = max_bytes
+        self._n_bytes = 0
+        self._images = OrderedDict()
+
+    @staticmethod
+    def image_bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, fname):
+        if fname in self._images:
+            self._images.move_to_end(fname)
+            return self._images[fname]
+
+        image = get_tex_data(fname=fname)
+        self._images[fname] = image
+        self._n_bytes += self.image_bytes(image)
+        while self._n_bytes > self._max_bytes and len(self._images) > 1:
+            old_fname, old_image = self._images.popitem(last=False)
+            self._n_bytes -= self.image_bytes(old_image)
+            logging.debug("Evicted texture %s", old_fname)
+
+        return image
+
+    def clear(self):
+        self._images.clear()
+        self._n_bytes = 0
+
+    @property
+    def n_bytes(self):
+        return self._n_bytes
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def __contains__(self, fname):
+        return fname in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+
+class VizzParams(dict):
+    """
+        The visual parameters of a body.  The 'tex_data' entry is not stored, it is
+        fetched through the texture cache of the data store each time it is requested.
+    """
+    def __init__(self, tex_loader=None, **kwargs):
+        super().__init__(**kwargs)
+        self._tex_loader = tex_loader
+
+    def __missing__(self, key):
+        if key == 'tex_data' and self._tex_loader is not None:
+            return self._tex_loader()
+
+        raise KeyError(key)
+
+
+class BodyTextures(Mapping):
+    """
+        A read-only mapping of body name to texture image, which decodes the images through the
+        texture cache of a SystemDataStore when they are accessed.
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, name):
+        res = self._store.body_texture_data(name)
+        if res is None:
+            raise KeyError(name)
+
+        return res
+
+    def __iter__(self):
+        return iter(self._store.body_names)
+
+    def __len__(self):
+        return len(self._store.body_names)
+
+
 log_config = {
     "version": 1,
     "formatters": {
@@ -323,10 +473,14 @@ log_config = {
 
 
 class SystemDataStore:
-    def __init__(self):
+    def __init__(self, tex_cache_bytes=DEF_TEX_CACHE_BYTES):
         """
+            Collects the static data of the system.  Textures are not read here, they are
+            decoded on first access through body_texture_data() and kept in a TextureCache.
         """
         self._dist_unit = DEF_UNITS
+        self._tex_cache = TextureCache(max_bytes=tex_cache_bytes)
+        self._tex_levels = {}
         DEF_EPOCH = DEF_EPOCH0  # default epoch
         SYS_PARAMS = dict(sys_name="Sol",
                           def_epoch=DEF_EPOCH,
@@ -335,11 +489,13 @@ class SystemDataStore:
                           spacing=24 * 60 * 60 * u.s,  # one Earth day (in seconds)
                           fps=60,
                           n_samples=365,
+                          cheb_span=365 * u.d,  # time covered by the Chebyshev ephemeris tables
+                          cheb_degree=12,
                           )
         _tex_path = "../resources/textures/"  # directory of texture image files for windows
         _def_tex_fname = "2k_ymakemake_fictional.png"
         _tex_fnames = []  # list of texture filenames (will be sorted)
-        _tex_dat_set = {}  # dist of body name and the texture data associated with it
+        _tex_paths = {}  # dict of body name and the path of its texture file
         _body_params = {}  # dict of body name and the static parameters of each
         _vizz_params = {}  # dict of body name and the semi-static visual parameters
         _type_count = {}  # dict of body types and the count of each typE
@@ -408,6 +564,10 @@ class SystemDataStore:
                     neptune_rot_elements_at_epoch,
                     moon_rot_elements_at_epoch,
                     ]
+        # the same rotation models as coefficient tables, keys of sim_rotation.IAU_ROT_MODELS
+        _rot_models = ('sun', 'mercury', 'venus', 'earth', 'moon', 'mars',
+                       'jupiter', 'saturn', 'uranus', 'neptune', 'moon',
+                       )
         # body color values in RGBA (0...255)
         _color_RGB = [[253, 184, 19],  # base color for each body
                       [26, 26, 26],
@@ -454,12 +614,18 @@ class SystemDataStore:
         for i in _tex_dirlist:
             if "png" in i:
                 _tex_fnames.append(i)  # add PNG type files to list
-        # _tex_fnames = _tex_fnames.sort()  # it doesn't like this sort()
-        _tex_fnames = tuple(_tex_fnames)  # the tuple locks in the order of sorted elements
-        # indices of texture filenames for each body
-        _tex_idx = (0, 1, 3, 10, 17, 11, 12, 13, 15, 16, 17,
-                    # 21, 21, 21, 21, 21, 21, 21, 21, 21,
-                    )
+        _tex_fnames = tuple(sorted(_tex_fnames))  # the tuple locks in the order of sorted elements
+        # texture filename of each body, named rather than indexed so that it does not depend on the listing
+        _tex_body_fnames = ("2k_0sun.png", "2k_1mercury.png", "2k_3venus_surface.png",
+                            "2k_aEarth_LOIC_2048.png", "2k_hmoon.png", "2k_bmars.png",
+                            "2k_cjupiter.png", "2k_dsaturn.png", "2k_furanus.png",
+                            "2k_gneptune.png", "2k_hmoon.png",
+                            )
+        _tex_missing = sorted(set(_tex_body_fnames + (_def_tex_fname,)) - set(_tex_fnames))
+        if _tex_missing:
+            raise FileNotFoundError(f'>>>ERROR: textures missing from {_tex_path}: {_tex_missing}')
+        # indices of texture filenames for each body, in the sorted listing
+        _tex_idx = tuple(_tex_fnames.index(fname) for fname in _tex_body_fnames)
 
         for idx in range(len(self._body_names)):  # idx = [0..,len(_body_names)-1]
             _bod_name = self._body_names[idx]
@@ -470,10 +636,10 @@ class SystemDataStore:
 
             try:
                 _tex_fname = _tex_path + _tex_fnames[_tex_idx[idx]]  # get path of indexed filename
-            except:
+            except IndexError:
                 _tex_fname = _tex_path + _def_tex_fname
-            _tex_dat_set.update({_bod_name: get_tex_data(fname=_tex_fname)})  # add texture data to active dict
-            logging.debug("_tex_dat_set[" + str(idx) + "] = " + str(_tex_fname))
+            _tex_paths.update({_bod_name: _tex_fname})  # the texture itself is loaded on demand
+            logging.debug("_tex_paths[" + str(idx) + "] = " + str(_tex_fname))
             if _body.parent is None:
                 R = _body.R
                 Rm = Rp = R
@@ -494,20 +660,23 @@ class SystemDataStore:
                               r_set=(R, Rm, Rp),
                               fixed_frame=_frame_set[idx],
                               rot_func=_rot_set[idx],
+                              rot_model=_rot_models[idx],
                               o_period=_o_per_set[idx].to(u.s),
-                              body_type=_body_types[_type_set[idx]]
+                              body_type=_body_types[_type_set[idx]],
+                              cheb_span=SYS_PARAMS['cheb_span'],
+                              cheb_degree=SYS_PARAMS['cheb_degree'],
                               )
             _body_params.update({_bod_name: _body_data})
             # a dict of the initial visual parameters
-            _vizz_data = dict(body_color=_colorset_rgb[idx],
-                              body_alpha=1.0,
-                              track_alpha=0.6,
-                              body_mark=_body_mark[_type_set[idx]],
-                              fname_idx=_tex_idx[idx],
-                              tex_fname=_tex_fnames[_tex_idx[idx]],
-                              tex_data=_tex_dat_set[_bod_name],  # _tex_dat_set[idx],
-                              viz_names=_viz_assign[_bod_name],
-                              )
+            _vizz_data = VizzParams(tex_loader=lambda n=_bod_name: self.body_texture_data(n),
+                                    body_color=_colorset_rgb[idx],
+                                    body_alpha=1.0,
+                                    track_alpha=0.6,
+                                    body_mark=_body_mark[_type_set[idx]],
+                                    fname_idx=_tex_idx[idx],
+                                    tex_fname=os.path.basename(_tex_fname),
+                                    viz_names=_viz_assign[_bod_name],
+                                    )
             _vizz_params.update({_bod_name: _vizz_data})
 
             if _body_data['body_type'] not in _type_count.keys():  # identify types of bodies
@@ -521,14 +690,14 @@ class SystemDataStore:
             len(_colorset_rgb),
             len(_frame_set),
             len(_rot_set),
+            len(_rot_models),
             len(_tex_idx),
             len(_type_set),
             len(self._body_names),
-            len(_tex_dat_set.keys()),
-            len(_tex_fnames),
+            len(_tex_paths.keys()),
         ]
         print("Check sets = ", _check_sets)
-        assert _check_sets == ([_body_count, ] * (len(_check_sets) - 1) + [100, ])
+        assert _check_sets == ([_body_count, ] * len(_check_sets))
         print("\t>>>check sets check out!")
         logging.debug("STATIC DATA has been loaded and verified...")
 
@@ -536,7 +705,7 @@ class SystemDataStore:
                                SYS_PARAMS=SYS_PARAMS,
                                TEX_FNAMES=_tex_fnames,
                                TEXTR_PATH=_tex_path,
-                               TEXTR_DATA=_tex_dat_set,
+                               TEXTR_PATHS=_tex_paths,
                                BODY_COUNT=_body_count,
                                BODY_NAMES=self._body_names,
                                COLOR_DATA=_colorset_rgb,
@@ -595,25 +764,90 @@ class SystemDataStore:
         return self._datastore['TEXTR_PATH']
 
     @property
-    def texture_fname(self, name=None):
+    def texture_fname(self):
+        """ The sorted filenames of the available textures. """
+        return self._datastore['TEX_FNAMES']
+
+    @property
+    def texture_data(self):
+        """ The texture image of each body, by name, decoded on first access (see body_texture_data). """
+        return BodyTextures(self)
+
+    def body_texture_fname(self, name=None):
+        """ The path of the texture file of a body, None if the name is not a valid body name. """
         res = None
-        if name is None:
-            res = self._datastore['TEX_FNAMES']
-        elif name in self.body_names:
-            res = self._datastore['BODY_PARAM'][name]['tex_fname']
+        if name in self.body_names:
+            res = self._datastore['TEXTR_PATHS'][name]
 
         return res
 
-    @property
-    def texture_data(self, name=None):
+    def body_texture_data(self, name=None):
+        """
+            Returns the decoded texture image of a body, reading it from disk on first use.
+        Parameters
+        ----------
+        name    : str       the name of the body
+
+        Returns
+        -------
+        PIL.Image | None    None if the name is not a valid body name
+        """
         res = None
-        if name is None:
-            res = self._datastore['TEXTR_DATA']
-        elif name in self.body_names:
-            res = self._datastore['BODY_PARAM'][name]['tex_data']
+        if name in self.body_names:
+            res = self._tex_cache.get(self._datastore['TEXTR_PATHS'][name])
 
         return res
 
+    def texture_levels(self, name=None):
+        """
+            Returns the (width, path) of each level of the texture pyramid of a body,
+            largest first.  The levels are only generated when texture_level() first needs them.
+        """
+        if name not in self.body_names:
+            return None
+
+        if name not in self._tex_levels:
+            self._tex_levels[name] = tex_pyramid_levels(self._datastore['TEXTR_PATHS'][name])
+
+        return self._tex_levels[name]
+
+    def texture_level_width(self, name=None, min_width=0):
+        """
+            Returns the width of the smallest level of the texture of a body that is at least
+            min_width wide, or of the full resolution image if none are that wide.
+        """
+        levels = self.texture_levels(name)
+        res = levels[0][0]
+        for width, _ in levels:
+            if width >= min_width:
+                res = width
+
+        return res
+
+    def texture_level(self, name=None, min_width=0):
+        """
+            Returns the decoded image of the level chosen by texture_level_width().
+        Parameters
+        ----------
+        name        : str       the name of the body
+        min_width   : int       the minimum width of the image in pixels
+
+        Returns
+        -------
+        PIL.Image | None        None if the name is not a valid body name
+        """
+        if name not in self.body_names:
+            return None
+
+        width = self.texture_level_width(name, min_width)
+        fname = build_tex_level(self.texture_levels(name), width)
+
+        return self._tex_cache.get(fname)
+
+    @property
+    def texture_cache(self):
+        return self._tex_cache
+
     @property
     def data_store(self):
         return self._datastore
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the EphemCache class, a persistent on-disk cache of sampled ephemerides.
+    Each entry is a memory-mappable .npy file of rows [jd, x, y, z, vx, vy, vz] (km, km/s) with a
+    .json sidecar that records the key it was generated for.  Entries are keyed by body name,
+    attractor, epoch range, spacing, reference plane and ephemeris source, and are validated
+    against their sidecar before use.
+"""
+import os
+import json
+import zlib
+import hashlib
+import logging
+import numpy as np
+from astropy.coordinates import solar_system_ephemeris
+
+logging.basicConfig(filename="../logs/sns_ephem.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+CACHE_VERSION = 1
+DEF_CACHE_DIR = "../cache/ephem/"
+DEF_EPHEM_SOURCE = "jpl"
+_ephem_source = DEF_EPHEM_SOURCE
+
+
+def set_ephem_source(name=DEF_EPHEM_SOURCE):
+    """
+        Selects the astropy solar system ephemeris.  Setting "jpl" requires the kernel to be
+        downloaded the first time; when that is not possible the name is still recorded so
+        that entries already in the cache can be used offline, but no new entries are stored
+        under it (see is_source_active).
+    """
+    global _ephem_source
+    try:
+        solar_system_ephemeris.set(name)
+    except (OSError, ImportError) as err:
+        logging.warning("Ephemeris %s is unavailable (%s), using %s, cached %s data is read only",
+                        name, err, solar_system_ephemeris.get(), name)
+    _ephem_source = name
+
+
+def ephem_source():
+    return _ephem_source
+
+
+def is_source_active(name=None):
+    """ True when the named source (default: the selected one) is the ephemeris astropy computes with. """
+    return (name if name else _ephem_source) == solar_system_ephemeris.get()
+
+
+class EphemCache:
+    """
+        A directory of cached ephemeris samples.
+    """
+    def __init__(self, cache_dir=DEF_CACHE_DIR, enabled=True):
+        self._cache_dir = cache_dir
+        self._enabled = enabled
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(body_name, jds, plane, attractor=None, source=None):
+        """
+            Builds the key that identifies a set of samples.
+        Parameters
+        ----------
+        body_name   : str               name of the sampled body
+        jds         : np.ndarray        TDB Julian dates of the samples
+        plane       : Planes            reference plane of the samples
+        attractor   : str               name of the central body, None for the barycenter
+        source      : str               the solar system ephemeris used
+
+        Returns
+        -------
+        dict        : a JSON serializable key
+        """
+        jds = np.ascontiguousarray(jds, dtype=np.float64)
+        steps = np.diff(jds)
+        is_uniform = len(steps) > 0 and np.allclose(steps, steps[0], rtol=0, atol=1e-9)
+        return dict(version=CACHE_VERSION,
+                    body=body_name,
+                    attractor=attractor,
+                    plane=getattr(plane, 'name', str(plane)),
+                    source=source if source else ephem_source(),
+                    jd_start=repr(float(jds[0])),
+                    jd_end=repr(float(jds[-1])),
+                    count=len(jds),
+                    spacing=repr(float(steps[0])) if is_uniform else None,
+                    epochs_sha1=hashlib.sha1(jds.tobytes()).hexdigest(),
+                    )
+
+    def _paths(self, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        stem = os.path.join(self._cache_dir, f"{key['body']}_{digest}")
+        return stem + ".npy", stem + ".json"
+
+    def load(self, key, verify=False):
+        """
+            Returns the memory-mapped samples for the key, or None if there is no valid entry.
+            Only the sidecar and the .npy header are checked, so that no sample is read until it
+            is used; verify=True also checks the checksum of the whole entry.
+        """
+        if not self._enabled:
+            return None
+
+        data_path, meta_path = self._paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            data = np.load(data_path, mmap_mode='r')
+            valid = (meta['key'] == key and
+                     tuple(meta['shape']) == data.shape and
+                     (not verify or meta['crc32'] == zlib.crc32(np.ascontiguousarray(data).tobytes())))
+        except (OSError, ValueError, KeyError) as err:
+            logging.warning("Unreadable cache entry %s: %s", data_path, err)
+            valid = False
+
+        if not valid:
+            logging.warning("Invalid cache entry for %s, removing it", key['body'])
+            data = None
+            self._remove(data_path, meta_path)
+
+        return data
+
+    def store(self, key, data):
+        """
+            Writes the samples for the key.  Both files are written under temporary names and
+            then moved into place, so an interrupted write never leaves a valid looking entry.
+            Samples that are not finite, or that were not computed with the source of the key,
+            are not stored.
+
+        Returns
+        -------
+        bool    : True if the entry was written
+        """
+        if not self._enabled:
+            return False
+
+        if not is_source_active(key['source']):
+            logging.warning("Not caching %s: computed with %s, not %s",
+                            key['body'], solar_system_ephemeris.get(), key['source'])
+            return False
+
+        if not np.all(np.isfinite(data)):
+            logging.warning("Not caching %s: the samples are not finite", key['body'])
+            return False
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        data_path, meta_path = self._paths(key)
+        meta = dict(key=key, shape=list(data.shape), crc32=zlib.crc32(data.tobytes()))
+        with open(data_path + ".tmp", 'wb') as f:
+            np.save(f, data)
+        with open(meta_path + ".tmp", 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        return True
+
+    def verify(self, key):
+        """ Checks the checksum of a whole entry, removing it if it is corrupt. """
+        return self.load(key, verify=True) is not None
+
+    def fetch_rv(self, body_name, jds, plane, compute_fn, attractor=None):
+        """
+            Returns the position and velocity samples of a body, from the cache when possible.
+        Parameters
+        ----------
+        compute_fn  : callable      maps jds to (r (K, 3) in km, v (K, 3) in km/s) on a miss
+
+        Returns
+        -------
+        r, v        : np.ndarray(K, 3)
+        """
+        key = self.make_key(body_name, jds, plane, attractor=attractor)
+        data = self.load(key)
+        if data is None:
+            self._misses += 1
+            r, v = compute_fn(jds)
+            data = np.column_stack([jds, r, v])
+            self.store(key, data)
+        else:
+            self._hits += 1
+            logging.info("Ephemeris cache hit for %s", body_name)
+
+        return data[:, 1:4], data[:, 4:7]
+
+    def invalidate(self, body_name=None):
+        """
+            Removes the cached entries of one body, or of every body.
+        Returns
+        -------
+        int     : the number of entries removed
+        """
+        if not os.path.isdir(self._cache_dir):
+            return 0
+
+        count = 0
+        for fname in os.listdir(self._cache_dir):
+            if fname.endswith(".npy") and (body_name is None or fname.startswith(body_name + "_")):
+                stem = os.path.join(self._cache_dir, fname[:-4])
+                self._remove(stem + ".npy", stem + ".json")
+                count += 1
+
+        return count
+
+    @staticmethod
+    def _remove(*paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, new_state=True):
+        self._enabled = new_state
+
+    @property
+    def stats(self):
+        return dict(hits=self._hits, misses=self._misses)
+
+
+EPHEM_CACHE = EphemCache()
@@ -1,2 +1,251 @@
-# This file defines the InstancedPlanetVisual and InstancedTrack classes
+# This file defines the InstancedPlanetVisual and TrackCollectionVisual classes
+"""
+    Instanced visuals that draw every body of the system with a constant number of draw calls.
+    InstancedPlanetVisual draws all of the bodies from one shared unit sphere mesh, with the
+    position, orientation and radii of each body supplied as per-instance attributes and the
+    surface of each body taken from its own tile of a single texture atlas.
+    TrackCollectionVisual draws all of the orbit tracks as one set of line segments.
+"""
+import logging
+import numpy as np
+from PIL import Image
+from vispy.color import Color
+from vispy.gloo import Texture2D, VertexBuffer
+from vispy.visuals import InstancedMeshVisual, LineVisual
+from vispy.visuals.filters import Filter
+from vispy.visuals.shaders import Function, Varying
+from vispy.scene.visuals import create_visual_node
+from vispy.geometry.meshdata import MeshData
+from datastore import _oblate_sphere
 
+logging.basicConfig(filename="../logs/sns_instviz.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_ATLAS_TILE = 512        # width of each body's tile in the texture atlas (height is half of it)
+
+
+def build_tex_atlas(images, tile_width=DEF_ATLAS_TILE):
+    """
+        Packs the texture of each body into one RGBA image, in a grid of equal tiles.
+    Parameters
+    ----------
+    images      : list of PIL.Image     one equirectangular texture per body
+    tile_width  : int                   width of a tile in pixels
+
+    Returns
+    -------
+    atlas       : np.ndarray(H, W, 4)   uint8 RGBA image
+    rects       : np.ndarray(N, 4)      (u0, v0, du, dv) of each tile, in texture coordinates
+    """
+    tile_height = tile_width // 2
+    n_cols = int(np.ceil(np.sqrt(len(images) / 2))) * 2 or 1
+    n_rows = int(np.ceil(len(images) / n_cols)) or 1
+    atlas = np.zeros((n_rows * tile_height, n_cols * tile_width, 4), dtype=np.uint8)
+    rects = np.zeros((len(images), 4), dtype=np.float32)
+    for idx, image in enumerate(images):
+        row, col = divmod(idx, n_cols)
+        tile = image.convert('RGBA').resize((tile_width, tile_height), Image.LANCZOS)
+        atlas[row * tile_height:(row + 1) * tile_height,
+              col * tile_width:(col + 1) * tile_width] = np.asarray(tile)
+        # inset by half a texel so that linear filtering does not sample the neighbouring tiles
+        rects[idx] = ((col * tile_width + 0.5) / atlas.shape[1],
+                      (row * tile_height + 0.5) / atlas.shape[0],
+                      (tile_width - 1) / atlas.shape[1],
+                      (tile_height - 1) / atlas.shape[0])
+
+    return atlas, rects
+
+
+class AtlasTextureFilter(Filter):
+    """
+        Like vispy's TextureFilter, but each instance maps the shared texture coordinates
+        into its own rectangle (u0, v0, du, dv) of the atlas.
+    """
+    def __init__(self, atlas, texcoords, tex_rects, enabled=True):
+        vfunc = Function("""
+            void pass_coords() {
+                $v_texcoords = $tex_rect.xy + $texcoords * $tex_rect.zw;
+            }
+        """)
+        ffunc = Function("""
+            void apply_texture() {
+                if ($enabled == 1) {
+                    gl_FragColor *= texture2D($u_texture, $texcoords);
+                }
+            }
+        """)
+        self._texcoord_varying = Varying('v_texcoord', 'vec2')
+        vfunc['v_texcoords'] = self._texcoord_varying
+        ffunc['texcoords'] = self._texcoord_varying
+        self._texcoords_buffer = VertexBuffer(np.zeros((0, 2), dtype=np.float32))
+        vfunc['texcoords'] = self._texcoords_buffer
+        self._rects_buffer = VertexBuffer(np.zeros((1, 4), dtype=np.float32), divisor=1)
+        vfunc['tex_rect'] = self._rects_buffer
+        super().__init__(vcode=vfunc, vhook='pre', fcode=ffunc)
+
+        self._texcoords = texcoords
+        self.enabled = enabled
+        self.atlas = atlas
+        self.tex_rects = tex_rects
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        self._enabled = enabled
+        self.fshader['enabled'] = 1 if enabled else 0
+
+    @property
+    def atlas(self):
+        return self._atlas
+
+    @atlas.setter
+    def atlas(self, atlas):
+        """ An image, or a Texture2D already uploaded and shared with other visuals. """
+        self._atlas = atlas
+        self.fshader['u_texture'] = atlas if isinstance(atlas, Texture2D) else Texture2D(atlas, interpolation='linear')
+
+    @property
+    def tex_rects(self):
+        return self._tex_rects
+
+    @tex_rects.setter
+    def tex_rects(self, rects):
+        self._tex_rects = np.ascontiguousarray(rects, dtype=np.float32)
+        self._rects_buffer.set_data(self._tex_rects)
+
+    def _update_texcoords_buffer(self):
+        if not self._attached or self._visual is None:
+            return
+
+        # the mesh is drawn unindexed, so the coordinates are expanded per face (as in TextureFilter)
+        tc = self._texcoords[self._visual.mesh_data.get_faces()]
+        self._texcoords_buffer.set_data(tc, convert=True)
+
+    def _attach(self, visual):
+        super()._attach(visual)
+        self._update_texcoords_buffer()
+
+
+class InstancedPlanetVisual(InstancedMeshVisual):
+    """
+        Draws every body as an instance of one unit sphere.
+
+    Parameters
+    ----------
+    radii       : np.ndarray(N, 3)      R, R_mean and R_polar of each body
+    textures    : list of PIL.Image     the surface texture of each body, None for plain colors
+    rows        : int                   rows of the shared sphere mesh
+    cols        : int                   columns of the shared sphere mesh, default 2 * rows
+    tile_width  : int                   width of each texture in the atlas
+    atlas       : (atlas, rects)        optional, an atlas already built (or uploaded as a Texture2D)
+                                        by build_tex_atlas, used instead of textures so that the
+                                        visuals of several levels of detail share one atlas
+    shown       : np.ndarray(N,)        optional, which instances are drawn (default: all)
+    """
+    def __init__(self, radii, textures=None, rows=18, cols=None,
+                 tile_width=DEF_ATLAS_TILE, color=Color((1, 1, 1, 1)), atlas=None, shown=None, **kwargs):
+        if cols is None:
+            cols = rows * 2
+
+        self._radii = np.asarray(radii, dtype=np.float64).reshape((-1, 3))
+        self._count = len(self._radii)
+        self._shown = np.ones((self._count,), dtype=bool) if shown is None else np.asarray(shown, dtype=bool).copy()
+        self._rows = rows
+        self._rot = np.tile(np.eye(3), (self._count, 1, 1))
+        surf = _oblate_sphere(rows, cols, radius=(1.0, 1.0, 1.0))
+        mesh = MeshData(vertices=surf['verts'], faces=surf['faces'])
+        super(InstancedPlanetVisual, self).__init__(meshdata=mesh,
+                                                    color=color,
+                                                    instance_positions=np.zeros((self._count, 3)),
+                                                    instance_transforms=self._instance_xforms(),
+                                                    **kwargs)
+        self.set_gl_state(depth_test=True, cull_face=False)
+        self._tex_filter = None
+        if atlas is None and textures is not None:
+            atlas = build_tex_atlas(textures, tile_width)
+        if atlas is not None:
+            self._tex_filter = AtlasTextureFilter(atlas[0], surf['tcord'], atlas[1])
+            self.attach(self._tex_filter)
+        logging.info("InstancedPlanetVisual created with %s instances", self._count)
+
+    def _instance_xforms(self):
+        # equatorial radii on x and y, polar radius on z, zero scale hides an instance
+        scale = np.stack([self._radii[:, 1], self._radii[:, 1], self._radii[:, 2]], axis=1)
+        scale[~self._shown] = 0.0
+        return self._rot * scale[:, None, :]
+
+    def set_model_matrices(self, mats):
+        """
+            Sets the placement of every instance from the (N, 4, 4) model matrices computed for
+            the Planet visuals (vispy's row vector convention: rotation in [:3, :3],
+            translation in [3, :3]).
+        """
+        self._rot = np.swapaxes(mats[:, :3, :3], 1, 2)      # row vector -> column vector convention
+        self.instance_transforms = self._instance_xforms()
+        self.instance_positions = mats[:, 3, :3]
+
+    @property
+    def shown(self):
+        return self._shown
+
+    @shown.setter
+    def shown(self, mask):
+        self._shown = np.asarray(mask, dtype=bool).copy()
+        self.instance_transforms = self._instance_xforms()
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def rows(self):
+        return self._rows
+
+
+class TrackCollectionVisual(LineVisual):
+    """
+        Draws every orbit track as one LineVisual.  Each track is stored relative to its
+        parent body, and shifted by the position of that parent on each update.
+
+    Parameters
+    ----------
+    tracks  : list of np.ndarray(K_i, 3)    the points of each track, relative to its parent
+    colors  : np.ndarray(N, 4)              the RGBA color of each track
+    """
+    def __init__(self, tracks, colors, width=1, **kwargs):
+        # each track is closed by repeating its first point
+        closed = [np.vstack([trk, trk[:1]]) for trk in tracks]
+        self._counts = np.array([len(trk) for trk in closed], dtype=np.intp)
+        self._local = np.vstack(closed).astype(np.float64)
+        self._pos = np.empty(self._local.shape, dtype=np.float32)
+        connect = np.ones((len(self._local),), dtype=bool)
+        connect[np.cumsum(self._counts) - 1] = False       # no segment from the end of one track to the next
+        vert_colors = np.repeat(np.asarray(colors, dtype=np.float32), self._counts, axis=0)
+        super(TrackCollectionVisual, self).__init__(pos=self._local.astype(np.float32),
+                                                    color=vert_colors,
+                                                    connect=connect,
+                                                    width=width,
+                                                    **kwargs)
+
+    def set_offsets(self, offsets):
+        """
+            Moves each track to the position of its parent.
+        Parameters
+        ----------
+        offsets : np.ndarray(N, 3)      the position of the parent of each track
+        """
+        np.add(self._local, np.repeat(offsets, self._counts, axis=0), out=self._pos, casting='unsafe')
+        self.set_data(pos=self._pos)
+
+    @property
+    def count(self):
+        return len(self._counts)
+
+
+InstancedPlanets = create_visual_node(InstancedPlanetVisual)
+TrackCollection = create_visual_node(TrackCollectionVisual)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+    Headless batch propagation of the model.  A SimSystem is loaded for the chosen bodies
+    (no visuals are constructed), propagated over a range of epochs at a fixed step, and the
+    state of every body at every epoch is written to disk, one chunk of epochs at a time.
+    Each chunk is computed in a single vectorized call, so memory use is bounded by the chunk
+    size rather than by the length of the run.
+
+        python sim_batch.py --start 2024-01-01 --days 365 --step 60 --out ../output/year
+        python sim_batch.py --bodies Sun Earth Moon --start 2460310.5 --stop 2460340.5 --format csv
+
+    Output, for each chunk of epochs:
+        npz     : <out>_<chunk>.npz with arrays 'jd' (K,), 'names' (N,), 'parent_idx' (N,),
+                  'r' (K, N, 3), 'v' (K, N, 3) and 'rot' (K, N, 3)
+        csv     : <out>_<chunk>.csv with one row per (epoch, body):
+                  jd, body, x, y, z, vx, vy, vz, ra, dec, w
+    Positions and velocities are in the distance unit of the model (km, km/s), relative to
+    the parent body unless --absolute is given.  RA, DEC and W are in degrees.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+from astropy.time import Time
+from sim_kepler import SEC_PER_DAY, absolute_positions
+
+logging.basicConfig(filename="../logs/sns_batch.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_STEP_SEC = 60.0
+DEF_CHUNK = 10080               # epochs per chunk (one week of 1-minute steps)
+DEF_OUT = "../output/sns_batch"
+CSV_HEADER = "jd,body,x,y,z,vx,vy,vz,ra,dec,w"
+CSV_WARN_ROWS = 2_000_000       # about ten seconds of text formatting, npz is far faster beyond it
+
+
+def parse_epoch(value):
+    """ Accepts a TDB Julian date or any string astropy.time.Time understands. """
+    try:
+        return Time(float(value), format='jd', scale='tdb')
+    except ValueError:
+        return Time(value, scale='tdb')
+
+
+class BatchPropagator:
+    """
+        Propagates a SimSystem over a range of epochs and streams the states to chunk files.
+    Parameters
+    ----------
+    model       : SimSystem         the loaded model
+    jd_start    : float             first epoch (TDB Julian date)
+    jd_stop     : float             last epoch (TDB Julian date), included if it falls on a step
+    step        : float             seconds between epochs
+    chunk       : int               epochs per chunk
+    """
+    def __init__(self, model, jd_start, jd_stop, step=DEF_STEP_SEC, chunk=DEF_CHUNK, absolute=False):
+        self._model = model
+        self._jd_start = jd_start
+        self._step_days = step / SEC_PER_DAY
+        self._n_epochs = int(np.floor((jd_stop - jd_start) / self._step_days + 1e-9)) + 1
+        self._chunk = max(1, int(chunk))
+        self._absolute = absolute
+        self._names = np.array(model.body_names)
+        self._parent_idx = model.get_field_columns(('parent_idx',))['parent_idx']
+        self._csv_fmt = None
+        self._buff = np.zeros((min(self._chunk, self._n_epochs), model.num_bodies, 3, 3),
+                              dtype=np.float64)
+
+    def chunks(self):
+        """
+            Yields (jds, states) for each chunk, states being a view of one reused buffer.
+        """
+        for c0 in range(0, self._n_epochs, self._chunk):
+            k = min(self._chunk, self._n_epochs - c0)
+            jds = self._jd_start + (c0 + np.arange(k)) * self._step_days
+            states = self._model.propagate_epochs(jds, out=self._buff[:k])
+            if self._absolute:
+                states[:, :, 0] = absolute_positions(states[:, :, 0], self._parent_idx)
+            yield jds, states
+
+    def write_npz(self, jds, states, fname, compress=False):
+        _save = np.savez_compressed if compress else np.savez
+        _save(fname,
+              jd=jds,
+              names=self._names,
+              parent_idx=self._parent_idx,
+              r=states[:, :, 0],
+              v=states[:, :, 1],
+              rot=states[:, :, 2],
+              )
+
+    def write_csv(self, jds, states, fname):
+        """
+            Writes the chunk as text.  The body names are folded into one format string that
+            covers all the bodies of an epoch, so each epoch is formatted by a single operation
+            on a (K, N * 10) block of numbers rather than value by value.
+        """
+        k, n = states.shape[:2]
+        if self._csv_fmt is None:
+            self._csv_fmt = ''.join([f'%.9f,{name},' + ','.join(['%.9g'] * 9) + '\n'
+                                     for name in self._names])
+        block = np.empty((k, n, 10), dtype=np.float64)
+        block[:, :, 0] = jds[:, None]
+        block[:, :, 1:] = states.reshape((k, n, 9))
+        with open(fname, 'w') as f:
+            f.write(CSV_HEADER + '\n')
+            f.writelines([self._csv_fmt % tuple(row) for row in block.reshape((k, n * 10)).tolist()])
+
+    def run(self, out=DEF_OUT, fmt='npz', compress=False):
+        """
+            Propagates the whole range, writing one file per chunk.
+
+        Returns
+        -------
+        list of str     : the files written
+        """
+        out_dir = os.path.dirname(out)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        fnames = []
+        if fmt == 'csv' and self._n_epochs * len(self._names) > CSV_WARN_ROWS:
+            print(f'>>>WARNING: {self._n_epochs * len(self._names):,} CSV rows will be slow to write, '
+                  f'use --format npz for long runs...')
+        t0 = time.perf_counter()
+        for c_idx, (jds, states) in enumerate(self.chunks()):
+            fname = f'{out}_{c_idx:05d}.{fmt}'
+            if fmt == 'csv':
+                self.write_csv(jds, states, fname)
+            else:
+                self.write_npz(jds, states, fname, compress)
+            fnames.append(fname)
+            print(f'Chunk {c_idx}: {len(jds)} epochs written to {fname}...')
+
+        dt = time.perf_counter() - t0
+        print(f'{self._n_epochs} epochs of {len(self._names)} bodies propagated in {dt:.4f} seconds '
+              f'({self._n_epochs * len(self._names) / dt:,.0f} body-states/s)')
+
+        return fnames
+
+    @property
+    def n_epochs(self):
+        return self._n_epochs
+
+    @property
+    def names(self):
+        return tuple(self._names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless batch propagation of the SNS model")
+    parser.add_argument('--bodies', nargs='*', default=None,
+                        help="names of the bodies to load (default: all)")
+    parser.add_argument('--start', default=None,
+                        help="first epoch, TDB Julian date or ISO date (default: the model epoch)")
+    stop = parser.add_mutually_exclusive_group()
+    stop.add_argument('--stop', default=None, help="last epoch, TDB Julian date or ISO date")
+    stop.add_argument('--days', type=float, default=1.0, help="length of the run in days")
+    parser.add_argument('--step', type=float, default=DEF_STEP_SEC, help="seconds between epochs")
+    parser.add_argument('--chunk', type=int, default=DEF_CHUNK, help="epochs per output file")
+    parser.add_argument('--format', choices=('npz', 'csv'), default='npz',
+                        help="npz (default) is binary and fast; csv is formatted as text, about "
+                             "200k rows (epochs x bodies) per second, so use npz for long runs")
+    parser.add_argument('--compress', action='store_true', help="write compressed npz files")
+    parser.add_argument('--absolute', action='store_true',
+                        help="positions relative to the system primary instead of the parent body")
+    parser.add_argument('--out', default=DEF_OUT, help="path and prefix of the output files")
+    args = parser.parse_args(argv)
+
+    from simsystem import SimSystem
+
+    model = SimSystem(body_names=args.bodies)
+    start = parse_epoch(args.start) if args.start else model.epoch
+    jd_start = start.tdb.jd
+    jd_stop = parse_epoch(args.stop).tdb.jd if args.stop else jd_start + args.days
+    if jd_stop < jd_start:
+        parser.error("the last epoch precedes the first")
+
+    batch = BatchPropagator(model, jd_start, jd_stop,
+                            step=args.step,
+                            chunk=args.chunk,
+                            absolute=args.absolute)
+
+    return batch.run(out=args.out, fmt=args.format, compress=args.compress)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
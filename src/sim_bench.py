@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+    Headless benchmarks of the model.  Nothing here needs Qt, vispy or a display.
+
+    The SimSystem benchmark builds the model for the real bodies of the system, then times
+    its construction, load_from_names(), a single update_state() and sustained runs of ticks
+    at several time warp factors.  A synthetic population of small bodies (moons of the
+    planets and asteroids of the primary) can be propagated with each tick, to see how the
+    model scales with the number of bodies.  With --synthetic-only the SimSystem is skipped,
+    and only the synthetic population is propagated (this mode does not need poliastro).
+    Throughput is reported as body-updates per second.
+
+        python sim_bench.py --moons 200 --asteroids 5000 --ticks 600 --warps 1 3600 86400
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from sim_kepler import KeplerPropagator, SEC_PER_DAY
+from sim_profiler import FrameProfiler
+
+logging.basicConfig(filename="../logs/sns_bench.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_TICKS = 300
+DEF_TICK_SEC = 1 / 60                   # real seconds per tick, the epoch advances by warp * DEF_TICK_SEC
+DEF_WARPS = (1.0, 3600.0, 86400.0)
+DEF_EPOCH_JD = 2451545.0                # J2000 TDB, used by --synthetic-only
+DEF_SEED = 1234
+
+# gravitational parameters (km^3 / s^2) of the attractors of the synthetic population,
+# used when the SimSystem is not loaded
+MU_KM3S2 = {'Sun': 1.32712440018e+11,
+            'Earth': 3.986004418e+05,
+            'Mars': 4.282837e+04,
+            'Jupiter': 1.26686534e+08,
+            'Saturn': 3.7931187e+07,
+            'Uranus': 5.793939e+06,
+            'Neptune': 6.836529e+06,
+            }
+MOON_HOSTS = ('Earth', 'Mars', 'Jupiter', 'Saturn', 'Uranus', 'Neptune')
+
+
+def synthetic_elements(n_moons=0, n_asteroids=0, hosts=MOON_HOSTS, mu=None, seed=DEF_SEED):
+    """
+        Generates random, bound orbits for a population of small bodies.  Asteroids orbit
+        the Sun in the main belt, moons are spread evenly among the hosts.
+    Parameters
+    ----------
+    n_moons     : int               number of moons
+    n_asteroids : int               number of asteroids
+    hosts       : tuple of str      the bodies that the moons orbit
+    mu          : dict              gravitational parameter (km^3 / s^2) of each attractor,
+                                    defaults to MU_KM3S2
+    seed        : int               seed of the random generator
+
+    Returns
+    -------
+    elems       : dict              'a', 'ecc', 'inc', 'raan', 'argp', 'nu', 'mu' arrays and
+                                    'parent', the attractor of each body
+    """
+    if mu is None:
+        mu = MU_KM3S2
+
+    rng = np.random.default_rng(seed)
+    n = n_moons + n_asteroids
+    parent = np.array([hosts[i % len(hosts)] for i in range(n_moons)] + ['Sun'] * n_asteroids,
+                      dtype=object)
+    a = np.concatenate([rng.uniform(2.0e+05, 5.0e+06, n_moons),
+                        rng.uniform(2.1, 3.3, n_asteroids) * 1.495978707e+08])
+    ecc = np.concatenate([rng.uniform(0.0, 0.1, n_moons),
+                          rng.uniform(0.0, 0.3, n_asteroids)])
+    inc = np.concatenate([rng.uniform(0.0, 0.1, n_moons),
+                          rng.uniform(0.0, 0.5, n_asteroids)])
+
+    return dict(a=a,
+                ecc=ecc,
+                inc=inc,
+                raan=rng.uniform(0.0, 2 * np.pi, n),
+                argp=rng.uniform(0.0, 2 * np.pi, n),
+                nu=rng.uniform(0.0, 2 * np.pi, n),
+                mu=np.array([mu[p] for p in parent], dtype=np.float64),
+                parent=parent,
+                )
+
+
+class SyntheticPopulation:
+    """
+        A population of small bodies propagated by one KeplerPropagator into its own
+        (N, 3, 3) state array, laid out like the state array of the SimSystem.
+    """
+    def __init__(self, elems, epoch):
+        self._parent = elems['parent']
+        self._state_arr = np.zeros((len(self._parent), 3, 3), dtype=np.float64)
+        self._propagator = KeplerPropagator()
+        self._propagator.set_elements(elems['a'], elems['ecc'], elems['inc'], elems['raan'],
+                                      elems['argp'], elems['nu'], elems['mu'], epoch=epoch)
+
+    def update_state(self, epoch):
+        self._propagator.propagate(epoch, out=self._state_arr)
+
+    @property
+    def count(self):
+        return self._propagator.count
+
+    @property
+    def state_array(self):
+        return self._state_arr
+
+    @property
+    def parent(self):
+        return self._parent
+
+
+class SimBenchmark:
+    """
+        Times the model, and reports the results as a dict of plain numbers.
+    Parameters
+    ----------
+    body_names      : list of str   the real bodies to load, all of them if None
+    n_moons         : int           synthetic moons
+    n_asteroids     : int           synthetic asteroids
+    synthetic_only  : bool          skip the SimSystem, propagate only the synthetic population
+    """
+    def __init__(self, body_names=None, n_moons=0, n_asteroids=0, synthetic_only=False,
+                 seed=DEF_SEED):
+        self._body_names = body_names
+        self._n_moons = n_moons
+        self._n_asteroids = n_asteroids
+        self._synthetic_only = synthetic_only
+        self._seed = seed
+        self._model = None
+        self._population = None
+        self._epoch0 = None
+        self._profiler = FrameProfiler()
+        self._results = {}
+
+    def setup(self):
+        """ Builds the model and the synthetic population, timing each step. """
+        mu = dict(MU_KM3S2)
+        if not self._synthetic_only:
+            from simsystem import SimSystem     # needs poliastro
+
+            t0 = time.perf_counter()
+            self._model = SimSystem(body_names=self._body_names)
+            t1 = time.perf_counter()
+            self._model.load_from_names()
+            t2 = time.perf_counter()
+            self._results.update(construct_sec=t1 - t0, load_sec=t2 - t1)
+            self._epoch0 = self._model.epoch
+            mu.update({sb.name: sb.body.k.to_value('km3 / s2') for sb in self._model.data.values()})
+            hosts = tuple([h for h in MOON_HOSTS if h in self._model.body_names]) or ('Sun',)
+        else:
+            self._epoch0 = DEF_EPOCH_JD
+            hosts = MOON_HOSTS
+
+        if self._n_moons + self._n_asteroids:
+            t0 = time.perf_counter()
+            elems = synthetic_elements(self._n_moons, self._n_asteroids, hosts=hosts, mu=mu,
+                                       seed=self._seed)
+            self._population = SyntheticPopulation(elems, self._epoch0)
+            self._results.update(synthetic_setup_sec=time.perf_counter() - t0)
+
+        self._results.update(body_count=self.body_count)
+
+    def _epochs(self, warp, ticks):
+        """ The epochs of each tick, built before the timing starts. """
+        offsets = np.arange(1, ticks + 1) * warp * DEF_TICK_SEC
+        if self._model is None:
+            return self._epoch0 + offsets / SEC_PER_DAY
+
+        import astropy.units as u
+        return self._epoch0 + offsets * u.s
+
+    def _tick(self, epoch):
+        if self._model is not None:
+            self._model.update_state(epoch)
+        if self._population is not None:
+            self._population.update_state(epoch)
+
+    def run_single(self):
+        """ Times one update of the whole system, after a warm-up update. """
+        epoch = self._epochs(1.0, 2)
+        self._tick(epoch[0])
+        t0 = time.perf_counter()
+        self._tick(epoch[1])
+        dt = time.perf_counter() - t0
+        self._results.update(single_update_sec=dt,
+                             single_body_updates_per_sec=self.body_count / dt)
+
+    def run_sustained(self, warps=DEF_WARPS, ticks=DEF_TICKS):
+        """ Times a run of ticks at each time warp factor. """
+        res = {}
+        for warp in warps:
+            epochs = self._epochs(warp, ticks)
+            span = f'tick_x{warp:g}'
+            t0 = time.perf_counter()
+            for i in range(ticks):
+                with self._profiler.span(span):
+                    self._tick(epochs[i])
+            dt = time.perf_counter() - t0
+            res[f'{warp:g}'] = dict(ticks=ticks,
+                                    total_sec=dt,
+                                    body_updates_per_sec=self.body_count * ticks / dt,
+                                    **self._profiler.summary()[span],
+                                    )
+        self._results.update(sustained=res)
+
+    def run(self, warps=DEF_WARPS, ticks=DEF_TICKS):
+        self.setup()
+        self.run_single()
+        self.run_sustained(warps, ticks)
+
+        return self._results
+
+    def report(self):
+        res = self._results
+        lines = [f'bodies: {res.get("body_count", 0)}  '
+                 f'(model: {self._model.num_bodies if self._model else 0}, '
+                 f'synthetic: {self._population.count if self._population else 0})']
+        if 'construct_sec' in res:
+            lines.append(f'SimSystem construction:  {res["construct_sec"]:.4f} s')
+            lines.append(f'load_from_names:         {res["load_sec"]:.4f} s')
+        if 'synthetic_setup_sec' in res:
+            lines.append(f'synthetic setup:         {res["synthetic_setup_sec"]:.4f} s')
+        if 'single_update_sec' in res:
+            lines.append(f'single update:           {res["single_update_sec"] * 1e3:.3f} ms  '
+                         f'({res["single_body_updates_per_sec"]:,.0f} body-updates/s)')
+        for warp, stats in res.get('sustained', {}).items():
+            lines.append(f'warp x{warp:<10}{stats["ticks"]:>6} ticks  '
+                         f'mean {stats["mean"]:.3f} ms  p95 {stats["p95"]:.3f} ms  '
+                         f'p99 {stats["p99"]:.3f} ms  ({stats["body_updates_per_sec"]:,.0f} body-updates/s)')
+
+        return '\n'.join(lines)
+
+    @property
+    def body_count(self):
+        return ((self._model.num_bodies if self._model is not None else 0) +
+                (self._population.count if self._population is not None else 0))
+
+    @property
+    def results(self):
+        return self._results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmarks of the SNS model")
+    parser.add_argument('--bodies', nargs='*', default=None,
+                        help="names of the real bodies to load (default: all)")
+    parser.add_argument('--moons', type=int, default=0, help="number of synthetic moons")
+    parser.add_argument('--asteroids', type=int, default=0, help="number of synthetic asteroids")
+    parser.add_argument('--ticks', type=int, default=DEF_TICKS, help="ticks per time warp factor")
+    parser.add_argument('--warps', type=float, nargs='+', default=list(DEF_WARPS),
+                        help="time warp factors (simulated seconds per real second)")
+    parser.add_argument('--synthetic-only', action='store_true',
+                        help="skip the SimSystem and propagate only the synthetic bodies")
+    parser.add_argument('--seed', type=int, default=DEF_SEED)
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.synthetic_only and not (args.moons + args.asteroids):
+        parser.error("--synthetic-only needs --moons and/or --asteroids")
+
+    bench = SimBenchmark(body_names=args.bodies,
+                         n_moons=args.moons,
+                         n_asteroids=args.asteroids,
+                         synthetic_only=args.synthetic_only,
+                         seed=args.seed)
+    results = bench.run(warps=args.warps, ticks=args.ticks)
+    print(bench.report())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,16 +7,23 @@ logging.basicConfig(filename="../logs/sns_simbod.log",
                     )
 
 from sim_object import *
-from vispy.color import Color
+try:
+    from vispy.color import Color
+except ImportError:         # headless use of the model, body_color and track_color are unavailable
+    Color = None
 from poliastro.twobody.orbit.scalar import Orbit
+from astropy.coordinates import CartesianRepresentation, CartesianDifferential
+from sim_ephem import (ChebyshevEphem, DEF_CHEB_SPAN, DEF_CHEB_DEGREE,
+                       DEF_CHEB_SEGS_PER_ORBIT, DEF_CHEB_MAX_SEG)
+from ephem_cache import EPHEM_CACHE
+from sim_kepler import epoch_td, jd_pair
+from sim_tracks import TRACK_CACHE
 
 MIN_FOV = 1 / 3600      # I think this would be arc-seconds
 
 
 def toTD(epoch=None):
-    d = (epoch - J2000_TDB).jd
-    T = d / 36525
-    return dict(T=T, d=d)
+    return epoch_td(epoch)
 
 
 class SimBody(SimObject):
@@ -29,6 +36,8 @@ class SimBody(SimObject):
         and the angular displacement over time. SimObjects effectively have a
         predetermined state over time and move strictly under gravitational forces.
     """
+    ephem_cache = EPHEM_CACHE
+
     def __init__(self, body_data=None, vizz_data=None):
         super(SimBody, self).__init__()
         self._body_data     = body_data
@@ -36,7 +45,12 @@ class SimBody(SimObject):
         self._name          = self._body_data['body_name']
         self._body          = self._body_data['body_obj']
         self._rot_func      = self._body_data['rot_func']
+        self._rot_model     = self._body_data.get('rot_model')
         self._o_period      = self._body_data['o_period']
+        self._orbit_stale   = False
+        self._cheby         = None
+        self._pos_source    = None          # the system that resolves the absolute positions
+        self._sys_idx       = None
 
         self.set_dimensions()
         self.set_ephem(epoch=self._epoch)
@@ -73,11 +87,12 @@ class SimBody(SimObject):
             self._end_epoch += self._periods * self._spacing
 
         if self._orbit is None:                                     # first time through
-            self._ephem = Ephem.from_body(self._body,
-                                          epochs=t_range,
-                                          attractor=self.body.parent,
-                                          plane=self._plane,
-                                          )
+            _r, _v = self._fetch_rv(t_range.tdb.jd)
+            _coords = CartesianRepresentation(_r.T * self._dist_unit,
+                                              differentials=CartesianDifferential(
+                                                  _v.T * self._dist_unit / u.s),
+                                              )
+            self._ephem = Ephem(_coords, t_range, self._plane)
         elif self._orbit != 0:                                      # this body has a parent
             self._ephem = Ephem.from_orbit(orbit=self._orbit,
                                            epochs=t_range,
@@ -87,6 +102,57 @@ class SimBody(SimObject):
         logging.info("EPHEM for %s: %s", self.name, str(self._ephem))
         print(f'EPHEM for {self.name:^9}: {self._ephem}')
 
+    def set_cheby_table(self, epoch=None, span=None):
+        """
+            Generates the table of Chebyshev segments used to evaluate the ephemeris of this body.
+            The body is sampled once, at every node of every segment, then fitted.  Only the
+            bodies without an Orbit use the table (the bodies with one are propagated from their
+            elements, by the system's KeplerPropagator), so it is built when they first need it.
+
+        Parameters
+        ----------
+        epoch           :   Time            The start of the table
+        span            :   Quantity        The time covered by the table
+        """
+        if epoch is None:
+            epoch = self._epoch
+        if span is None:
+            span = self._body_data.get('cheb_span', DEF_CHEB_SPAN * u.d)
+
+        seg_days = min(self._o_period.to_value(u.d) / DEF_CHEB_SEGS_PER_ORBIT, DEF_CHEB_MAX_SEG)
+        self._cheby = ChebyshevEphem.from_function(self._sample_body,
+                                                   jd_start=epoch.tdb.jd,
+                                                   span=span.to_value(u.d),
+                                                   seg_days=seg_days,
+                                                   degree=self._body_data.get('cheb_degree', DEF_CHEB_DEGREE),
+                                                   )
+        logging.info("CHEBYSHEV TABLE for %s: %s segments", self.name, self._cheby.n_segments)
+
+    def _sample_body(self, jds):
+        return self._fetch_rv(jds)[0]
+
+    def _fetch_rv(self, jds):
+        """
+            Samples the position and velocity of this body at the given TDB Julian dates,
+            using the on-disk ephemeris cache when it holds a matching entry.
+
+        Returns
+        -------
+        r, v            :   np.ndarray(K, 3)    positions and velocities in dist_unit and dist_unit / s
+        """
+        return self.ephem_cache.fetch_rv(self._name, jds, self._plane, self._query_rv,
+                                         attractor=getattr(self.body.parent, 'name', None),
+                                         )
+
+    def _query_rv(self, jds):
+        ephem = Ephem.from_body(self._body,
+                                epochs=Time(jds, format='jd', scale='tdb'),
+                                attractor=self.body.parent,
+                                plane=self._plane,
+                                )
+        _r, _v = ephem.rv()
+        return _r.to_value(self._dist_unit), _v.to_value(self._dist_unit / u.s)
+
     def set_orbit(self, ephem=None):
         if ephem is None:
             ephem = self._ephem
@@ -100,7 +166,8 @@ class SimBody(SimObject):
             logging.info(">>> COMPUTING ORBIT: %s",
                          str(self._orbit))
             if (self._trajectory is None) or (self._RESAMPLE is True):
-                self._trajectory = self._orbit.sample(720)
+                # sampled by curvature and shared through the cache, only rebuilt when the elements change
+                self._trajectory = TRACK_CACHE.track_for_orbit(self._orbit, self._dist_unit)
                 self._RESAMPLE = False
 
         elif self._body.parent is None:
@@ -108,12 +175,14 @@ class SimBody(SimObject):
             logging.info(">>> NO PARENT BODY, Orbit set to: %s",
                          str(self._orbit))
 
-    def update_state(self, epoch=None):
+    def update_state(self, epoch=None, td=None):
         """
 
         Parameters
         ----------
         epoch           :   Time            The epoch to which the state is to be set
+        td              :   dict            epoch_td() of the epoch, when the caller has already
+                                            computed it for the whole system
 
         Returns
         -------
@@ -123,18 +192,22 @@ class SimBody(SimObject):
         if epoch:
             if type(epoch) == Time:
                 self._epoch = epoch
+            if td is None:
+                td = epoch_td(self._epoch)
 
             if type(self._orbit) == Orbit:
-                new_orbit = self._orbit.propagate(self._epoch)
-                new_state = np.array([new_orbit.r.to(self._dist_unit).value,
-                                      new_orbit.v.to(self._dist_unit / u.s).value,
-                                      self._rot_func(**toTD(self._epoch)),
+                new_orbit = self._sync_orbit(force=True)
+                new_state = np.array([new_orbit.r.to_value(self._dist_unit),
+                                      new_orbit.v.to_value(self._vel_unit),
+                                      self._rot_func(**td),
                                       ])
-                self._orbit = new_orbit
             else:
-                new_state = np.array([self._ephem.rv(self._epoch)[0].to(self._dist_unit).value,
-                                      self._ephem.rv(self._epoch)[1].to(self._dist_unit / u.s).value,
-                                      self._rot_func(**toTD(self._epoch)),
+                _jd = jd_pair(self._epoch)
+                self._cover_cheby(_jd[0] + _jd[1], _jd[0] + _jd[1])
+                _r, _v = self._cheby.rv(_jd)
+                new_state = np.array([_r,
+                                      _v,
+                                      self._rot_func(**td),
                                       ])
 
         # self.update_pos(self._state.[0])
@@ -145,13 +218,102 @@ class SimBody(SimObject):
                      np.linalg.norm(new_state[1]),
                      new_state[2],
                      )
-        self._state = new_state
+        self._state[:] = new_state
         # return self._state
 
+    def update_rotation(self, epoch=None, td=None):
+        """
+            Sets the epoch and rotational elements only.  This is used when the position
+            and velocity rows of the state have already been written by a system propagator.
+            The Orbit object is brought up to date lazily, when the elements are requested.
+
+        Parameters
+        ----------
+        epoch           :   Time            The epoch to which the state is to be set
+        td              :   dict            epoch_td() of the epoch, if already computed
+        """
+        self.set_epoch(epoch)
+        self._state[2] = self._rot_func(**(td if td is not None else epoch_td(self._epoch)))
+
+    def rv_at_jds(self, jds):
+        """
+            Evaluates the Chebyshev table of this body at a series of epochs, without changing
+            the state.  The table is regenerated if it does not cover all of them.
+
+        Parameters
+        ----------
+        jds             :   np.ndarray(K,)      TDB Julian dates
+
+        Returns
+        -------
+        r, v            :   np.ndarray(K, 3)    positions and velocities in dist_unit and dist_unit / s
+        """
+        jds = np.atleast_1d(jds)
+        self._cover_cheby(jds.min(), jds.max())
+
+        return self._cheby.rv(jds)
+
+    def _cover_cheby(self, jd_lo, jd_hi):
+        """
+            Makes the Chebyshev table cover [jd_lo, jd_hi].  The table is built on first use and
+            then extended segment by segment, so that a run of consecutive requests (the chunks of
+            a batch run) only samples the new segments.  A new table is started instead when the
+            range is more than a table span away from the current one.
+        """
+        if self._cheby is not None and self._cheby.covers(jd_lo) and self._cheby.covers(jd_hi):
+            return
+
+        span = self._body_data.get('cheb_span', DEF_CHEB_SPAN * u.d).to_value(u.d)
+        if self._cheby is None or max(jd_lo - self._cheby.jd_end, self._cheby.jd_start - jd_hi) > span:
+            self.set_cheby_table(epoch=Time(jd_lo, format='jd', scale='tdb'),
+                                 span=max(span, jd_hi - jd_lo + 1) * u.d)
+        else:
+            self._cheby = self._cheby.extend(self._sample_body, jd_lo, jd_hi)
+
+    def rot_at_jds(self, jds):
+        """
+        Parameters
+        ----------
+        jds             :   np.ndarray(K,)      TDB Julian dates
+
+        Returns
+        -------
+        np.ndarray(K, 3)    :   the RA, DEC and W rotational elements at each epoch (deg)
+        """
+        return np.stack(np.broadcast_arrays(*self._rot_func(**epoch_td(np.atleast_1d(jds)))), axis=-1)
+
+    def set_epoch(self, epoch=None):
+        if type(epoch) == Time:
+            self._epoch = epoch
+        self._orbit_stale = True
+
+    def _sync_orbit(self, force=False):
+        if (self._orbit_stale or force) and type(self._orbit) == Orbit:
+            self._orbit = self._orbit.propagate(self._epoch)
+            self._orbit_stale = False
+
+        return self._orbit
+
     @property
     def body(self):
         return self._body
 
+    @property
+    def orbit(self):
+        return self._sync_orbit()
+
+    @property
+    def rot_model(self):
+        return self._rot_model
+
+    @property
+    def has_orbit(self):
+        return type(self._orbit) == Orbit
+
+    @property
+    def cheby(self):
+        return self._cheby
+
     @property
     def radius(self):
         return self._rad_set
@@ -213,6 +375,16 @@ class SimBody(SimObject):
     def pos(self):
         return self.pos2primary
 
+    @property
+    def pos_arr(self):
+        """ position relative to the system primary, as floats in dist_unit """
+        if self._pos_source is not None:
+            return self._pos_source.abs_positions[self._sys_idx]
+        if self._sim_parent is None:
+            return np.zeros((3,), dtype=np.float64)
+
+        return self._state[0] + self._sim_parent.pos_arr
+
     @property
     def RA(self):
         return self._state[2, 0]
@@ -225,13 +397,22 @@ class SimBody(SimObject):
     def W(self):
         return self._state[2, 2]
 
+    def bind_positions(self, source=None, sys_idx=None):
+        """
+            Takes the position relative to the primary from a row of the absolute positions
+            resolved once per epoch by the system, instead of walking up the parents.
+
+        Parameters
+        ----------
+        source          :   SimObjectDict       the system, or None to unbind
+        sys_idx         :   int                 the row of this body in the system
+        """
+        self._pos_source = source
+        self._sys_idx = sys_idx
+
     @property                   # this returns the position of a body plus the position of the primary
     def pos2primary(self):
-        _pos = self._state[0] * self._dist_unit
-        if self._sim_parent is None:
-            return np.zeros((3,), dtype=np.float64) * self._dist_unit
-        else:
-            return _pos + self._sim_parent.pos2primary
+        return u.Quantity(self.pos_arr, self._dist_unit)
 
     @property
     def attr(self):
@@ -247,7 +428,7 @@ class SimBody(SimObject):
         if self._is_primary:
             res = np.zeros((6,), dtype=np.float64)
         else:
-            res = list(self._orbit.classical())
+            res = list(self._sync_orbit().classical())
 
         return res
 
@@ -256,13 +437,13 @@ class SimBody(SimObject):
         if self._rank == 0:
             res = np.zeros((3, 3), dtype=np.float64)
         else:
-            res = list(self._orbit.pqw())
+            res = list(self._sync_orbit().pqw())
 
         return res
 
     @property
     def elem_rv(self):
-        res = list(self._orbit.rv())
+        res = list(self._sync_orbit().rv())
 
         return res
 
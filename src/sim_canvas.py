@@ -7,6 +7,7 @@ from vispy import app, scene
 from vispy.color import Color
 from vispy.scene.cameras import BaseCamera
 from sim_camset import CameraSet
+from sim_profiler import PROFILER
 
 logging.basicConfig(filename="logs/mainsimwin.log",
                     level=logging.ERROR,
@@ -158,6 +159,11 @@ class MainSimCanvas(scene.SceneCanvas):
         except AttributeError:
             print("Key Error...")
 
+    def on_draw(self, event):
+        with PROFILER.span('draw'):
+            super(MainSimCanvas, self).on_draw(event)
+        PROFILER.mark_frame('frame')
+
     def draw_scene(self):
         self.update()
         # self.update_signal.emit('')
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the SimClock class, which holds the simulation epoch as a split
+    two-float TDB Julian date (jd1 holding whole days, jd2 the fraction of a day) along with
+    the time warp factor and direction.  Each tick advances the epoch by the wall clock time
+    elapsed since the previous tick, multiplied by the signed warp, and emits the new epoch
+    as plain floats.  Astropy Time objects are only built on request, at the API boundary.
+"""
+import time
+import logging
+import numpy as np
+import psygnal
+from sim_kepler import jd_pair, SEC_PER_DAY
+
+logging.basicConfig(filename="../logs/sns_clock.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_CLOCK_EPOCH = (2451545.0, 0.0)      # J2000 TDB
+MAX_TICK_SEC = 0.25                     # longest wall clock step taken by one tick (e.g. after a stall)
+
+
+def split_jd(jd1, jd2=0.0):
+    """
+        Renormalizes a two-float Julian date so that jd1 holds whole days and
+        0 <= jd2 < 1 holds the fraction of a day.
+    """
+    total1 = np.floor(jd1)
+    frac = (jd1 - total1) + jd2
+    whole = np.floor(frac)
+
+    return float(total1 + whole), float(frac - whole)
+
+
+class SimClock:
+    """
+        The simulation clock.
+
+    Parameters
+    ----------
+    epoch       : Time, (jd1, jd2) or jd    the reference epoch, where the clock starts (TDB)
+    warp        : float                     simulated seconds per wall clock second, >= 0
+    direction   : int                       +1 to run forward in time, -1 to run backward
+    """
+    ticked = psygnal.Signal(float, float)   # emits (jd1, jd2) after each change of the epoch
+
+    def __init__(self, epoch=DEF_CLOCK_EPOCH, warp=1.0, direction=1):
+        self._ref = split_jd(*jd_pair(epoch))
+        self._jd1, self._jd2 = self._ref
+        self._warp = abs(float(warp))
+        self._direction = 1 if direction >= 0 else -1
+        self._paused = True
+        self._last_wall = None
+
+    def tick(self):
+        """
+            Advances the epoch by the wall clock time since the previous tick times the signed warp.
+            The first tick after a resume only starts the wall clock.
+        """
+        now = time.perf_counter()
+        if self._paused or self._last_wall is None:
+            self._last_wall = now
+            return
+
+        wall_dt = min(now - self._last_wall, MAX_TICK_SEC)
+        self._last_wall = now
+        self.advance(self._direction * self._warp * wall_dt)
+
+    def advance(self, seconds):
+        """ Moves the epoch by the given number of simulated seconds, ignoring warp and pause. """
+        if seconds:
+            self._jd1, self._jd2 = split_jd(self._jd1, self._jd2 + seconds / SEC_PER_DAY)
+            self.ticked.emit(self._jd1, self._jd2)
+
+    def set_epoch(self, epoch):
+        self._jd1, self._jd2 = split_jd(*jd_pair(epoch))
+        self.ticked.emit(self._jd1, self._jd2)
+
+    def reset(self, epoch=None):
+        """ Returns to the reference epoch (or makes the given epoch the new reference), with a warp of 1. """
+        if epoch is not None:
+            self._ref = split_jd(*jd_pair(epoch))
+        self._warp = 1.0
+        self._direction = 1
+        self.set_epoch(self._ref)
+
+    def resume(self):
+        self._paused = False
+        self._last_wall = time.perf_counter()
+
+    def pause(self):
+        self._paused = True
+        self._last_wall = None
+
+    def toggle_pause(self):
+        if self._paused:
+            self.resume()
+        else:
+            self.pause()
+
+        return self._paused
+
+    def reverse(self):
+        self._direction = -self._direction
+
+    def format_epoch(self, digits=6):
+        """ The epoch as a Julian date string, for display only. """
+        return f'{self._jd1 + self._jd2:.{digits}f}'
+
+    def format_elapsed(self, digits=6):
+        """ The days elapsed since the reference epoch, for display only. """
+        return f'{self.elapsed / SEC_PER_DAY:.{digits}f}'
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def jd_pair(self):
+        return self._jd1, self._jd2
+
+    @property
+    def jd(self):
+        return self._jd1 + self._jd2
+
+    @property
+    def ref_jd_pair(self):
+        return self._ref
+
+    @property
+    def elapsed(self):
+        """ Simulated seconds since the reference epoch. """
+        return ((self._jd1 - self._ref[0]) + (self._jd2 - self._ref[1])) * SEC_PER_DAY
+
+    @property
+    def time(self):
+        """ The epoch as an astropy Time, for use at the API boundary. """
+        from astropy.time import Time
+        return Time(self._jd1, self._jd2, format='jd', scale='tdb')
+
+    @property
+    def warp(self):
+        return self._warp
+
+    @warp.setter
+    def warp(self, new_warp):
+        self._warp = abs(float(new_warp))
+
+    @property
+    def signed_warp(self):
+        return self._direction * self._warp
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @direction.setter
+    def direction(self, new_dir):
+        self._direction = 1 if new_dir >= 0 else -1
+
+    @property
+    def paused(self):
+        return self._paused
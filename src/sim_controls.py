@@ -9,7 +9,7 @@ from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from gui_tiled import Ui_SNS_DataPanels
 from datastore import log_config
 from datastore import DEF_EPOCH0 as DEF_EPOCH
-from astropy.time import Time, TimeDelta
+from sim_clock import SimClock
 
 logging.config.dictConfig(log_config)
 
@@ -33,7 +33,7 @@ class Controls(QtWidgets.QWidget):
         self._active_cam = 'def_cam'
         self.timer_widgets = self._widget_groups['time_']
         self.timer_paused = True
-        self._last_elapsed = 0
+        self._clock = SimClock(epoch=DEF_EPOCH)
 
     def with_prefix(self, prefix):
         return [widget for name, widget in self.ui.__dict__.items()
@@ -71,11 +71,17 @@ class Controls(QtWidgets.QWidget):
         self.init_epoch_timer()
         print("Controls initialized...")
 
-    def init_epoch_timer(self, wexp=1, ref_epoch=DEF_EPOCH,):
+    def set_clock(self, clock):
+        """ The SimClock driven by the epoch timer widgets. """
+        self._clock = clock
+
+    def init_epoch_timer(self, wexp=1, ref_epoch=None,):
         # [print(f'{k}:\t{v.objectName()}:\t{v}') for k, v in enumerate(self.timer_widgets)]
-        print(f'JD1:\t{ref_epoch.jd1}\nJD2:\t{ref_epoch.jd2}')
+        if ref_epoch is not None:
+            self._clock.reset(ref_epoch)
+        print(f'JD1:\t{self._clock.ref_jd_pair[0]}\nJD2:\t{self._clock.ref_jd_pair[1]}')
 
-        self.ui.time_ref_epoch.setText(str(ref_epoch.jd1))
+        self.ui.time_ref_epoch.setText(f'{sum(self._clock.ref_jd_pair):.6f}')
         self.ui.time_elapsed.setText(f'{str(0)}')
         self.ui.time_wexp.setValue(wexp)
         self.ui.time_wmax.setText(str(pow(10, wexp)))
@@ -83,16 +89,17 @@ class Controls(QtWidgets.QWidget):
         self.ui.time_slider.setMaximum(int(self.ui.time_wmax.text()))
         self.ui.time_slider.setValue(0)
         self.ui.time_warp.setText(str(self.ui.time_slider.value()))
-        self.ui.time_sys_epoch.setText(str(self.ui.time_ref_epoch.text()))
+        self._clock.warp = self.ui.time_slider.value()
+        self.show_clock()
 
     @pyqtSlot()
-    def tw_elapsed_updated(self):
-        new_elapsed = float(self.ui.time_elapsed.text())
-        dt = TimeDelta(new_elapsed - self._last_elapsed)
-        self._last_elapsed = new_elapsed
-        new_sys_epoch = (Time(float(self.ui.time_sys_epoch.text()), format='jd') +
-                         float(self.ui.time_warp.text()) * dt.to(u.s))
-        self.ui.time_sys_epoch.setText(f'{new_sys_epoch.value:.4f}')
+    def show_clock(self):
+        """
+            Pushes the state of the clock to the epoch timer widgets.  This is called at the
+            display rate, the widgets are never read back to get the epoch.
+        """
+        self.ui.time_sys_epoch.setText(self._clock.format_epoch())
+        self.ui.time_elapsed.setText(self._clock.format_elapsed())
 
     def tw_exp_updated(self, new_wexp):
         new_max = pow(10, new_wexp)
@@ -113,10 +120,47 @@ class Controls(QtWidgets.QWidget):
         else:
             res = max_value * ((new_value - mid_value) / mid_value)
 
-        self.ui.time_warp.setText(f'{float(res):.4f}')
+        self._clock.warp = res
+        self.ui.time_warp.setText(f'{self._clock.signed_warp:.4f}')
+
+    def scale_warp(self, factor):
+        """ Multiplies the time warp, as the [ and ] keys do, starting from 0.1 when speeding up from rest. """
+        warp = self._clock.warp
+        if factor > 1:
+            warp = max(warp, 0.1)
+        self.set_warp(warp * factor)
+
+    def set_warp(self, new_warp):
+        """
+            Sets the time warp from outside the slider.  The exponent and the slider are moved to
+            match, with their signals blocked so that they do not set the warp again.
+        """
+        new_warp = abs(float(new_warp))
+        wexp = self.ui.time_wexp.value()
+        while pow(10, wexp) < new_warp and wexp < self.ui.time_wexp.maximum():
+            wexp += 1
+        max_value = pow(10, wexp)
+        mid_value = int(max_value / 2)
+        new_warp = min(new_warp, max_value)
+        if new_warp <= 1:                           # the inverse of tw_slider_updated()
+            position = new_warp * mid_value
+        else:
+            position = mid_value + new_warp * mid_value / max_value
+
+        for widget in (self.ui.time_wexp, self.ui.time_slider):
+            widget.blockSignals(True)
+        self.ui.time_wexp.setValue(wexp)
+        self.ui.time_wmax.setText(f'{max_value}')
+        self.ui.time_slider.setMaximum(max_value)
+        self.ui.time_slider.setValue(int(round(position)))
+        for widget in (self.ui.time_wexp, self.ui.time_slider):
+            widget.blockSignals(False)
+
+        self._clock.warp = new_warp
+        self.ui.time_warp.setText(f'{self._clock.signed_warp:.4f}')
 
     def toggle_twarp2norm(self):
-        if float(self.ui.time_warp.text()) == 1.0:
+        if self._clock.warp == 1.0:
             self.ui.time_slider.setValue(0)
             self.timer_paused = True
         else:
@@ -124,13 +168,16 @@ class Controls(QtWidgets.QWidget):
             self.timer_paused = False
 
     def toggle_twarp_sign(self):
-        self.ui.time_warp.setText(f'{-float(self.ui.time_warp.text())}')
+        self._clock.reverse()
+        self.ui.time_warp.setText(f'{self._clock.signed_warp:.4f}')
 
     def reset_epoch_timer(self):
-        self.ui.time_warp.setText('0')
         self.ui.time_slider.setValue(0)
-        self.ui.time_elapsed.setText('0')
-        self.ui.time_ref_epoch.setText(f'{DEF_EPOCH}')
+        self._clock.reset()
+        self._clock.warp = 0
+        self.ui.time_warp.setText('0')
+        self.ui.time_ref_epoch.setText(f'{sum(self._clock.ref_jd_pair):.6f}')
+        self.show_clock()
 
     def set_active_cam(self, cam_id):
         print()
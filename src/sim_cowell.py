@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the EnsemblePropagator class, a Cowell propagator that integrates an
+    ensemble of spacecraft states, shape (M, 6), together.  All members share one adaptive
+    Dormand-Prince 5(4) step, sized by the worst scaled error in the ensemble, so that every
+    stage is a single vectorized evaluation of the accelerations of all members.  The major
+    bodies of a SimSystem act as perturbers; their positions are computed for all the stages
+    of a step in one call.
+
+    States are relative to a central body, in km and km/s, and the frame is its (non-rotating)
+    frame, so the indirect acceleration of the centre by the perturbers is included.
+
+        model = SimSystem(body_names=['Sun', 'Earth', 'Moon'])
+        pert = SystemPerturbers(model, center='Earth')
+        ens = EnsemblePropagator(disperse(y_nom, sigma, 1000), jd0, pert.mu_center, pert)
+        jds, states = ens.propagate(jd0 + 3.0, n_out=73)
+"""
+import logging
+import numpy as np
+from sim_kepler import jd_pair, absolute_positions, SEC_PER_DAY
+
+logging.basicConfig(filename="../logs/sns_cowell.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_RTOL = 1e-10
+DEF_ATOL = 1e-6             # km and km/s
+DEF_H0 = 60.0               # first trial step (s)
+DEF_MIN_STEP = 1e-3         # s
+DEF_MAX_STEP = 86400.0      # s
+SAFETY = 0.9
+MIN_FACTOR = 0.2
+MAX_FACTOR = 5.0
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0, 1.0])
+DP_A = (np.array([]),
+        np.array([1 / 5]),
+        np.array([3 / 40, 9 / 40]),
+        np.array([44 / 45, -56 / 15, 32 / 9]),
+        np.array([19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729]),
+        np.array([9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656]),
+        np.array([35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]),
+        )
+DP_B = np.array([35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0.0])
+DP_E = DP_B - np.array([5179 / 57600, 0.0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40])
+
+
+def disperse(nominal, sigma, count, seed=None):
+    """
+        Draws a Monte Carlo ensemble around a nominal state.
+    Parameters
+    ----------
+    nominal : array-like(6,)                the nominal state (km, km/s)
+    sigma   : array-like(6,) or (6, 6)      standard deviations, or a covariance matrix
+    count   : int                           the number of members
+
+    Returns
+    -------
+    np.ndarray(count, 6)
+    """
+    rng = np.random.default_rng(seed)
+    nominal = np.asarray(nominal, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if sigma.ndim == 2:
+        return rng.multivariate_normal(nominal, sigma, size=count)
+
+    return nominal + rng.standard_normal((count, 6)) * sigma
+
+
+class SystemPerturbers:
+    """
+        The positions of the major bodies of a SimSystem relative to a central body, for the
+        stages of a step.
+
+    Parameters
+    ----------
+    model   : SimSystem         the loaded model
+    center  : str               the name of the central body
+    bodies  : list of str       optional, the perturbing bodies (default: all others)
+    """
+    def __init__(self, model, center, bodies=None):
+        self._model = model
+        names = list(model.body_names)
+        self._c_idx = names.index(center)
+        if bodies is None:
+            bodies = [n for n in names if n != center]
+        self._p_idx = np.array([names.index(n) for n in bodies if n != center], dtype=np.intp)
+        self._parent_idx = model.parent_idx
+        mu = model.nbody.mu
+        self._mu_center = float(mu[self._c_idx])
+        self._mu = mu[self._p_idx].copy()
+        self._buff = np.zeros((len(DP_C), model.num_bodies, 3, 3), dtype=np.float64)
+
+    def __call__(self, jds):
+        """
+        Returns
+        -------
+        np.ndarray(K, P, 3)     positions of the perturbers relative to the centre at each epoch
+        """
+        states = self._model.propagate_epochs(jds, out=self._buff[:len(jds)])
+        pos = absolute_positions(states[:, :, 0], self._parent_idx)
+
+        return pos[:, self._p_idx] - pos[:, self._c_idx, None]
+
+    @property
+    def mu(self):
+        return self._mu
+
+    @property
+    def mu_center(self):
+        return self._mu_center
+
+
+class EnsemblePropagator:
+    """
+        Integrates an ensemble of states together with a shared adaptive step.
+
+    Parameters
+    ----------
+    y0          : np.ndarray(M, 6)      initial states relative to the central body (km, km/s)
+    epoch       : Time, (jd1, jd2)      epoch of y0 (TDB)
+    mu_center   : float                 gravitational parameter of the central body (km^3 / s^2)
+    perturbers  : callable(jds)         optional, returns the (K, P, 3) positions of the perturbers
+                                        relative to the central body, with a mu attribute (P,)
+    """
+    def __init__(self, y0, epoch, mu_center, perturbers=None,
+                 rtol=DEF_RTOL, atol=DEF_ATOL, h0=DEF_H0, max_step=DEF_MAX_STEP):
+        self._y = np.array(y0, dtype=np.float64, ndmin=2)
+        self._jd = jd_pair(epoch)
+        self._t = 0.0                   # seconds since epoch
+        self._mu_c = float(mu_center)
+        self._pert = perturbers
+        self._rtol = rtol
+        self._atol = atol
+        self._h = h0
+        self._max_step = max_step
+        m = len(self._y)
+        self._k = np.zeros((len(DP_C), m, 6), dtype=np.float64)
+        self._fsal = False
+        self._n_steps = 0
+        self._n_rejected = 0
+
+    def _jds(self, t):
+        return self._jd[0] + (self._jd[1] + np.asarray(t) / SEC_PER_DAY)
+
+    def derivatives(self, y, s_pos=None, out=None):
+        """
+            The time derivatives of the states, given the positions of the perturbers.
+
+        Parameters
+        ----------
+        y       : np.ndarray(M, 6)
+        s_pos   : np.ndarray(P, 3)      positions of the perturbers relative to the central body
+        """
+        if out is None:
+            out = np.empty_like(y)
+        r = y[:, :3]
+        out[:, :3] = y[:, 3:]
+        r2 = np.einsum('ij,ij->i', r, r)
+        out[:, 3:] = r * (-self._mu_c / (r2 * np.sqrt(r2)))[:, None]
+        if s_pos is not None and len(s_pos):
+            mu = self._pert.mu
+            d = s_pos[None, :, :] - r[:, None, :]
+            d2 = np.einsum('ijk,ijk->ij', d, d)
+            direct = np.einsum('ij,ijk->ik', mu[None, :] / (d2 * np.sqrt(d2)), d)
+            s2 = np.einsum('ij,ij->i', s_pos, s_pos)
+            indirect = (s_pos * (mu / (s2 * np.sqrt(s2)))[:, None]).sum(axis=0)
+            out[:, 3:] += direct - indirect
+
+        return out
+
+    def _attempt(self, h):
+        """ One Dormand-Prince step of size h for the whole ensemble, returns (y_new, err). """
+        s_pos = self._pert(self._jds(self._t + DP_C * h)) if self._pert is not None else [None] * len(DP_C)
+        k = self._k
+        if not self._fsal:
+            self.derivatives(self._y, s_pos[0], out=k[0])
+        for i in range(1, len(DP_C)):
+            y_i = self._y + h * np.tensordot(DP_A[i], k[:i], axes=(0, 0))
+            self.derivatives(y_i, s_pos[i], out=k[i])
+
+        y_new = y_i                                     # the last stage is evaluated at the 5th order solution
+        err = h * np.tensordot(DP_E, k, axes=(0, 0))
+        scale = self._atol + self._rtol * np.maximum(np.abs(self._y), np.abs(y_new))
+        err_norm = np.sqrt(np.mean((err / scale) ** 2, axis=1)).max()
+
+        return y_new, err_norm
+
+    def step(self, h_max=None):
+        """
+            Takes one accepted step, no longer than h_max (signed), retrying with smaller steps
+            until the error of every member is within tolerance.
+
+        Returns
+        -------
+        float   : the step taken (s)
+        """
+        h_free = np.copysign(min(abs(self._h), self._max_step), self._h)
+        h = h_free if h_max is None else np.copysign(min(abs(h_free), abs(h_max)), h_max)
+        clipped = abs(h) < abs(h_free)
+        while True:
+            y_new, err = self._attempt(h)
+            if err <= 1.0 or abs(h) <= DEF_MIN_STEP:
+                break
+            self._n_rejected += 1
+            self._fsal = True                           # k[0] is still valid for the same start
+            h *= max(MIN_FACTOR, SAFETY * err ** -0.2)
+
+        self._y = y_new
+        self._t += h
+        self._k[0] = self._k[-1]
+        self._fsal = True
+        self._n_steps += 1
+        factor = MAX_FACTOR if err == 0 else min(MAX_FACTOR, max(MIN_FACTOR, SAFETY * err ** -0.2))
+        self._h = h * factor
+        if clipped:                                     # a short step to hit a record does not shrink the next
+            self._h = np.copysign(max(abs(h_free), abs(self._h)), h)
+
+        return h
+
+    def propagate(self, epoch, n_out=2):
+        """
+            Integrates the ensemble to an epoch, recording the states at n_out evenly spaced
+            epochs from the current one to it, both included.
+
+        Returns
+        -------
+        jds     : np.ndarray(n_out,)            TDB Julian dates of the records
+        states  : np.ndarray(n_out, M, 6)       the ensemble at each record
+        """
+        jd1, jd2 = jd_pair(epoch)
+        t_end = ((jd1 - self._jd[0]) + (jd2 - self._jd[1])) * SEC_PER_DAY
+        t_out = np.linspace(self._t, t_end, max(2, int(n_out)))
+        states = np.zeros((len(t_out),) + self._y.shape, dtype=np.float64)
+        states[0] = self._y
+        direction = np.sign(t_end - self._t)
+        if direction and np.sign(self._h) != direction:
+            self._h = -self._h
+            self._fsal = False
+        for i, t_rec in enumerate(t_out[1:], start=1):
+            while (t_rec - self._t) * direction > 1e-9:
+                self.step(h_max=t_rec - self._t)
+            states[i] = self._y
+
+        return self._jds(t_out), states
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def state(self):
+        return self._y
+
+    @property
+    def count(self):
+        return len(self._y)
+
+    @property
+    def jd(self):
+        return float(self._jds(self._t))
+
+    @property
+    def elapsed(self):
+        return self._t
+
+    @property
+    def stats(self):
+        return dict(steps=self._n_steps, rejected=self._n_rejected, h=self._h)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the ChebyshevEphem class, a table of Chebyshev polynomial segments
+    (in the manner of JPL SPK type 2) fitted to the position of a body.  The table is generated
+    once over a span of epochs and is then evaluated with pure NumPy, returning the position
+    and the velocity (the derivative of the same polynomials) in a single evaluation.
+
+    The tables are used for the bodies that have no Orbit (the system primary); the bodies
+    that orbit a parent are propagated from their elements by sim_kepler.KeplerPropagator.
+"""
+import logging
+import numpy as np
+from sim_kepler import jd_pair, SEC_PER_DAY
+
+logging.basicConfig(filename="../logs/sns_ephem.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_CHEB_SPAN = 365.0           # days covered by a table
+DEF_CHEB_DEGREE = 12            # degree of the polynomial in each segment
+DEF_CHEB_SEGS_PER_ORBIT = 16    # segments per orbital period
+DEF_CHEB_MAX_SEG = 32.0         # longest segment allowed (days)
+
+
+def cheb_nodes(degree):
+    """ The Chebyshev-Gauss nodes on [-1, 1] for a polynomial of the given degree. """
+    n = degree + 1
+    return np.cos(np.pi * (np.arange(n) + 0.5) / n)
+
+
+def cheb_basis(x, degree):
+    """
+        Evaluates the Chebyshev polynomials T_k(x) and their derivatives dT_k/dx.
+    Parameters
+    ----------
+    x       : np.ndarray(K,)    normalized times in [-1, 1]
+    degree  : int
+
+    Returns
+    -------
+    T, dT   : np.ndarray(K, degree + 1)
+    """
+    T = np.empty((len(x), degree + 1), dtype=np.float64)
+    dT = np.empty_like(T)
+    T[:, 0] = 1.0
+    dT[:, 0] = 0.0
+    if degree > 0:
+        T[:, 1] = x
+        dT[:, 1] = 1.0
+    for k in range(1, degree):
+        T[:, k + 1] = 2 * x * T[:, k] - T[:, k - 1]
+        dT[:, k + 1] = 2 * T[:, k] + 2 * x * dT[:, k] - dT[:, k - 1]
+
+    return T, dT
+
+
+class ChebyshevEphem:
+    """
+        A table of Chebyshev segments of equal length covering [jd_start, jd_start + n_seg * seg_days].
+        Positions are in km and velocities in km/s.
+    """
+    def __init__(self, jd_start, seg_days, coeffs):
+        """
+        Parameters
+        ----------
+        jd_start    : float                     TDB Julian date at the start of the first segment
+        seg_days    : float                     length of each segment in days
+        coeffs      : np.ndarray(S, 3, D + 1)   coefficients of each segment for x, y and z
+        """
+        self._jd_start = float(jd_start)
+        self._seg_days = float(seg_days)
+        self._coeffs = np.ascontiguousarray(coeffs, dtype=np.float64)
+        self._n_seg, _, n = self._coeffs.shape
+        self._degree = n - 1
+        self._jd_end = self._jd_start + self._n_seg * self._seg_days
+
+    @staticmethod
+    def node_epochs(jd_start, span, seg_days, degree=DEF_CHEB_DEGREE):
+        """
+            The epochs at which the body must be sampled to fit a table.
+        Parameters
+        ----------
+        jd_start    : float     start of the table (TDB Julian date)
+        span        : float     days to be covered, rounded up to a whole number of segments
+        seg_days    : float     length of each segment in days
+
+        Returns
+        -------
+        np.ndarray(S * (D + 1),)    Julian dates of the nodes, segment by segment
+        """
+        n_seg = max(1, int(np.ceil(span / seg_days)))
+        mids = jd_start + (np.arange(n_seg) + 0.5) * seg_days
+        nodes = cheb_nodes(degree) * seg_days / 2
+
+        return (mids[:, None] + nodes[None, :]).ravel()
+
+    @classmethod
+    def from_samples(cls, jd_start, seg_days, r_nodes, degree=DEF_CHEB_DEGREE):
+        """
+            Fits the table to positions sampled at the epochs given by node_epochs().
+        Parameters
+        ----------
+        r_nodes     : np.ndarray(S * (D + 1), 3)    positions (km) at the node epochs
+
+        Returns
+        -------
+        ChebyshevEphem
+        """
+        n = degree + 1
+        r_nodes = np.asarray(r_nodes, dtype=np.float64).reshape((-1, n, 3))
+        theta = np.pi * (np.arange(n) + 0.5) / n
+        basis = np.cos(np.outer(np.arange(n), theta)) * (2.0 / n)   # (k, j)
+        basis[0] *= 0.5
+        coeffs = np.einsum('kj,sjc->sck', basis, r_nodes)
+
+        return cls(jd_start, seg_days, coeffs)
+
+    @classmethod
+    def from_function(cls, sample_fn, jd_start, span=DEF_CHEB_SPAN, seg_days=DEF_CHEB_MAX_SEG,
+                      degree=DEF_CHEB_DEGREE):
+        """
+            Builds a table by calling sample_fn once with every node epoch.
+        Parameters
+        ----------
+        sample_fn   : callable      maps an array of TDB Julian dates to positions (K, 3) in km
+        """
+        jds = cls.node_epochs(jd_start, span, seg_days, degree)
+        res = cls.from_samples(jd_start, seg_days, sample_fn(jds), degree)
+        logging.info("Chebyshev table: %s segments of %s days, degree %s",
+                     res.n_segments, seg_days, degree)
+
+        return res
+
+    def extend(self, sample_fn, jd_lo, jd_hi):
+        """
+            Returns a table that also covers [jd_lo, jd_hi].  Segments are added before and after
+            this table on the same grid, so only the added segments are sampled and their node
+            epochs are the same whichever request added them.
+        Parameters
+        ----------
+        sample_fn       : callable      as for from_function()
+        jd_lo, jd_hi    : float         TDB Julian dates
+
+        Returns
+        -------
+        ChebyshevEphem  : self if it already covers the range
+        """
+        n_before = max(0, int(np.ceil((self._jd_start - jd_lo) / self._seg_days)))
+        n_after = max(0, int(np.ceil((jd_hi - self._jd_end) / self._seg_days)))
+        if not (n_before or n_after):
+            return self
+
+        jd_start = self._jd_start - n_before * self._seg_days
+        parts = [self._coeffs]
+        if n_before:        # the span is rounded up to whole segments, half a segment less avoids an extra one
+            parts.insert(0, self.from_function(sample_fn, jd_start, (n_before - 0.5) * self._seg_days,
+                                               self._seg_days, self._degree).coeffs)
+        if n_after:
+            parts.append(self.from_function(sample_fn, self._jd_end, (n_after - 0.5) * self._seg_days,
+                                            self._seg_days, self._degree).coeffs)
+        logging.info("Chebyshev table extended by %s segments before and %s after", n_before, n_after)
+
+        return ChebyshevEphem(jd_start, self._seg_days, np.concatenate(parts))
+
+    def covers(self, epoch):
+        jd1, jd2 = jd_pair(epoch)
+        t = (jd1 - self._jd_start) + jd2
+
+        return np.all((t >= 0) & (t <= self._jd_end - self._jd_start))
+
+    def rv(self, epoch):
+        """
+            Evaluates position and velocity at one or more epochs.  Epochs outside of the
+            table are evaluated with the nearest segment.
+        Parameters
+        ----------
+        epoch   : Time, (jd1, jd2) or jd    scalar or array of TDB epochs
+
+        Returns
+        -------
+        r, v    : np.ndarray(3,) or (K, 3)  position (km) and velocity (km/s)
+        """
+        jd1, jd2 = jd_pair(epoch)
+        t = np.atleast_1d((np.asarray(jd1) - self._jd_start) + np.asarray(jd2))
+        seg = np.clip((t // self._seg_days).astype(np.intp), 0, self._n_seg - 1)
+        x = 2 * (t - seg * self._seg_days) / self._seg_days - 1
+        T, dT = cheb_basis(x, self._degree)
+        c = self._coeffs[seg]
+        r = np.einsum('kn,kcn->kc', T, c)
+        v = np.einsum('kn,kcn->kc', dT, c) * (2.0 / (self._seg_days * SEC_PER_DAY))
+        if np.ndim(jd1) == 0 and np.ndim(jd2) == 0:
+            return r[0], v[0]
+
+        return r, v
+
+    @property
+    def jd_start(self):
+        return self._jd_start
+
+    @property
+    def jd_end(self):
+        return self._jd_end
+
+    @property
+    def seg_days(self):
+        return self._seg_days
+
+    @property
+    def degree(self):
+        return self._degree
+
+    @property
+    def n_segments(self):
+        return self._n_seg
+
+    @property
+    def coeffs(self):
+        return self._coeffs
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the KeplerPropagator class, which holds the classical orbital
+    elements of many bodies in NumPy arrays and solves Kepler's equation for all of them
+    in a single batched call.  The resulting position and velocity vectors are written
+    directly into a contiguous (N, 3, 3) state array, laid out exactly like the state
+    matrix of a SimBody:  [r, v, rot].
+"""
+import logging
+import numpy as np
+
+logging.basicConfig(filename="../logs/sns_kepler.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+SEC_PER_DAY = 86400.0
+DAYS_PER_CENTURY = 36525.0
+J2000_JD = 2451545.0            # J2000 as a TDB Julian date
+KEPLER_TOL = 1e-12
+KEPLER_MAX_ITER = 30
+
+
+def jd_pair(epoch=None):
+    """
+        Convert an epoch into a two-float Julian date (jd1, jd2).
+    Parameters
+    ----------
+    epoch   : astropy.time.Time | tuple | float | np.ndarray     The epoch(s) to be converted
+
+    Returns
+    -------
+    (jd1, jd2)  : tuple of float
+    """
+    if hasattr(epoch, 'jd1'):
+        if epoch.scale != 'tdb':
+            epoch = epoch.tdb
+        return epoch.jd1, epoch.jd2
+    elif isinstance(epoch, tuple):
+        return epoch[0], epoch[1]
+    elif np.ndim(epoch) > 0:
+        return np.asarray(epoch, dtype=np.float64), 0.0
+    else:
+        return float(epoch), 0.0
+
+
+def epoch_td(epoch=None):
+    """
+        The interval from J2000 to an epoch, as used by the IAU rotational element functions.
+        The subtraction is done on the jd1 and jd2 halves separately to keep the precision.
+    Parameters
+    ----------
+    epoch   : Time | (jd1, jd2) | float | np.ndarray     the TDB epoch(s)
+
+    Returns
+    -------
+    dict    : 'd', days since J2000, and 'T', Julian centuries since J2000
+    """
+    jd1, jd2 = jd_pair(epoch)
+    d = (jd1 - J2000_JD) + jd2
+    return dict(T=d / DAYS_PER_CENTURY, d=d)
+
+
+def solve_kepler_elliptic(M, ecc, tol=KEPLER_TOL, max_iter=KEPLER_MAX_ITER):
+    """
+        Solves M = E - e * sin(E) for the eccentric anomaly E, element-wise.
+    Parameters
+    ----------
+    M       : np.ndarray    mean anomalies (rad)
+    ecc     : np.ndarray    eccentricities, 0 <= e < 1
+
+    Returns
+    -------
+    E       : np.ndarray    eccentric anomalies (rad)
+    """
+    M = np.remainder(M + np.pi, 2 * np.pi) - np.pi
+    E = np.where(ecc < 0.8, M, np.pi * np.sign(M))
+    for _ in range(max_iter):
+        dE = (E - ecc * np.sin(E) - M) / (1.0 - ecc * np.cos(E))
+        E -= dE
+        if np.all(np.abs(dE) < tol):
+            break
+
+    return E
+
+
+def solve_kepler_hyperbolic(M, ecc, tol=KEPLER_TOL, max_iter=KEPLER_MAX_ITER):
+    """
+        Solves M = e * sinh(F) - F for the hyperbolic anomaly F, element-wise.
+    Parameters
+    ----------
+    M       : np.ndarray    hyperbolic mean anomalies (rad)
+    ecc     : np.ndarray    eccentricities, e > 1
+
+    Returns
+    -------
+    F       : np.ndarray    hyperbolic anomalies (rad)
+    """
+    F = np.sign(M) * np.log(2 * np.abs(M) / ecc + 1.8)
+    for _ in range(max_iter):
+        dF = (ecc * np.sinh(F) - F - M) / (ecc * np.cosh(F) - 1.0)
+        F -= dF
+        if np.all(np.abs(dF) < tol):
+            break
+
+    return F
+
+
+def pqw_basis(inc, raan, argp):
+    """
+        Computes the P and Q unit vectors of the perifocal frame for arrays of angles.
+    Parameters
+    ----------
+    inc, raan, argp : np.ndarray    inclination, RAAN and argument of periapsis (rad)
+
+    Returns
+    -------
+    P, Q    : np.ndarray(N, 3)      unit vectors toward periapsis and 90 deg ahead of it
+    """
+    c_O, s_O = np.cos(raan), np.sin(raan)
+    c_w, s_w = np.cos(argp), np.sin(argp)
+    c_i, s_i = np.cos(inc), np.sin(inc)
+    P = np.stack([c_O * c_w - s_O * s_w * c_i,
+                  s_O * c_w + c_O * s_w * c_i,
+                  s_w * s_i], axis=-1)
+    Q = np.stack([-c_O * s_w - s_O * c_w * c_i,
+                  -s_O * s_w + c_O * c_w * c_i,
+                  c_w * s_i], axis=-1)
+
+    return P, Q
+
+
+def absolute_positions(r, parent_idx):
+    """
+        Adds the position of each parent to the positions of its children.
+    Parameters
+    ----------
+    r           : np.ndarray(K, N, 3)   positions relative to the parent of each body
+    parent_idx  : np.ndarray(N,)        index of the parent of each body, -1 for the primary
+
+    Returns
+    -------
+    np.ndarray(K, N, 3)     positions relative to the system primary
+    """
+    res = r.copy()
+    res[:, parent_idx < 0] = 0.0
+    has_parent = np.nonzero(parent_idx >= 0)[0]
+    anc = parent_idx.copy()
+    while np.any(anc[has_parent] >= 0):     # one pass per level of the body hierarchy
+        lvl = has_parent[anc[has_parent] >= 0]
+        res[:, lvl] += np.where((parent_idx[anc[lvl]] >= 0)[None, :, None], r[:, anc[lvl]], 0.0)
+        anc[lvl] = parent_idx[anc[lvl]]
+
+    return res
+
+
+class KeplerPropagator:
+    """
+        Propagates a set of two-body orbits analytically, all at once.
+        The elements are stored as flat float64 arrays (distances in km, angles in rad,
+        mu in km^3 / s^2) along with the epoch (as a jd1, jd2 pair) at which each set of
+        elements is valid.  Each row maps onto a row of a system state array via sys_idx.
+    """
+    def __init__(self):
+        self._count    = 0
+        self._sys_idx  = np.zeros((0,), dtype=np.intp)
+        self._a        = np.zeros((0,), dtype=np.float64)
+        self._ecc      = np.zeros((0,), dtype=np.float64)
+        self._mu       = np.zeros((0,), dtype=np.float64)
+        self._M0       = np.zeros((0,), dtype=np.float64)
+        self._n        = np.zeros((0,), dtype=np.float64)
+        self._jd1_0    = np.zeros((0,), dtype=np.float64)
+        self._jd2_0    = np.zeros((0,), dtype=np.float64)
+        self._P        = np.zeros((0, 3), dtype=np.float64)
+        self._Q        = np.zeros((0, 3), dtype=np.float64)
+        self._is_hyp   = np.zeros((0,), dtype=bool)
+
+    @classmethod
+    def from_orbits(cls, orbits, sys_idx=None):
+        """
+            Builds a propagator from a sequence of poliastro Orbit objects.
+        Parameters
+        ----------
+        orbits      : list of Orbit     the orbits to be propagated together
+        sys_idx     : list of int       the row of the system state array for each orbit
+
+        Returns
+        -------
+        KeplerPropagator
+        """
+        res = cls()
+        if sys_idx is None:
+            sys_idx = range(len(orbits))
+
+        elems = np.zeros((len(orbits), 7), dtype=np.float64)
+        jd1_0 = np.zeros((len(orbits),), dtype=np.float64)
+        jd2_0 = np.zeros((len(orbits),), dtype=np.float64)
+        for i, orb in enumerate(orbits):
+            a, ecc, inc, raan, argp, nu = orb.classical()
+            elems[i] = (a.to_value('km'), ecc.value,
+                        inc.to_value('rad'), raan.to_value('rad'),
+                        argp.to_value('rad'), nu.to_value('rad'),
+                        orb.attractor.k.to_value('km3 / s2'),
+                        )
+            jd1_0[i], jd2_0[i] = orb.epoch.tdb.jd1, orb.epoch.tdb.jd2
+
+        res.set_elements(*elems.T, epoch=(jd1_0, jd2_0), sys_idx=sys_idx)
+
+        return res
+
+    def set_elements(self, a, ecc, inc, raan, argp, nu, mu, epoch, sys_idx=None):
+        """
+            Loads the classical elements for all bodies.  Every argument is array-like
+            with one entry per body, except that epoch may be a single value for all.
+        Parameters
+        ----------
+        a               : semi-major axes (km), negative for hyperbolic orbits
+        ecc             : eccentricities
+        inc, raan, argp : inclinations, RAANs and arguments of periapsis (rad)
+        nu              : true anomalies at epoch (rad)
+        mu              : gravitational parameter of each attractor (km^3 / s^2)
+        epoch           : Time, (jd1, jd2) or jd at which the elements are valid
+        sys_idx         : row of the system state array that each body writes into
+        """
+        a, ecc, inc, raan, argp, nu, mu = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                                                for x in (a, ecc, inc, raan, argp, nu, mu)])
+        self._count = len(a)
+        if np.any(np.isclose(ecc, 1.0)):
+            raise ValueError(">>>ERROR: parabolic orbits are not supported by KeplerPropagator")
+
+        jd1_0, jd2_0 = jd_pair(epoch)
+        self._jd1_0 = np.broadcast_to(np.asarray(jd1_0, dtype=np.float64), (self._count,)).copy()
+        self._jd2_0 = np.broadcast_to(np.asarray(jd2_0, dtype=np.float64), (self._count,)).copy()
+        if sys_idx is None:
+            sys_idx = np.arange(self._count)
+        self._sys_idx = np.asarray(sys_idx, dtype=np.intp)
+        self._a = a
+        self._ecc = ecc
+        self._mu = mu
+        self._is_hyp = ecc > 1.0
+        self._n = np.sqrt(mu / np.abs(a) ** 3)
+        self._P, self._Q = pqw_basis(inc, raan, argp)
+
+        # mean anomaly at epoch from the true anomaly
+        ell = ~self._is_hyp
+        self._M0 = np.zeros_like(a)
+        E0 = 2 * np.arctan2(np.sqrt(1 - ecc[ell]) * np.sin(nu[ell] / 2),
+                            np.sqrt(1 + ecc[ell]) * np.cos(nu[ell] / 2))
+        self._M0[ell] = E0 - ecc[ell] * np.sin(E0)
+        hyp = self._is_hyp
+        F0 = 2 * np.arctanh(np.sqrt((ecc[hyp] - 1) / (ecc[hyp] + 1)) * np.tan(nu[hyp] / 2))
+        self._M0[hyp] = ecc[hyp] * np.sinh(F0) - F0
+        logging.info("KeplerPropagator loaded with %s bodies", self._count)
+
+    def propagate(self, epoch, out=None):
+        """
+            Propagates every orbit to the given epoch.
+        Parameters
+        ----------
+        epoch   : Time, (jd1, jd2) or jd    The epoch to propagate to (TDB)
+        out     : np.ndarray(N, 3, 3)       A system state array to write r and v into.
+                                            Rows are selected by sys_idx.
+
+        Returns
+        -------
+        out     : np.ndarray                The state array with r in [:, 0] and v in [:, 1]
+        """
+        jd1, jd2 = jd_pair(epoch)
+        dt = ((jd1 - self._jd1_0) + (jd2 - self._jd2_0)) * SEC_PER_DAY
+        r, v = self.rv_at(dt)
+        if out is None:
+            out = np.zeros((self._count, 3, 3), dtype=np.float64)
+            out[:, 0] = r
+            out[:, 1] = v
+        else:
+            out[self._sys_idx, 0] = r
+            out[self._sys_idx, 1] = v
+
+        return out
+
+    def propagate_epochs(self, epochs, out=None):
+        """
+            Propagates every orbit to each of a series of epochs, in one vectorized call.
+        Parameters
+        ----------
+        epochs  : (jd1, jd2) or jd          K TDB epochs, as arrays
+        out     : np.ndarray(K, N, 3, 3)    A series of system state arrays to write r and v into.
+                                            Rows are selected by sys_idx.
+
+        Returns
+        -------
+        out     : np.ndarray                The state arrays with r in [:, :, 0] and v in [:, :, 1]
+        """
+        jd1, jd2 = jd_pair(epochs)
+        jd1 = np.atleast_1d(np.asarray(jd1, dtype=np.float64))
+        jd2 = np.broadcast_to(np.asarray(jd2, dtype=np.float64), jd1.shape)
+        dt = ((jd1[:, None] - self._jd1_0) + (jd2[:, None] - self._jd2_0)) * SEC_PER_DAY
+        r, v = self.rv_at(dt)
+        if out is None:
+            out = np.zeros((len(jd1), self._count, 3, 3), dtype=np.float64)
+            out[:, :, 0] = r
+            out[:, :, 1] = v
+        else:
+            out[:, self._sys_idx, 0] = r
+            out[:, self._sys_idx, 1] = v
+
+        return out
+
+    def rv_at(self, dt):
+        """
+            Computes the position and velocity of every body after dt seconds.
+        Parameters
+        ----------
+        dt      : np.ndarray(..., N)    seconds elapsed since each body's element epoch,
+                                        any leading axes (a series of epochs) are kept
+
+        Returns
+        -------
+        r, v    : np.ndarray(..., N, 3) positions (km) and velocities (km/s)
+        """
+        a = np.abs(self._a)
+        ecc = self._ecc
+        M = self._M0 + self._n * dt
+        x = np.empty_like(M)
+        y = np.empty_like(M)
+        vx = np.empty_like(M)
+        vy = np.empty_like(M)
+
+        ell = ~self._is_hyp
+        if np.any(ell):
+            e = ecc[ell]
+            E = solve_kepler_elliptic(M[..., ell], e)
+            cos_E, sin_E = np.cos(E), np.sin(E)
+            b_a = np.sqrt(1.0 - e * e)
+            rad = a[ell] * (1.0 - e * cos_E)
+            h = np.sqrt(self._mu[ell] * a[ell]) / rad
+            x[..., ell] = a[ell] * (cos_E - e)
+            y[..., ell] = a[ell] * b_a * sin_E
+            vx[..., ell] = -h * sin_E
+            vy[..., ell] = h * b_a * cos_E
+
+        hyp = self._is_hyp
+        if np.any(hyp):
+            e = ecc[hyp]
+            F = solve_kepler_hyperbolic(M[..., hyp], e)
+            cosh_F, sinh_F = np.cosh(F), np.sinh(F)
+            b_a = np.sqrt(e * e - 1.0)
+            rad = a[hyp] * (e * cosh_F - 1.0)
+            h = np.sqrt(self._mu[hyp] * a[hyp]) / rad
+            x[..., hyp] = a[hyp] * (e - cosh_F)
+            y[..., hyp] = a[hyp] * b_a * sinh_F
+            vx[..., hyp] = -h * sinh_F
+            vy[..., hyp] = h * b_a * cosh_F
+
+        r = x[..., None] * self._P + y[..., None] * self._Q
+        v = vx[..., None] * self._P + vy[..., None] * self._Q
+
+        return r, v
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def a(self):
+        """ The semi-major axes (km), negative for hyperbolic orbits. """
+        return self._a
+
+    @property
+    def sys_idx(self):
+        return self._sys_idx
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the NBodyEngine class, which computes the mutual gravitational
+    accelerations of a set of bodies and integrates their motion with a kick-drift-kick
+    leapfrog.  The pairwise relative states are computed by broadcasting over preallocated
+    (N, N, 3) work buffers, with the diagonal masked out, so a step costs a handful of array
+    operations and no allocations, whatever the number of bodies.
+
+    The SmallBodyField class holds the large populations (belts) of massless or low-mass
+    particles, attracted directly by the major bodies and, through a BarnesHutTree, by each other.
+
+    Positions are in km, velocities in km/s and gravitational parameters in km^3 / s^2.
+"""
+import logging
+import numpy as np
+from sim_kepler import KeplerPropagator, SEC_PER_DAY
+from sim_octree import BarnesHutTree, DEF_THETA
+
+logging.basicConfig(filename="../logs/sns_nbody.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_MAX_STEP = 600.0                # longest integration step (s)
+DEF_SOFTENING = 0.0                 # softening length (km), avoids singular close encounters
+DEF_MAX_JUMP = 30 * 86400.0         # longest change of epoch integrated, beyond it the state is reseeded (s)
+DEF_FIELD_STEP = 86400.0            # longest integration step of a small-body field (s)
+DEF_TREE_EVERY = 16                 # field steps between evaluations of its self-gravity, reused in between
+DEF_MAJOR_CHUNK = 16384             # particles whose attraction by the major bodies is computed together
+AU_KM = 1.495978707e+08
+
+# semi-major axis (AU), max eccentricity and max inclination (deg) of the populations in solar_system.yaml
+BELTS = {'Asteroid Belt': dict(a=(2.1, 3.3), ecc=0.3, inc=20.0),
+         'Kuiper Belt': dict(a=(30.0, 50.0), ecc=0.2, inc=30.0),
+         'Oort Cloud': dict(a=(2.0e+03, 5.0e+04), ecc=0.7, inc=180.0),
+         }
+
+
+class NBodyEngine:
+    """
+        Vectorized pairwise accelerations and a symplectic integrator for N bodies.
+
+    Parameters
+    ----------
+    mu          : array-like(N,)    gravitational parameter of each body (km^3 / s^2)
+    softening   : float             softening length (km)
+    max_step    : float             longest integration step (s)
+    """
+    def __init__(self, mu, softening=DEF_SOFTENING, max_step=DEF_MAX_STEP):
+        self._mu = np.asarray(mu, dtype=np.float64).copy()
+        self._count = len(self._mu)
+        self._eps2 = float(softening) ** 2
+        self._max_step = float(max_step)
+        n = self._count
+        self._rel_pos = np.zeros((n, n, 3), dtype=np.float64)      # [i, j] = pos[j] - pos[i]
+        self._rel_vel = np.zeros((n, n, 3), dtype=np.float64)      # [i, j] = vel[j] - vel[i]
+        self._dist2 = np.zeros((n, n), dtype=np.float64)
+        self._coef = np.zeros((n, n), dtype=np.float64)            # mu[j] / |r_ij|^3
+        self._acc = np.zeros((n, 3), dtype=np.float64)
+        self._acc_valid = False
+
+    def relative_state(self, pos, vel=None):
+        """
+            Fills the pairwise relative positions (and velocities) of all bodies.
+
+        Returns
+        -------
+        rel_pos, rel_vel    : np.ndarray(N, N, 3)   views of the work buffers, [i, j] is body j
+                                                    relative to body i
+        """
+        np.subtract(pos[None, :, :], pos[:, None, :], out=self._rel_pos)
+        if vel is not None:
+            np.subtract(vel[None, :, :], vel[:, None, :], out=self._rel_vel)
+
+        return self._rel_pos, self._rel_vel
+
+    def accelerations(self, pos, out=None):
+        """
+            Computes the gravitational acceleration of every body due to all of the others.
+
+        Parameters
+        ----------
+        pos     : np.ndarray(N, 3)      positions (km)
+        out     : np.ndarray(N, 3)      optional, the array to write the accelerations into
+
+        Returns
+        -------
+        out     : np.ndarray(N, 3)      accelerations (km / s^2)
+        """
+        if out is None:
+            out = self._acc
+
+        self.relative_state(pos)
+        np.einsum('ijk,ijk->ij', self._rel_pos, self._rel_pos, out=self._dist2)
+        if self._eps2:
+            self._dist2 += self._eps2
+        np.fill_diagonal(self._dist2, np.inf)           # no body attracts itself
+        np.power(self._dist2, -1.5, out=self._coef)
+        self._coef *= self._mu[None, :]
+        np.einsum('ij,ijk->ik', self._coef, self._rel_pos, out=out)
+
+        return out
+
+    def step(self, pos, vel, dt):
+        """
+            Advances the positions and velocities in place by one kick-drift-kick leapfrog step.
+            The accelerations at the end of a step are kept for the first kick of the next one.
+        """
+        if not self._acc_valid:
+            self.accelerations(pos)
+        vel += 0.5 * dt * self._acc
+        pos += dt * vel
+        self.accelerations(pos)
+        vel += 0.5 * dt * self._acc
+        self._acc_valid = True
+
+    def advance(self, pos, vel, seconds):
+        """
+            Advances the positions and velocities in place by the given time, in equal steps
+            no longer than max_step.  A negative time integrates backward.
+
+        Returns
+        -------
+        int     : the number of steps taken
+        """
+        n_steps = int(np.ceil(abs(seconds) / self._max_step)) if seconds else 0
+        if n_steps:
+            dt = seconds / n_steps
+            for _ in range(n_steps):
+                self.step(pos, vel, dt)
+
+        return n_steps
+
+    def invalidate(self):
+        """ Must be called when the positions are changed other than by step(). """
+        self._acc_valid = False
+
+    def energy(self, pos, vel):
+        """ The total energy per unit G (km^5 / s^4), which the leapfrog should conserve closely. """
+        mass = self._mu
+        kinetic = 0.5 * np.sum(mass * np.einsum('ij,ij->i', vel, vel))
+        self.relative_state(pos)
+        dist = np.sqrt(np.einsum('ijk,ijk->ij', self._rel_pos, self._rel_pos) + self._eps2)
+        np.fill_diagonal(dist, np.inf)
+        potential = -0.5 * np.sum(mass[:, None] * mass[None, :] / dist)
+
+        return kinetic + potential
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mu(self):
+        return self._mu
+
+    @property
+    def rel_pos(self):
+        return self._rel_pos
+
+    @property
+    def rel_vel(self):
+        return self._rel_vel
+
+    @property
+    def acc(self):
+        return self._acc
+
+    @property
+    def max_step(self):
+        return self._max_step
+
+    @max_step.setter
+    def max_step(self, new_step):
+        self._max_step = max(1e-3, float(new_step))
+
+
+def belt_elements(name, count, seed=None):
+    """
+        Draws random heliocentric elements for a population of small bodies.
+    Parameters
+    ----------
+    name    : str       a key of BELTS
+    count   : int       the number of bodies
+
+    Returns
+    -------
+    a, ecc, inc, raan, argp, nu     : np.ndarray(count,)    km and rad
+    """
+    spec = BELTS[name]
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(*spec['a'], count) * AU_KM,
+            rng.uniform(0.0, spec['ecc'], count),
+            np.radians(rng.uniform(0.0, spec['inc'], count)),
+            rng.uniform(0.0, 2 * np.pi, count),
+            rng.uniform(0.0, 2 * np.pi, count),
+            rng.uniform(0.0, 2 * np.pi, count),
+            )
+
+
+class SmallBodyField:
+    """
+        A population of massless or low-mass particles attracted by the major bodies.  The
+        attraction of the (few) major bodies is summed directly; the mutual attraction of the
+        particles, when they have mass, is approximated with a BarnesHutTree that is refit each
+        time it is evaluated and rebuilt every few evaluations.  The particles are seeded from
+        Keplerian elements about the primary, and are reseeded from them after a long jump of
+        the epoch instead of being integrated across it.
+
+    Parameters
+    ----------
+    elements    : tuple             a, ecc, inc, raan, argp, nu arrays (km, rad) about the primary
+    mu_primary  : float             gravitational parameter of the primary (km^3 / s^2)
+    epoch       : (jd1, jd2)        epoch of the elements
+    mu          : array-like(P,)    optional, gravitational parameter of each particle
+    theta       : float             opening angle of the tree
+    tree_every  : int               steps between evaluations of the self-gravity
+    major_pos   : np.ndarray(M, 3)  optional, positions of the major bodies at epoch, see seed()
+    """
+    def __init__(self, elements, mu_primary, epoch, mu=None, theta=DEF_THETA,
+                 softening=DEF_SOFTENING, max_step=DEF_FIELD_STEP, tree_every=DEF_TREE_EVERY,
+                 major_pos=None):
+        self._kepler = KeplerPropagator()
+        self._kepler.set_elements(*elements, mu_primary, epoch)
+        self._count = self._kepler.count
+        self._state = np.zeros((self._count, 3, 3), dtype=np.float64)
+        self._pos = self._state[:, 0]
+        self._vel = self._state[:, 1]
+        self._mu = None if mu is None else np.broadcast_to(np.asarray(mu, dtype=np.float64),
+                                                           (self._count,)).copy()
+        self._tree = BarnesHutTree(theta=theta, softening=softening) if self.has_mass else None
+        self._tree_every = max(1, int(tree_every))
+        self._tree_age = 0
+        self._self_acc = np.zeros((self._count, 3), dtype=np.float64)
+        self._acc = np.zeros((self._count, 3), dtype=np.float64)
+        self._eps2 = float(softening) ** 2
+        self._max_step = float(max_step)
+        self._major_prev = None
+        self._jd = None
+        self.seed(epoch, major_pos)
+
+    @classmethod
+    def from_belt(cls, name, count, mu_primary, epoch, seed=None, **kwargs):
+        return cls(belt_elements(name, count, seed), mu_primary, epoch, **kwargs)
+
+    def seed(self, jd, major_pos=None):
+        """
+            Sets the state of the particles to their Keplerian state at jd.  When the positions
+            of the major bodies at jd are given, the next advance() moves them from there rather
+            than holding them at their positions at the end of the step.
+        """
+        self._kepler.propagate(jd, out=self._state)
+        self._jd = jd
+        self._major_prev = None if major_pos is None else np.array(major_pos, dtype=np.float64)
+        self._tree_age = 0
+
+    def _major_accelerations(self, major_pos, major_mu):
+        """
+            Adds the attraction of the major bodies to self._acc, a chunk of particles at a time.
+            The frame is centred on the primary, which is itself accelerated by the other major
+            bodies, so that (indirect) acceleration is subtracted from every particle.
+        """
+        s2 = np.einsum('ij,ij->i', major_pos, major_pos)
+        off_centre = s2 > 0                             # the primary is at the origin
+        indirect = (major_pos[off_centre] *
+                    (major_mu[off_centre] / (s2[off_centre] * np.sqrt(s2[off_centre])))[:, None]).sum(axis=0)
+        for c0 in range(0, self._count, DEF_MAJOR_CHUNK):
+            d = major_pos[None, :, :] - self._pos[c0:c0 + DEF_MAJOR_CHUNK, None, :]
+            r2 = np.einsum('ijk,ijk->ij', d, d) + self._eps2
+            coef = major_mu[None, :] / (r2 * np.sqrt(r2))
+            self._acc[c0:c0 + DEF_MAJOR_CHUNK] += np.einsum('ij,ijk->ik', coef, d) - indirect
+
+    def accelerations(self, major_pos, major_mu):
+        """
+            The acceleration of every particle due to the major bodies and, if the particles
+            have mass, to each other, the latter only re-evaluated every tree_every calls.
+        """
+        if self._tree is not None:
+            if self._tree_age % self._tree_every == 0:
+                self._tree.update(self._pos, self._mu if self._tree_age == 0 else None)
+                self._tree.accelerations(self._pos, out=self._self_acc)
+            self._tree_age += 1
+            self._acc[:] = self._self_acc
+        else:
+            self._acc[:] = 0.0
+
+        self._major_accelerations(major_pos, major_mu)
+
+        return self._acc
+
+    def advance(self, jd, major_pos, major_mu):
+        """
+            Integrates the particles to jd with a kick-drift-kick leapfrog.  The major bodies
+            are moved linearly from their positions at the previous call to major_pos.
+
+        Parameters
+        ----------
+        jd          : (jd1, jd2)        the new epoch
+        major_pos   : np.ndarray(M, 3)  positions of the major bodies at jd, in the frame of the primary
+        major_mu    : np.ndarray(M,)    gravitational parameters of the major bodies
+        """
+        seconds = ((jd[0] - self._jd[0]) + (jd[1] - self._jd[1])) * SEC_PER_DAY
+        if abs(seconds) > DEF_MAX_JUMP:
+            self.seed(jd)
+        else:
+            start = major_pos if self._major_prev is None else self._major_prev
+            n_steps = int(np.ceil(abs(seconds) / self._max_step)) if seconds else 0
+            for k in range(n_steps):
+                dt = seconds / n_steps
+                frac0, frac1 = k / n_steps, (k + 1) / n_steps
+                self._vel += 0.5 * dt * self.accelerations(start + frac0 * (major_pos - start), major_mu)
+                self._pos += dt * self._vel
+                self._vel += 0.5 * dt * self.accelerations(start + frac1 * (major_pos - start), major_mu)
+            self._jd = jd
+
+        self._major_prev = major_pos.copy()
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def has_mass(self):
+        return self._mu is not None and bool(np.any(self._mu > 0))
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @property
+    def vel(self):
+        return self._vel
+
+    @property
+    def tree(self):
+        return self._tree
@@ -32,6 +32,8 @@ class SimObject(ABC):
     epoch0 = J2000_TDB.jd
     system = {}
     dist_unit = u.km
+    # the state is held as plain float64 in these units, Quantities are only built by the accessors
+    vel_unit = u.km / u.s
     # created = pyqtSignal(str)
     _fields = ('attr',
                'pos',
@@ -41,10 +43,11 @@ class SimObject(ABC):
 
     def __init__(self, *args, **kwargs):
         self._name       = ""
-        self._dist_unit  = u.km
+        self._dist_unit  = SimObject.dist_unit
+        self._vel_unit   = SimObject.vel_unit
         super(SimObject, self).__init__(*args, **kwargs)
         self._epoch      = Time(SimObject.epoch0, format='jd', scale='tdb')
-        self._state      = np.zeros((3,), dtype=VEC_TYPE)
+        self._state      = np.zeros((3, 3), dtype=np.float64)
         self._rad_set    = [MIN_SIZE, ] * 3
         self._plane      = Planes.EARTH_ECLIPTIC
         self._body       = None
@@ -114,17 +117,51 @@ class SimObject(ABC):
     def set_parent(self, new_parent=None):
         self._parent = new_parent
 
+    def bind_state(self, state_view=None, preserve=True):
+        """
+            Makes this object's state matrix a view into a row of a system state array,
+            so that a system-level propagator can write the state of every object at once.
+        Parameters
+        ----------
+        state_view  : np.ndarray(3, 3)     A row of the (N, 3, 3) system state array
+        preserve    : bool                 Copy the current state into the new row
+        """
+        if state_view is None:
+            self._state = self._state.copy()
+        else:
+            if preserve:
+                state_view[:] = self._state
+            self._state = state_view
+
+    @property
+    def r_arr(self):
+        """ position relative to the parent, as floats in dist_unit (a view of the state) """
+        return self._state[0]
+
+    @property
+    def v_arr(self):
+        """ velocity relative to the parent, as floats in vel_unit (a view of the state) """
+        return self._state[1]
+
+    @property
+    def pos_arr(self):
+        return self._state[0]
+
+    @property
+    def vel_arr(self):
+        return self._state[1]
+
     @property
     def r(self):
-        return self._state[0] * self._dist_unit
+        return u.Quantity(self.r_arr, self._dist_unit)
 
     @property
     def v(self):
-        return self._state[1] * self._dist_unit / u.s
+        return u.Quantity(self.v_arr, self._vel_unit)
 
     @property
     def pos(self):
-        return self._state[0] * self._dist_unit
+        return u.Quantity(self.pos_arr, self._dist_unit)
 
     @property
     def rot(self):
@@ -136,8 +173,8 @@ class SimObject(ABC):
 
     @property
     def track(self):
-        if self._trajectory:
-            return self._trajectory.xyz.transpose().value
+        """ The orbit track, a float32 (K, 3) array relative to the parent, in dist_unit. """
+        return self._trajectory
 
     @property
     def plane(self):
@@ -220,7 +257,7 @@ class SimObject(ABC):
         -------
         velocity of body relative to its parent body
         """
-        return self._state[1] * self._dist_unit / u.s
+        return u.Quantity(self.vel_arr, self._vel_unit)
 
     @epoch.setter
     def epoch(self, e=None):
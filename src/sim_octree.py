@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the BarnesHutTree class, a linear octree used to approximate the
+    gravitational attraction of a large population of low-mass bodies.  The sources are sorted
+    by their Morton (Z-order) code, so that every node of the tree is a contiguous run of the
+    sorted sources and each level of the tree is built with a few array operations.  The tree
+    is walked for all targets at once: each (target, node) pair is either accepted, when the
+    node looks small enough from the target (size / distance < theta), or replaced by the
+    pairs of the node's children.
+
+    Building the tree (sorting) is the expensive part.  Between rebuilds the topology is kept
+    and only the masses, centres of mass and extents of the nodes are refit to the moved
+    sources, which stays exact, only less efficient as the sources drift apart.
+"""
+import logging
+import numpy as np
+
+logging.basicConfig(filename="../logs/sns_octree.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_THETA = 0.5             # opening angle, smaller is more accurate and slower
+DEF_MAX_DEPTH = 16          # levels below the root, Morton codes use 3 bits per level
+DEF_REBUILD_EVERY = 8       # updates between rebuilds of the tree, refits in between
+DEF_TARGET_CHUNK = 8192     # targets walked together, bounds the memory of the pair lists
+
+
+def morton_codes(q):
+    """
+        Interleaves the bits of integer coordinates into Morton codes.
+    Parameters
+    ----------
+    q       : np.ndarray(N, 3)      non-negative integer coordinates, below 2 ** 21
+
+    Returns
+    -------
+    np.ndarray(N,) of uint64
+    """
+    res = np.zeros((len(q),), dtype=np.uint64)
+    for axis in range(3):
+        x = q[:, axis].astype(np.uint64)
+        x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+        x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+        x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+        x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+        x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+        res |= x << np.uint64(2 - axis)
+
+    return res
+
+
+class BarnesHutTree:
+    """
+        A linear octree over a set of gravitating sources.
+
+    Parameters
+    ----------
+    theta           : float     opening angle
+    softening       : float     softening length (km)
+    max_depth       : int       levels below the root
+    rebuild_every   : int       calls to update() between rebuilds, refits in between
+    """
+    def __init__(self, theta=DEF_THETA, softening=0.0, max_depth=DEF_MAX_DEPTH,
+                 rebuild_every=DEF_REBUILD_EVERY):
+        self._theta2 = float(theta) ** 2
+        self._eps2 = float(softening) ** 2
+        self._max_depth = min(int(max_depth), 21)
+        self._rebuild_every = max(1, int(rebuild_every))
+        self._since_build = 0
+        self._order = None
+        self._mu = None
+        self._levels = []           # (first node, node starts) of each level
+        self._node_start = None
+        self._node_count = None
+        self._child_first = None
+        self._child_n = None
+        self._mass = None
+        self._com = None
+        self._size = None
+
+    def build(self, pos, mu):
+        """
+            Sorts the sources in Morton order and builds the node hierarchy, down to the level
+            where every node holds a single source (or to max_depth).
+        """
+        pos = np.asarray(pos, dtype=np.float64)
+        lo = pos.min(axis=0)
+        span = float((pos.max(axis=0) - lo).max()) or 1.0
+        n_cells = 1 << self._max_depth
+        q = np.minimum(((pos - lo) * (n_cells / span)).astype(np.int64), n_cells - 1)
+        codes = morton_codes(q)
+        self._order = np.argsort(codes, kind='stable')
+        codes = codes[self._order]
+        self._mu = np.asarray(mu, dtype=np.float64)[self._order]
+
+        starts, counts, firsts = [], [], []
+        n_nodes = 0
+        for lvl in range(self._max_depth + 1):
+            prefix = codes >> np.uint64(3 * (self._max_depth - lvl))
+            lvl_starts = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+            starts.append(lvl_starts)
+            counts.append(np.diff(np.r_[lvl_starts, len(codes)]))
+            firsts.append(n_nodes)
+            n_nodes += len(lvl_starts)
+            if counts[-1].max() == 1:
+                break
+
+        child_first, child_n = [], []
+        for lvl in range(len(starts)):
+            if lvl + 1 < len(starts):
+                lo_idx = np.searchsorted(starts[lvl + 1], starts[lvl])
+                hi_idx = np.searchsorted(starts[lvl + 1], starts[lvl] + counts[lvl])
+                leaf = counts[lvl] == 1
+                child_first.append(firsts[lvl + 1] + lo_idx)
+                child_n.append(np.where(leaf, 0, hi_idx - lo_idx))
+            else:
+                child_first.append(np.zeros_like(starts[lvl]))
+                child_n.append(np.zeros_like(starts[lvl]))
+
+        self._levels = list(zip(firsts, starts))
+        self._node_start = np.concatenate(starts)
+        self._node_count = np.concatenate(counts)
+        self._child_first = np.concatenate(child_first)
+        self._child_n = np.concatenate(child_n)
+        self._mass = np.zeros((n_nodes,), dtype=np.float64)
+        self._com = np.zeros((n_nodes, 3), dtype=np.float64)
+        self._size = np.zeros((n_nodes,), dtype=np.float64)
+        self._since_build = 0
+        self.refit(pos)
+
+    def refit(self, pos):
+        """
+            Recomputes the mass, centre of mass and extent of every node for the moved sources,
+            keeping the topology of the last build.
+        """
+        p = np.asarray(pos, dtype=np.float64)[self._order]
+        mp = p * self._mu[:, None]
+        for first, starts in self._levels:
+            sl = slice(first, first + len(starts))
+            mass = np.add.reduceat(self._mu, starts)
+            msum = np.add.reduceat(mp, starts, axis=0)
+            psum = np.add.reduceat(p, starts, axis=0)
+            has_mass = mass > 0
+            self._com[sl] = np.where(has_mass[:, None], msum / np.where(has_mass, mass, 1.0)[:, None],
+                                     psum / self._node_count[sl, None])
+            single = self._node_count[sl] == 1         # exact, so that a source skips itself
+            self._com[sl][single] = p[starts[single]]
+            self._mass[sl] = mass
+            self._size[sl] = (np.maximum.reduceat(p, starts, axis=0) -
+                              np.minimum.reduceat(p, starts, axis=0)).max(axis=1)
+
+    def update(self, pos, mu=None):
+        """ Rebuilds the tree every rebuild_every calls (or when mu is given), refits it otherwise. """
+        self._since_build += 1
+        if mu is not None or self._order is None or self._since_build >= self._rebuild_every:
+            self.build(pos, self._mu_unsorted() if mu is None else mu)
+        else:
+            self.refit(pos)
+
+    def _mu_unsorted(self):
+        res = np.empty_like(self._mu)
+        res[self._order] = self._mu
+        return res
+
+    def accelerations(self, targets, out=None, chunk=DEF_TARGET_CHUNK):
+        """
+            Approximates the acceleration of each target due to all of the sources.
+
+        Parameters
+        ----------
+        targets : np.ndarray(T, 3)      positions (km)
+        out     : np.ndarray(T, 3)      optional, the array to write the accelerations into
+
+        Returns
+        -------
+        out     : np.ndarray(T, 3)      accelerations (km / s^2)
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        if out is None:
+            out = np.zeros((len(targets), 3), dtype=np.float64)
+        else:
+            out[:] = 0.0
+
+        for c0 in range(0, len(targets), chunk):
+            self._walk(targets[c0:c0 + chunk], out[c0:c0 + chunk])
+
+        return out
+
+    def _walk(self, tgt, acc):
+        n_tgt = len(tgt)
+        ti = np.arange(n_tgt)
+        ni = np.zeros((n_tgt,), dtype=np.intp)      # every walk starts at the root
+        while ti.size:
+            d = self._com[ni] - tgt[ti]
+            r2 = np.einsum('ij,ij->i', d, d) + self._eps2
+            accept = (self._child_n[ni] == 0) | (self._size[ni] ** 2 < self._theta2 * r2)
+
+            a_ti, a_d, a_r2, a_m = ti[accept], d[accept], r2[accept], self._mass[ni[accept]]
+            valid = a_r2 > 0                        # a target is not attracted by itself
+            coef = np.zeros_like(a_r2)
+            coef[valid] = a_m[valid] / (a_r2[valid] * np.sqrt(a_r2[valid]))
+            for axis in range(3):
+                acc[:, axis] += np.bincount(a_ti, weights=coef * a_d[:, axis], minlength=n_tgt)
+
+            o_ti, o_ni = ti[~accept], ni[~accept]
+            n_kids = self._child_n[o_ni]
+            total = int(n_kids.sum())
+            ti = np.repeat(o_ti, n_kids)
+            ni = (np.repeat(self._child_first[o_ni], n_kids) +
+                  np.arange(total) - np.repeat(np.cumsum(n_kids) - n_kids, n_kids))
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def theta(self):
+        return np.sqrt(self._theta2)
+
+    @theta.setter
+    def theta(self, new_theta):
+        self._theta2 = float(new_theta) ** 2
+
+    @property
+    def node_count(self):
+        return 0 if self._mass is None else len(self._mass)
+
+    @property
+    def depth(self):
+        return len(self._levels) - 1
+
+    @property
+    def rebuild_every(self):
+        return self._rebuild_every
+
+    @rebuild_every.setter
+    def rebuild_every(self, new_val):
+        self._rebuild_every = max(1, int(new_val))
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the FrameProfiler class, which collects the duration of named spans of
+    the model/view loop (propagation, aggregation, transform upload, canvas draw, ...) into fixed
+    size ring buffers and reports their percentiles.  A cProfile or pyinstrument capture of the
+    whole loop can be toggled on and off, and the statistics can be exported to JSON or CSV.
+    A single module-level instance, PROFILER, is shared by the model and the viewer.
+"""
+import io
+import csv
+import json
+import time
+import pstats
+import logging
+import cProfile
+import numpy as np
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logging.basicConfig(filename="../logs/sns_profile.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_RING_SIZE = 1024            # number of samples kept for each span
+DEF_PROFILE_DIR = "../logs/"
+PERCENTILES = (50, 95, 99)
+
+
+class SpanStats:
+    """
+        A ring buffer of the most recent durations (in seconds) of one span.
+    """
+    def __init__(self, size=DEF_RING_SIZE):
+        self._samples = np.zeros((size,), dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._total = 0
+
+    def add(self, seconds):
+        self._samples[self._next] = seconds
+        self._next = (self._next + 1) % len(self._samples)
+        self._count = min(self._count + 1, len(self._samples))
+        self._total += 1
+
+    @property
+    def samples(self):
+        """ The samples held, oldest first. """
+        if self._count < len(self._samples):
+            return self._samples[:self._count].copy()
+
+        return np.roll(self._samples, -self._next)
+
+    @property
+    def last(self):
+        """ The most recent sample, 0 if there is none. """
+        return self._samples[self._next - 1] if self._count else 0.0
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict    : the number of samples recorded, and the mean, percentiles and maximum
+                  of the samples held, in milliseconds
+        """
+        res = dict(count=self._total)
+        if self._count == 0:
+            return res
+
+        data = self._samples[:self._count] * 1e3
+        res.update(mean=float(data.mean()))
+        res.update({f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(data, PERCENTILES))})
+        res.update(max=float(data.max()))
+
+        return res
+
+
+class FrameProfiler:
+    """
+        Collects named span timings.  When disabled, span() and record() do nothing.
+    """
+    def __init__(self, ring_size=DEF_RING_SIZE, enabled=True):
+        self._ring_size = ring_size
+        self._enabled = enabled
+        self._spans = {}
+        self._last_frame = None
+        self._capture = None
+        self._capture_mode = None
+
+    @contextmanager
+    def span(self, name):
+        """
+            Times the enclosed block as one sample of the named span.
+
+            with PROFILER.span('propagate'):
+                ...
+        """
+        if not self._enabled:
+            yield
+            return
+
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name, seconds):
+        if not self._enabled:
+            return
+
+        if name not in self._spans:
+            self._spans[name] = SpanStats(self._ring_size)
+        self._spans[name].add(seconds)
+
+    def mark_frame(self, name='frame'):
+        """ Records the time since the previous call as one sample of the named span. """
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            self.record(name, now - self._last_frame)
+        self._last_frame = now
+
+    def last(self, name):
+        """ The most recent duration of the named span (seconds), 0 if it has not been recorded. """
+        return self._spans[name].last if name in self._spans else 0.0
+
+    def summary(self):
+        return {name: stats.summary() for name, stats in self._spans.items()}
+
+    def report(self):
+        """ Returns the summary as a text table, for the caller to show; nothing is printed here. """
+        lines = [f'{"span":<16}{"count":>8}{"mean":>10}' +
+                 ''.join([f'{"p" + str(p):>10}' for p in PERCENTILES]) + f'{"max":>10}  (ms)']
+        for name, stats in self.summary().items():
+            if 'mean' in stats:
+                lines.append(f'{name:<16}{stats["count"]:>8}{stats["mean"]:>10.3f}' +
+                             ''.join([f'{stats["p" + str(p)]:>10.3f}' for p in PERCENTILES]) +
+                             f'{stats["max"]:>10.3f}')
+
+        return '\n'.join(lines)
+
+    def reset(self):
+        self._spans.clear()
+        self._last_frame = None
+
+    def start_capture(self, mode='cprofile'):
+        """
+            Starts a capture of every function call until stop_capture() is called.
+        Parameters
+        ----------
+        mode    : str       'cprofile' or 'pyinstrument' (if it is installed)
+        """
+        if self._capture is not None:
+            return
+
+        if mode == 'pyinstrument':
+            if pyinstrument is None:
+                logging.warning("pyinstrument is not installed, using cProfile")
+                mode = 'cprofile'
+            else:
+                self._capture = pyinstrument.Profiler()
+
+        if mode == 'cprofile':
+            self._capture = cProfile.Profile()
+
+        self._capture_mode = mode
+        self._capture.start() if mode == 'pyinstrument' else self._capture.enable()
+        logging.info("Profile capture started (%s)", mode)
+
+    def stop_capture(self, fname=None):
+        """
+            Stops the capture and writes it out.
+        Parameters
+        ----------
+        fname   : str       where to write the capture; '.prof' files receive the raw cProfile
+                            stats (pyinstrument writes HTML), anything else a text report
+
+        Returns
+        -------
+        str     : the text report of the capture
+        """
+        if self._capture is None:
+            return None
+
+        if self._capture_mode == 'pyinstrument':
+            self._capture.stop()
+            res = self._capture.output_text()
+            if fname:
+                with open(fname, 'w') as f:
+                    f.write(self._capture.output_html() if fname.endswith('.html') else res)
+        else:
+            self._capture.disable()
+            buff = io.StringIO()
+            pstats.Stats(self._capture, stream=buff).sort_stats('tottime').print_stats(40)
+            res = buff.getvalue()
+            if fname and fname.endswith('.prof'):
+                self._capture.dump_stats(fname)
+            elif fname:
+                with open(fname, 'w') as f:
+                    f.write(res)
+
+        self._capture = None
+        logging.info("Profile capture stopped (%s)", self._capture_mode)
+
+        return res
+
+    def toggle_capture(self, mode='cprofile', fname=None):
+        if self._capture is None:
+            self.start_capture(mode)
+        else:
+            self.stop_capture(fname)
+
+    def export_json(self, fname=DEF_PROFILE_DIR + "sns_frame_stats.json", with_samples=False):
+        res = self.summary()
+        if with_samples:
+            for name, stats in self._spans.items():
+                res[name].update(samples_ms=(stats.samples * 1e3).tolist())
+        with open(fname, 'w') as f:
+            json.dump(res, f, indent=2)
+
+    def export_csv(self, fname=DEF_PROFILE_DIR + "sns_frame_stats.csv"):
+        fields = ['span', 'count', 'mean'] + [f'p{p}' for p in PERCENTILES] + ['max']
+        with open(fname, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for name, stats in self.summary().items():
+                writer.writerow(dict(span=name, **stats))
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, new_state=True):
+        self._enabled = new_state
+
+    @property
+    def is_capturing(self):
+        return self._capture is not None
+
+    @property
+    def span_names(self):
+        return tuple(self._spans.keys())
+
+
+PROFILER = FrameProfiler()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the IAU rotation models of the bodies as tables of coefficients,
+    and the IAURotation class, which evaluates the RA, DEC and W rotational elements of every
+    body of the system in one NumPy pass, for one epoch or for an array of epochs.
+
+    Each model is
+        ra  = ra0 + ra1 * T                 + sum(amp * sin|cos(arg))
+        dec = dec0 + dec1 * T               + sum(amp * sin|cos(arg))
+        W   = W0 + W1 * d + W2 * d ** 2     + sum(amp * sin|cos(arg))
+    where each argument is phase + rate * T (or d), all in degrees.  T is in Julian centuries
+    and d in days since J2000 TDB.  The values are those of the functions in
+    poliastro.core.fixed (IAU WGCCRE 2015, and 2009 for the Moon), W is returned modulo 360.
+"""
+import logging
+import numpy as np
+
+logging.basicConfig(filename="../logs/sns_rotation.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+# the periodic terms are (element, 'sin' | 'cos', amplitude, argument)
+# the arguments are name: (phase, rate, 'T' | 'd')
+IAU_ROT_MODELS = {
+    'sun': dict(ra=(286.13, 0.0),
+                dec=(63.87, 0.0),
+                W=(84.176, 14.1844000, 0.0),
+                ),
+    'mercury': dict(ra=(281.0103, -0.0328),
+                    dec=(61.45, -0.005),
+                    W=(329.5988, 6.1385108, 0.0),
+                    args={'M1': (174.7910857, 4.092335, 'd'),
+                          'M2': (349.5821714, 8.184670, 'd'),
+                          'M3': (164.3732571, 12.277005, 'd'),
+                          'M4': (339.1643429, 16.369340, 'd'),
+                          'M5': (153.9554286, 20.461675, 'd'),
+                          },
+                    terms=(('W', 'sin', 0.01067257, 'M1'),
+                           ('W', 'sin', -0.00112309, 'M2'),
+                           ('W', 'sin', -0.00011040, 'M3'),
+                           ('W', 'sin', -0.00002539, 'M4'),
+                           ('W', 'sin', -0.00000571, 'M5'),
+                           ),
+                    ),
+    'venus': dict(ra=(272.76, 0.0),
+                  dec=(67.16, 0.0),
+                  W=(160.20, -1.4813688, 0.0),
+                  ),
+    # the simplified model of the Earth used by this simulation: a fixed tilt, one turn per day
+    'earth': dict(ra=(0.0, 0.0),
+                  dec=(90.0 - 23.5, 0.0),
+                  W=(0.0, 360.0, 0.0),
+                  ),
+    'mars': dict(ra=(317.269202, -0.10927547),
+                 dec=(54.432516, -0.05827105),
+                 W=(176.049863, 350.891982443297, 0.0),
+                 args={'M1': (198.991226, 19139.4819985, 'T'),
+                       'M2': (226.292679, 38280.8511281, 'T'),
+                       'M3': (249.663391, 57420.7251593, 'T'),
+                       'M4': (266.183510, 76560.6367950, 'T'),
+                       'M5': (79.398797, 0.5042615, 'T'),
+                       'K1': (122.433576, 19139.9407476, 'T'),
+                       'K2': (43.058401, 38280.8753272, 'T'),
+                       'K3': (57.663379, 57420.7517205, 'T'),
+                       'K4': (79.476401, 76560.6495004, 'T'),
+                       'K5': (166.325722, 0.5042615, 'T'),
+                       'J1': (129.071773, 19140.0328244, 'T'),
+                       'J2': (36.352167, 38281.0473591, 'T'),
+                       'J3': (56.668646, 57420.9295360, 'T'),
+                       'J4': (67.364003, 76560.2552215, 'T'),
+                       'J5': (104.792680, 95700.4387578, 'T'),
+                       'J6': (95.391654, 0.5042615, 'T'),
+                       },
+                 terms=(('ra', 'sin', 0.000068, 'M1'),
+                        ('ra', 'sin', 0.000238, 'M2'),
+                        ('ra', 'sin', 0.000052, 'M3'),
+                        ('ra', 'sin', 0.000009, 'M4'),
+                        ('ra', 'sin', 0.419057, 'M5'),
+                        ('dec', 'cos', 0.000051, 'K1'),
+                        ('dec', 'cos', 0.000141, 'K2'),
+                        ('dec', 'cos', 0.000031, 'K3'),
+                        ('dec', 'cos', 0.000005, 'K4'),
+                        ('dec', 'cos', 1.591274, 'K5'),
+                        ('W', 'sin', 0.000145, 'J1'),
+                        ('W', 'sin', 0.000157, 'J2'),
+                        ('W', 'sin', 0.000040, 'J3'),
+                        ('W', 'sin', 0.000001, 'J4'),
+                        ('W', 'sin', 0.000001, 'J5'),
+                        ('W', 'sin', 0.584542, 'J6'),
+                        ),
+                 ),
+    'jupiter': dict(ra=(268.056595, -0.006499),
+                    dec=(64.495303, 0.002413),
+                    W=(284.95, 870.536, 0.0),
+                    args={'Ja': (99.360714, 4850.4046, 'T'),
+                          'Jb': (175.895369, 1191.9605, 'T'),
+                          'Jc': (300.323162, 262.5475, 'T'),
+                          'Jd': (114.012305, 6070.2476, 'T'),
+                          'Je': (49.511251, 64.3000, 'T'),
+                          },
+                    terms=(('ra', 'sin', 0.000117, 'Ja'),
+                           ('ra', 'sin', 0.000938, 'Jb'),
+                           ('ra', 'sin', 0.001432, 'Jc'),
+                           ('ra', 'sin', 0.000030, 'Jd'),
+                           ('ra', 'sin', 0.002150, 'Je'),
+                           ('dec', 'cos', 0.000050, 'Ja'),
+                           ('dec', 'cos', 0.000404, 'Jb'),
+                           ('dec', 'cos', 0.000617, 'Jc'),
+                           ('dec', 'cos', -0.000013, 'Jd'),
+                           ('dec', 'cos', 0.000926, 'Je'),
+                           ),
+                    ),
+    'saturn': dict(ra=(40.589, -0.036),
+                   dec=(83.537, -0.004),
+                   W=(38.90, 810.7939024, 0.0),
+                   ),
+    'uranus': dict(ra=(257.311, 0.0),
+                   dec=(-15.175, 0.0),
+                   W=(203.81, -501.1600928, 0.0),
+                   ),
+    'neptune': dict(ra=(299.36, 0.0),
+                    dec=(43.46, 0.0),
+                    W=(249.978, 541.1397757, 0.0),
+                    args={'N': (357.85, 52.316, 'T')},
+                    terms=(('ra', 'sin', 0.70, 'N'),
+                           ('dec', 'cos', -0.51, 'N'),
+                           ('W', 'sin', -0.48, 'N'),
+                           ),
+                    ),
+    'moon': dict(ra=(269.9949, 0.0031),
+                 dec=(66.5392, 0.0130),
+                 W=(38.3213, 13.17635815, -1.4e-12),
+                 args={'E1': (125.045, -0.0529921, 'd'),
+                       'E2': (250.089, -0.1059842, 'd'),
+                       'E3': (260.008, 13.0120009, 'd'),
+                       'E4': (176.625, 13.3407154, 'd'),
+                       'E5': (357.529, 0.9856003, 'd'),
+                       'E6': (311.589, 26.4057084, 'd'),
+                       'E7': (134.963, 13.0649930, 'd'),
+                       'E8': (276.617, 0.3287146, 'd'),
+                       'E9': (34.226, 1.7484877, 'd'),
+                       'E10': (15.134, -0.1589763, 'd'),
+                       'E11': (119.743, 0.0036096, 'd'),
+                       'E12': (239.961, 0.1643573, 'd'),
+                       'E13': (25.053, 12.9590088, 'd'),
+                       },
+                 terms=(('ra', 'sin', -3.8787, 'E1'),
+                        ('ra', 'sin', -0.1204, 'E2'),
+                        ('ra', 'sin', 0.0700, 'E3'),
+                        ('ra', 'sin', -0.0172, 'E4'),
+                        ('ra', 'sin', 0.0072, 'E6'),
+                        ('ra', 'sin', -0.0052, 'E10'),
+                        ('ra', 'sin', 0.0043, 'E13'),
+                        ('dec', 'cos', 1.5419, 'E1'),
+                        ('dec', 'cos', 0.0239, 'E2'),
+                        ('dec', 'cos', -0.0278, 'E3'),
+                        ('dec', 'cos', 0.0068, 'E4'),
+                        ('dec', 'cos', -0.0029, 'E6'),
+                        ('dec', 'cos', 0.0009, 'E7'),
+                        ('dec', 'cos', 0.0008, 'E10'),
+                        ('dec', 'cos', -0.0009, 'E13'),
+                        ('W', 'sin', 3.5610, 'E1'),
+                        ('W', 'sin', 0.1208, 'E2'),
+                        ('W', 'sin', -0.0642, 'E3'),
+                        ('W', 'sin', 0.0158, 'E4'),
+                        ('W', 'sin', 0.0252, 'E5'),
+                        ('W', 'sin', -0.0066, 'E6'),
+                        ('W', 'sin', -0.0047, 'E7'),
+                        ('W', 'sin', -0.0046, 'E8'),
+                        ('W', 'sin', 0.0028, 'E9'),
+                        ('W', 'sin', 0.0052, 'E10'),
+                        ('W', 'sin', 0.0040, 'E11'),
+                        ('W', 'sin', 0.0019, 'E12'),
+                        ('W', 'sin', -0.0044, 'E13'),
+                        ),
+                 ),
+}
+_ELEMENTS = ('ra', 'dec', 'W')
+
+
+def rotation_matrices(rot):
+    """
+        The matrices that take vectors from the body fixed frame of each body into the
+        reference frame:  R = Rz(ra + 90) @ Rx(90 - dec) @ Rz(W)  (column vector convention).
+    Parameters
+    ----------
+    rot     : np.ndarray(..., 3)    RA, DEC and W (deg)
+
+    Returns
+    -------
+    np.ndarray(..., 3, 3)
+    """
+    rot = np.deg2rad(np.asarray(rot, dtype=np.float64))
+    a = rot[..., 0] + np.pi / 2
+    b = np.pi / 2 - rot[..., 1]
+    w = rot[..., 2]
+    ca, sa = np.cos(a), np.sin(a)
+    cb, sb = np.cos(b), np.sin(b)
+    cw, sw = np.cos(w), np.sin(w)
+    res = np.empty(rot.shape[:-1] + (3, 3), dtype=np.float64)
+    res[..., 0, 0] = ca * cw - sa * cb * sw
+    res[..., 0, 1] = -ca * sw - sa * cb * cw
+    res[..., 0, 2] = sa * sb
+    res[..., 1, 0] = sa * cw + ca * cb * sw
+    res[..., 1, 1] = -sa * sw + ca * cb * cw
+    res[..., 1, 2] = -ca * sb
+    res[..., 2, 0] = sb * sw
+    res[..., 2, 1] = sb * cw
+    res[..., 2, 2] = cb
+
+    return res
+
+
+class IAURotation:
+    """
+        Evaluates the rotation models of a list of bodies together.  The models are compiled
+        into flat coefficient arrays:  a polynomial part for each of the 3 * N elements, and
+        one row per periodic term, mapped onto its element by a (terms, 3 * N) matrix.
+
+    Parameters
+    ----------
+    model_keys  : list of str       the key in IAU_ROT_MODELS of each body, in system order
+    """
+    def __init__(self, model_keys, models=IAU_ROT_MODELS):
+        self._keys = tuple(model_keys)
+        n = len(self._keys)
+        self._c0 = np.zeros((3 * n,), dtype=np.float64)
+        self._cT = np.zeros((3 * n,), dtype=np.float64)
+        self._cd = np.zeros((3 * n,), dtype=np.float64)
+        self._cd2 = np.zeros((3 * n,), dtype=np.float64)
+        self._is_W = np.zeros((3 * n,), dtype=bool)
+
+        phase, rate_T, rate_d = [], [], []
+        term_arg, term_cos, term_amp, term_col = [], [], [], []
+        for i, key in enumerate(self._keys):
+            mdl = models[key]
+            self._c0[3 * i:3 * i + 3] = mdl['ra'][0], mdl['dec'][0], mdl['W'][0]
+            self._cT[3 * i:3 * i + 2] = mdl['ra'][1], mdl['dec'][1]
+            self._cd[3 * i + 2] = mdl['W'][1]
+            self._cd2[3 * i + 2] = mdl['W'][2]
+            self._is_W[3 * i + 2] = True
+            arg_idx = {}
+            for name, (p, r, unit) in mdl.get('args', {}).items():
+                arg_idx[name] = len(phase)
+                phase.append(p)
+                rate_T.append(r if unit == 'T' else 0.0)
+                rate_d.append(r if unit == 'd' else 0.0)
+            for elem, func, amp, arg in mdl.get('terms', ()):
+                term_arg.append(arg_idx[arg])
+                term_cos.append(func == 'cos')
+                term_amp.append(amp)
+                term_col.append(3 * i + _ELEMENTS.index(elem))
+
+        self._phase = np.array(phase, dtype=np.float64)
+        self._rate_T = np.array(rate_T, dtype=np.float64)
+        self._rate_d = np.array(rate_d, dtype=np.float64)
+        self._term_arg = np.array(term_arg, dtype=np.intp)
+        self._term_cos = np.array(term_cos, dtype=bool)
+        self._term_map = np.zeros((len(term_amp), 3 * n), dtype=np.float64)
+        self._term_map[np.arange(len(term_amp)), term_col] = term_amp
+        logging.info("IAURotation: %s bodies, %s arguments, %s terms", n, len(phase), len(term_amp))
+
+    def evaluate(self, T, d, out=None):
+        """
+            Evaluates RA, DEC and W for every body.
+        Parameters
+        ----------
+        T       : float or np.ndarray(K,)       Julian centuries since J2000 TDB
+        d       : float or np.ndarray(K,)       days since J2000 TDB
+        out     : np.ndarray(N, 3) or (K, N, 3) optional, where to write the result
+
+        Returns
+        -------
+        np.ndarray(N, 3) for a scalar epoch, or (K, N, 3) for K epochs  (deg)
+        """
+        T = np.asarray(T, dtype=np.float64)
+        d = np.asarray(d, dtype=np.float64)
+        t_col, d_col = T[..., None], d[..., None]
+        res = self._c0 + t_col * self._cT + d_col * self._cd + d_col * d_col * self._cd2
+        if len(self._term_arg):
+            args = np.deg2rad(self._phase + t_col * self._rate_T + d_col * self._rate_d)
+            trig = np.where(self._term_cos, np.cos(args)[..., self._term_arg], np.sin(args)[..., self._term_arg])
+            res = res + trig @ self._term_map
+        res[..., self._is_W] = np.remainder(res[..., self._is_W], 360.0)
+        res = res.reshape(T.shape + (len(self._keys), 3))
+        if out is None:
+            return res
+
+        out[...] = res
+        return out
+
+    def matrices(self, T, d):
+        """ The body fixed to reference frame rotation matrix of every body, (N, 3, 3) or (K, N, 3, 3). """
+        return rotation_matrices(self.evaluate(T, d))
+
+    @property
+    def model_keys(self):
+        return self._keys
+
+    @property
+    def count(self):
+        return len(self._keys)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the FrameScheduler class, which paces the model/view loop.
+    Epoch changes are submitted as they happen and coalesced, so that each frame propagates
+    the model only to the latest epoch; frames with no pending epoch are skipped.  The cost
+    of the model step and of the render is measured on every frame and smoothed, and the
+    interval to the next frame is stretched to fit that cost, so that a slow frame delays the
+    next one instead of leaving a backlog of ticks behind it.
+
+    The scheduler holds no timer of its own.  The owner runs one frame per timeout of a
+    single-shot timer and restarts it with next_interval.
+"""
+import time
+import logging
+import psygnal
+
+logging.basicConfig(filename="../logs/sns_sched.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_TARGET_MS = 16.0        # the frame interval aimed for when the frames are cheap
+DEF_MAX_MS = 250.0          # the longest interval, however costly the frames
+DEF_HEADROOM = 1.25         # interval / frame cost, leaves time for the event loop and input
+DEF_SMOOTHING = 0.2         # weight of the newest sample in the moving averages
+
+
+class FrameScheduler:
+    """
+        Coalesces epoch updates and adapts the frame interval to the measured frame cost.
+
+    Parameters
+    ----------
+    model_fn    : callable(jd1, jd2)    propagates the model to an epoch
+    render_fn   : callable()            pushes the model state to the visuals
+    draw_cost_fn: callable() -> float   optional, seconds taken by the last canvas draw
+    target_ms   : float                 the shortest frame interval
+    max_ms      : float                 the longest frame interval
+    """
+    frame_done = psygnal.Signal(float, float)       # model and render time of the frame (ms)
+
+    def __init__(self, model_fn, render_fn, draw_cost_fn=None,
+                 target_ms=DEF_TARGET_MS, max_ms=DEF_MAX_MS,
+                 headroom=DEF_HEADROOM, smoothing=DEF_SMOOTHING):
+        self._model_fn = model_fn
+        self._render_fn = render_fn
+        self._draw_cost_fn = draw_cost_fn
+        self._target_ms = target_ms
+        self._max_ms = max_ms
+        self._headroom = headroom
+        self._smoothing = smoothing
+        self._pending = None
+        self._model_ms = 0.0
+        self._render_ms = 0.0
+        self._n_frames = 0
+        self._n_coalesced = 0
+        self._n_skipped = 0
+
+    def submit(self, jd1, jd2=0.0):
+        """ Makes (jd1, jd2) the epoch of the next frame, replacing any epoch still pending. """
+        if self._pending is not None:
+            self._n_coalesced += 1
+        self._pending = (jd1, jd2)
+
+    def run_frame(self):
+        """
+            Propagates the model to the pending epoch and renders it.
+
+        Returns
+        -------
+        bool    : False if there was no pending epoch, and the frame was skipped
+        """
+        if self._pending is None:
+            self._n_skipped += 1
+            return False
+
+        epoch, self._pending = self._pending, None
+        t0 = time.perf_counter()
+        self._model_fn(*epoch)
+        t1 = time.perf_counter()
+        self._render_fn()
+        t2 = time.perf_counter()
+
+        draw_sec = self._draw_cost_fn() if self._draw_cost_fn is not None else 0.0
+        self._model_ms = self._smooth(self._model_ms, (t1 - t0) * 1e3)
+        self._render_ms = self._smooth(self._render_ms, ((t2 - t1) + (draw_sec or 0.0)) * 1e3)
+        self._n_frames += 1
+        self.frame_done.emit((t1 - t0) * 1e3, (t2 - t1) * 1e3)
+        logging.debug("frame %s: model %.3f ms, render %.3f ms, next in %.1f ms",
+                      self._n_frames, self._model_ms, self._render_ms, self.next_interval)
+
+        return True
+
+    def _smooth(self, avg, sample):
+        if self._n_frames == 0:
+            return sample
+
+        return avg + self._smoothing * (sample - avg)
+
+    def reset_stats(self):
+        self._n_frames = self._n_coalesced = self._n_skipped = 0
+        self._model_ms = self._render_ms = 0.0
+
+    @property
+    def next_interval(self):
+        """ Milliseconds to wait before the next frame. """
+        cost = (self._model_ms + self._render_ms) * self._headroom
+        return min(max(self._target_ms, cost), self._max_ms)
+
+    @property
+    def has_pending(self):
+        return self._pending is not None
+
+    @property
+    def frame_cost(self):
+        """ The smoothed cost of the model step and of the render (ms). """
+        return self._model_ms, self._render_ms
+
+    @property
+    def stats(self):
+        return dict(frames=self._n_frames,
+                    coalesced=self._n_coalesced,
+                    skipped=self._n_skipped,
+                    model_ms=self._model_ms,
+                    render_ms=self._render_ms,
+                    interval_ms=self.next_interval,
+                    )
+
+    @property
+    def target_ms(self):
+        return self._target_ms
+
+    @target_ms.setter
+    def target_ms(self, new_target):
+        self._target_ms = max(1.0, float(new_target))
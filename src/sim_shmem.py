@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the StateBuffers class, a pair of SharedMemory segments holding
+    the (N, 3, 3) system state plus a small control segment with a generation counter.
+
+    The model process writes into the back buffer and then increments the generation,
+    which flips the back buffer to the front.  The viewer maps the front buffer as a
+    zero-copy NumPy view and acknowledges the generation it is holding.  The writer only
+    reuses a buffer once the reader has acknowledged the latest generation, so a buffer
+    that the viewer is drawing from is never overwritten underneath it.
+"""
+import logging
+import numpy as np
+from multiprocessing import shared_memory
+
+logging.basicConfig(filename="../logs/sns_shmem.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_BUFF_NAME = "state_buff"
+_GEN = 0            # index of the generation counter in the control segment
+_ACK = 1            # index of the generation last acknowledged by the reader
+_COUNT = 2          # index of the number of bodies in the state buffers
+_CTRL_SIZE = 4
+_EPOCH_SIZE = 2     # each buffer ends with the (jd1, jd2) epoch of its state
+
+
+def _open_segment(name, size, create):
+    if create:
+        try:
+            shm = shared_memory.SharedMemory(create=True, name=name, size=size)
+        except FileExistsError:
+            # left behind by a model process that did not shut down cleanly
+            logging.warning("Removing stale SharedMemory segment %s", name)
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(create=True, name=name, size=size)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+
+    return shm
+
+
+class StateBuffers:
+    """
+        Double buffered system state in SharedMemory.  There is a single writer (the model)
+        and a single reader (the viewer).
+    """
+    def __init__(self, body_count=None, name=DEF_BUFF_NAME, create=True):
+        """
+        Parameters
+        ----------
+        body_count  : int       number of bodies in the state array (required when creating)
+        name        : str       prefix of the SharedMemory segment names
+        create      : bool      True in the model process, False in the viewer
+        """
+        self._name = name
+        self._is_owner = create
+        self._ctrl_shm = _open_segment(name + "_ctrl", _CTRL_SIZE * 8, create)
+        self._ctrl = np.ndarray((_CTRL_SIZE,), dtype=np.int64, buffer=self._ctrl_shm.buf)
+        if create:
+            self._ctrl[:] = 0
+            self._ctrl[_COUNT] = body_count
+        self._count = int(self._ctrl[_COUNT])
+
+        size = (self._count * 9 + _EPOCH_SIZE) * 8
+        self._shms = [_open_segment(name + str(i), size, create) for i in range(2)]
+        self._bufs = [np.ndarray((self._count * 9 + _EPOCH_SIZE,), dtype=np.float64, buffer=shm.buf)
+                      for shm in self._shms]
+        self._states = [buf[:self._count * 9].reshape((self._count, 3, 3)) for buf in self._bufs]
+        self._epochs = [buf[self._count * 9:] for buf in self._bufs]
+        if create:
+            [buf.fill(0.0) for buf in self._bufs]
+        self._last_read = -1
+
+    def publish(self, state, epoch):
+        """
+            Writes a new state into the back buffer and flips it to the front.
+        Parameters
+        ----------
+        state   : np.ndarray(N, 3, 3)   the system state array
+        epoch   : (jd1, jd2)            the epoch of the state
+
+        Returns
+        -------
+        bool    : False if the reader still holds the back buffer and nothing was written
+        """
+        gen = int(self._ctrl[_GEN])
+        if self._ctrl[_ACK] != gen:
+            return False
+
+        back = (gen + 1) % 2
+        self._states[back][:] = state
+        self._epochs[back][:] = epoch
+        self._ctrl[_GEN] = gen + 1      # a single aligned 8-byte store is the flip
+
+        return True
+
+    def acquire(self):
+        """
+            Maps the front buffer if a new generation has been published.
+        Returns
+        -------
+        (state, epoch)  : zero-copy views of the front buffer, or None if nothing is new
+        """
+        gen = int(self._ctrl[_GEN])
+        if gen == self._last_read:
+            return None
+
+        self._last_read = gen
+        self._ctrl[_ACK] = gen
+
+        return self._states[gen % 2], (self._epochs[gen % 2][0], self._epochs[gen % 2][1])
+
+    def close(self):
+        """
+            Releases the views and detaches from the segments; the owner also unlinks them.
+        """
+        self._ctrl = self._bufs = self._states = self._epochs = None
+        for shm in self._shms + [self._ctrl_shm]:
+            shm.close()
+            if self._is_owner:
+                shm.unlink()
+
+    @property
+    def generation(self):
+        return int(self._ctrl[_GEN])
+
+    @property
+    def body_count(self):
+        return self._count
+
+    @property
+    def name(self):
+        return self._name
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    This module contains the SOIIndex class, which finds the dominant attractor of many
+    objects at once from the spheres of influence of the bodies of a system.  The lookup
+    descends the body hierarchy one level at a time: every object starts at the primary and
+    is only tested against the children of the body it is currently in, so the cost per object
+    grows with the depth of the hierarchy rather than with the number of bodies.  The result
+    can be fed back as the previous attractor of each object, which widens the sphere of
+    influence it is in by a small margin, so that objects near a boundary do not switch back
+    and forth between frames.
+
+    Only the lookup is provided: the parents of the SimBodies stay as loaded, and nothing is
+    moved from one attractor's frame to another when it crosses a boundary.
+"""
+import logging
+import numpy as np
+
+logging.basicConfig(filename="../logs/sns_soi.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+SOI_EXPONENT = 0.4          # Laplace: r_soi = a * (m / M) ** (2 / 5)
+SOI_HYSTERESIS = 0.02       # fraction by which the current sphere of influence is widened
+DEF_LOOKUP_CHUNK = 65536    # objects tested together, bounds the (K, C) work arrays
+
+
+def soi_radii(a, mu, parent_idx):
+    """
+        Computes the Laplace sphere of influence radius of each body about its parent.
+    Parameters
+    ----------
+    a           : np.ndarray(N,)    semi-major axis of each body about its parent (km)
+    mu          : np.ndarray(N,)    gravitational parameter of each body (km^3 / s^2)
+    parent_idx  : np.ndarray(N,)    index of the parent of each body, -1 for the primary
+
+    Returns
+    -------
+    np.ndarray(N,)      the radii (km), infinite for the primary
+    """
+    res = np.full((len(mu),), np.inf, dtype=np.float64)
+    has_parent = parent_idx >= 0
+    mu_par = mu[parent_idx[has_parent]]
+    res[has_parent] = np.abs(a[has_parent]) * (mu[has_parent] / mu_par) ** SOI_EXPONENT
+
+    return res
+
+
+class SOIIndex:
+    """
+        Hierarchical lookup of the sphere of influence that contains each of many points.
+
+    Parameters
+    ----------
+    radii       : np.ndarray(N,)    sphere of influence radius of each body
+    parent_idx  : np.ndarray(N,)    index of the parent of each body, -1 for the primary
+    """
+    def __init__(self, radii, parent_idx, hysteresis=SOI_HYSTERESIS):
+        self._radii = np.asarray(radii, dtype=np.float64)
+        self._parent_idx = np.asarray(parent_idx, dtype=np.intp)
+        self._hysteresis = hysteresis
+        self._root = int(np.nonzero(self._parent_idx < 0)[0][0])
+        # the children of each body, for the bodies that have any
+        self._children = {int(p): np.nonzero(self._parent_idx == p)[0]
+                          for p in np.unique(self._parent_idx[self._parent_idx >= 0])}
+
+    def lookup(self, points, body_pos, prev=None, chunk=DEF_LOOKUP_CHUNK):
+        """
+            Finds the dominant attractor of each point: the deepest body whose sphere of
+            influence contains it.
+
+        Parameters
+        ----------
+        points      : np.ndarray(K, 3)      positions of the objects
+        body_pos    : np.ndarray(N, 3)      positions of the bodies, in the same frame
+        prev        : np.ndarray(K,)        optional, the attractor of each object at the last lookup
+
+        Returns
+        -------
+        np.ndarray(K,)      the index of the attractor of each object
+        """
+        points = np.asarray(points, dtype=np.float64)
+        res = np.full((len(points),), self._root, dtype=np.intp)
+        for c0 in range(0, len(points), chunk):
+            self._descend(points[c0:c0 + chunk], body_pos, res[c0:c0 + chunk],
+                          None if prev is None else prev[c0:c0 + chunk])
+
+        return res
+
+    def _descend(self, pts, body_pos, res, prev):
+        active = np.arange(len(pts))
+        while active.size:
+            moved = []
+            for p in np.unique(res[active]):
+                kids = self._children.get(int(p))
+                if kids is None:
+                    continue
+                sel = active[res[active] == p]
+                d = pts[sel, None, :] - body_pos[None, kids, :]
+                r2 = np.einsum('ijk,ijk->ij', d, d)
+                rad = np.broadcast_to(self._radii[kids], r2.shape)
+                if prev is not None:
+                    rad = np.where(prev[sel, None] == kids[None, :], rad * (1 + self._hysteresis), rad)
+                inside = r2 < rad * rad
+                # the spheres of siblings can overlap, the nearest body relative to its radius wins
+                score = np.where(inside, r2 / (rad * rad), np.inf)
+                best = score.argmin(axis=1)
+                hit = np.isfinite(score[np.arange(len(sel)), best])
+                res[sel[hit]] = kids[best[hit]]
+                moved.append(sel[hit])
+
+            active = np.concatenate(moved) if moved else active[:0]
+
+    '''===== PROPERTIES ==========================================================================================='''
+
+    @property
+    def radii(self):
+        return self._radii
+
+    @property
+    def root(self):
+        return self._root
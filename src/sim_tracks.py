@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    This module samples the orbit tracks drawn for the bodies.  Instead of a fixed number of
+    points per orbit, the points are spaced along the conic so that the chord between two
+    neighbours never strays from the true curve by more than a tolerance: few points where the
+    orbit is nearly straight, many near the periapsis of an eccentric orbit.  The tolerance is
+    given in pixels, for the orbit seen filling a view of DEF_VIEW_PIXELS.
+
+    Tracks are float32 (K, 3) arrays relative to the attractor, in km.  They are kept in a
+    cache shared by all bodies, keyed by the (rounded) shape and orientation elements of the
+    orbit, so a track is only resampled when the orbit itself changes.
+"""
+import logging
+import numpy as np
+from collections import OrderedDict
+from sim_kepler import pqw_basis
+
+logging.basicConfig(filename="../logs/sns_tracks.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_PIX_TOL = 0.5           # largest chord error, in pixels
+DEF_VIEW_PIXELS = 2048      # size of the view (pixels) filled by the orbit's largest extent
+MIN_POINTS = 32
+MAX_POINTS = 4096
+FINE_GRID = 4096            # true anomalies used to integrate the point density
+HYP_MAX_P = 20.0            # hyperbolic tracks stop at this many semi-latus recta
+ELEM_DIGITS = 9             # significant digits of the elements in the cache key
+DEF_CACHE_SIZE = 512
+
+
+def track_anomalies(ecc, p, tol, min_pts=MIN_POINTS, max_pts=MAX_POINTS):
+    """
+        Chooses the true anomalies of the points of a track, so that the chord error
+        (sagitta = curvature * chord ** 2 / 8) is about tol everywhere.
+
+    Parameters
+    ----------
+    ecc     : float     eccentricity
+    p       : float     semi-latus rectum (km)
+    tol     : float     largest chord error (km)
+
+    Returns
+    -------
+    np.ndarray(K,)      true anomalies (rad), the first point is not repeated at the end
+    """
+    if ecc < 1.0:
+        nu = np.linspace(0.0, 2 * np.pi, FINE_GRID + 1)
+    else:                                   # up to where r = HYP_MAX_P * p
+        nu_max = np.arccos((1.0 / HYP_MAX_P - 1.0) / ecc)
+        nu = np.linspace(-nu_max, nu_max, FINE_GRID + 1)
+
+    w = 1.0 + ecc * np.cos(nu)
+    g = 1.0 + 2 * ecc * np.cos(nu) + ecc ** 2
+    speed = p * np.sqrt(g) / w ** 2                 # ds / dnu
+    kappa = w ** 3 / (p * g ** 1.5)                 # curvature of the conic
+    density = speed * np.sqrt(kappa / (8.0 * tol))  # points per radian of true anomaly
+    cum = np.concatenate([[0.0], np.cumsum(0.5 * (density[1:] + density[:-1]) * np.diff(nu))])
+    n_pts = int(np.clip(np.ceil(cum[-1]), min_pts, max_pts))
+    if ecc < 1.0:
+        targets = np.arange(n_pts) * (cum[-1] / n_pts)
+    else:
+        targets = np.linspace(0.0, cum[-1], n_pts)
+
+    return np.interp(targets, cum, nu)
+
+
+def sample_track(a, ecc, inc, raan, argp, pix_tol=DEF_PIX_TOL, view_px=DEF_VIEW_PIXELS):
+    """
+        Samples the track of an orbit adaptively.
+
+    Parameters
+    ----------
+    a                   : float     semi-major axis (km), negative for hyperbolic orbits
+    ecc                 : float     eccentricity
+    inc, raan, argp     : float     orientation (rad)
+
+    Returns
+    -------
+    np.ndarray(K, 3) of float32     the points, relative to the attractor (km)
+    """
+    p = abs(a) * abs(1.0 - ecc ** 2) if not np.isclose(ecc, 1.0) else 2 * abs(a)
+    extent = 2 * abs(a) * (1.0 + ecc) if ecc < 1.0 else 2 * HYP_MAX_P * p
+    tol = pix_tol * extent / view_px
+    nu = track_anomalies(ecc, p, tol)
+    r = p / (1.0 + ecc * np.cos(nu))
+    P, Q = pqw_basis(np.atleast_1d(inc), np.atleast_1d(raan), np.atleast_1d(argp))
+    pts = (r * np.cos(nu))[:, None] * P + (r * np.sin(nu))[:, None] * Q
+
+    return pts.astype(np.float32)
+
+
+class TrackCache:
+    """
+        Tracks shared by all bodies, keyed by the elements that determine their shape.
+    """
+    def __init__(self, pix_tol=DEF_PIX_TOL, view_px=DEF_VIEW_PIXELS, max_size=DEF_CACHE_SIZE):
+        self._pix_tol = pix_tol
+        self._view_px = view_px
+        self._max_size = max_size
+        self._tracks = OrderedDict()
+        self._n_hits = 0
+        self._n_misses = 0
+
+    def key(self, a, ecc, inc, raan, argp):
+        return tuple(float(f'{x:.{ELEM_DIGITS}g}') for x in (a, ecc, inc, raan, argp)) + \
+            (self._pix_tol, self._view_px)
+
+    def track(self, a, ecc, inc, raan, argp):
+        """ The track of an orbit, sampled on the first request for its elements. """
+        key = self.key(a, ecc, inc, raan, argp)
+        res = self._tracks.get(key)
+        if res is None:
+            self._n_misses += 1
+            res = sample_track(a, ecc, inc, raan, argp, self._pix_tol, self._view_px)
+            res.setflags(write=False)       # shared between bodies, must not be changed in place
+            self._tracks[key] = res
+            while len(self._tracks) > self._max_size:
+                self._tracks.popitem(last=False)
+            logging.info("track sampled with %s points for %s", len(res), key)
+        else:
+            self._n_hits += 1
+            self._tracks.move_to_end(key)
+
+        return res
+
+    def track_for_orbit(self, orbit, dist_unit):
+        """ The track of a poliastro Orbit, in dist_unit. """
+        import astropy.units as u
+
+        a, ecc, inc, raan, argp, _ = orbit.classical()
+        res = self.track(a.to_value(u.km), ecc.value, inc.to_value(u.rad),
+                         raan.to_value(u.rad), argp.to_value(u.rad))
+        if dist_unit != u.km:
+            res = (res * u.km.to(dist_unit)).astype(np.float32)
+
+        return res
+
+    def clear(self):
+        self._tracks.clear()
+
+    @property
+    def stats(self):
+        return dict(tracks=len(self._tracks), hits=self._n_hits, misses=self._n_misses)
+
+    @property
+    def pix_tol(self):
+        return self._pix_tol
+
+    @pix_tol.setter
+    def pix_tol(self, new_tol):
+        """ Changing the tolerance starts a new set of keys, the old tracks age out of the cache. """
+        self._pix_tol = float(new_tol)
+
+
+TRACK_CACHE = TrackCache()
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import cProfile
 import logging.config
 
 import numpy as np
@@ -11,16 +10,29 @@ from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QCoreApplication
 from multiprocessing import Queue
 from poliastro.bodies import Body
-from simsystem import SimSystem
+from simsystem import SimSystem, ModelProcess
+from sim_clock import SimClock
+from sim_scheduler import FrameScheduler
+from sim_workers import PanelUpdater
+from sim_kepler import jd_pair
 from sim_canvas import CanvasWrapper
 from sim_controls import Controls
 from system_visual import StarSystemVisuals
+from sim_profiler import PROFILER, DEF_PROFILE_DIR
 from datastore import *
 
 logging.config.dictConfig(log_config)
 QT_NATIVE = False
 STOP_IT = True
-DO_PROFILE = False
+DO_PROFILE = False          # capture the whole session, written to DEF_PROFILE_DIR on close
+PROFILE_MODE = 'cprofile'   # 'cprofile' or 'pyinstrument'
+USE_MODEL_PROC = False      # propagate the model in its own process, sharing state via SharedMemory
+MODEL_PROC_TIMEOUT = 120    # seconds to wait for the model process to load the system
+FRAME_INTERVAL = 16         # ms between polls of the shared state buffers
+DISPLAY_INTERVAL = 100      # ms between updates of the epoch timer widgets
+PANEL_HZ = 10.0             # most refreshes per second of the element panels, computed off the GUI thread
+USE_INSTANCING = False      # draw all bodies and tracks with instanced visuals
+USE_NBODY = False           # integrate the mutual gravity of all bodies instead of independent Kepler orbits
 
 
 class MainQtWindow(QtWidgets.QMainWindow):
@@ -52,12 +64,14 @@ class MainQtWindow(QtWidgets.QMainWindow):
         self.setWindowTitle("SPACE NAVIGATION SIMULATOR, (c)2024 Max S. Whitten")
         self.timer_paused = True
         self.interval = 10
-        self.tw_hold = 0
         self.comm_q = Queue()
         self.stat_q = Queue()
 
-        #       TODO: Here the model process will be spawned:
-        self.model = SimSystem(self.comm_q, self.stat_q, use_multi=True)
+        self.model = SimSystem(self.comm_q, self.stat_q, use_multi=True, use_nbody=USE_NBODY)
+        self.model_proc = None
+        self.frame_timer = None
+        if USE_MODEL_PROC:
+            self._start_model_proc()
         # self.model.load_from_names()
         self.body_names = self.model.body_names
 
@@ -70,15 +84,30 @@ class MainQtWindow(QtWidgets.QMainWindow):
         self.controls = Controls()
         self.ui = self.controls.ui
         self.central_widget = QtWidgets.QWidget(self)
+        self.clock = SimClock(epoch=self.model.epoch, warp=0)
+        self.controls.set_clock(self.clock)
+        self.scheduler = FrameScheduler(self._step_model, self.refresh_canvas,
+                                        draw_cost_fn=lambda: PROFILER.last('draw'),
+                                        target_ms=self.interval)
+        self.panels = PanelUpdater(self._panel_snapshot, rate_hz=PANEL_HZ, parent=self)
         self.timer = QtCore.QTimer()
         self.timer.setTimerType(QtCore.Qt.TimerType.PreciseTimer)
+        self.timer.setSingleShot(True)      # restarted after each frame, so ticks never pile up
+        self.display_timer = QtCore.QTimer()
 
         #       TODO:   Encapsulate the vizz_fields2agg inside StartSystemVisuals class
         self._vizz_fields2agg = ('pos', 'radius', 'body_alpha', 'track_alpha', 'body_mark',
-                                 'body_color', 'track_data', 'tex_data', 'is_primary',
+                                 'body_color', 'track_data', 'tex_fname', 'is_primary',
                                  'axes', 'rot', 'parent_name'
                                  )
-        self.visuals = StarSystemVisuals(self.body_names)
+        # the columns consumed by StarSystemVisuals.update_vizz() on every frame
+        self._vizz_fields2cols = ('pos', 'rot', 'axes', 'radius',
+                                  'is_primary', 'parent_idx', 'body_color',
+                                  )
+        self.visuals = StarSystemVisuals(self.body_names,
+                                         tex_store=self.model.ref_data,
+                                         use_instancing=USE_INSTANCING,
+                                         )
         self.visuals.generate_visuals(self.canvas.view,
                                       self.model.get_agg_fields(self._vizz_fields2agg))
 
@@ -93,9 +122,49 @@ class MainQtWindow(QtWidgets.QMainWindow):
         self.curr_simbod = self.model['Earth']
         self.reset_rotation()
         self.main_window_ready.emit('Earth')
-        self._last_elapsed = 0.0
         self.rpy_delta = np.zeros((3, 1), dtype=np.float64)
 
+    def _start_model_proc(self):
+        """
+            Spawns the model process, waits until it has loaded the system, then maps its
+            state buffers.  The local model is kept for the static data and the panels, while
+            its state is re-bound to the front buffer whenever a new generation is published.
+        """
+        self.model_proc = ModelProcess(self.comm_q, self.stat_q, body_names=self.model.body_names)
+        self.model_proc.start()
+        status = self.stat_q.get(timeout=MODEL_PROC_TIMEOUT)
+        if status[0] != 'ready':
+            raise RuntimeError(f'>>>ERROR: unexpected status from model process: {status}')
+
+        self.model.open_state_buffers(create=False)
+        self.frame_timer = QtCore.QTimer()
+        self.frame_timer.setTimerType(QtCore.Qt.TimerType.PreciseTimer)
+        self.frame_timer.setInterval(FRAME_INTERVAL)
+        self.frame_timer.timeout.connect(self.model.poll_state)
+        self.frame_timer.start()
+        print("Model process started...")
+
+    def closeEvent(self, event):
+        if self.model_proc is not None:
+            self.frame_timer.stop()
+            self.comm_q.put(('stop',))
+            self.model.close_state_buffers()
+            self.model_proc.join(timeout=5)
+        self.dump_profile()
+        super(MainQtWindow, self).closeEvent(event)
+
+    def dump_profile(self):
+        """
+            Stops any running capture and writes it, with the frame span statistics, to DEF_PROFILE_DIR.
+        """
+        if PROFILER.is_capturing:
+            PROFILER.stop_capture(DEF_PROFILE_DIR + ("sns_capture.html" if PROFILE_MODE == 'pyinstrument'
+                                                     else "sns_capture.prof"))
+        if PROFILER.span_names:
+            print(PROFILER.report())
+            PROFILER.export_json()
+            PROFILER.export_csv()
+
     def _setup_layout(self):
         # TODO:     Learn more about the QSplitter object
         main_layout = QtWidgets.QHBoxLayout()
@@ -127,13 +196,18 @@ class MainQtWindow(QtWidgets.QMainWindow):
         #   Handling epoch timer widget signals
         self.ui.time_wexp.valueChanged.connect(self.controls.tw_exp_updated)
         self.ui.time_slider.valueChanged.connect(self.controls.tw_slider_updated)
-        self.ui.time_elapsed.textChanged.connect(self.controls.tw_elapsed_updated)
-        self.ui.time_sys_epoch.textChanged.connect(self.update_model_epoch)
         self.ui.time_sys_epoch.textChanged.connect(self.updatePanels)
-        self.model.has_updated.connect(self.refresh_canvas)
+        self.panels.panels_ready.connect(self.show_panels)
+        if self.model_proc is not None:
+            self.model.has_updated.connect(self.refresh_canvas)
 
+        # the clock drives the model directly, the widgets only display it
+        self.clock.ticked.connect(self.update_model_epoch)
         self.timer.setInterval(self.interval)
-        self.timer.timeout.connect(self.update_elapsed)
+        self.timer.timeout.connect(self.run_frame)
+        self.display_timer.setInterval(DISPLAY_INTERVAL)
+        self.display_timer.timeout.connect(self.controls.show_clock)
+        self.display_timer.start()
 
         # Handling buttons in epoch timer
         self.ui.btn_play_pause.pressed.connect(self.toggle_play_pause)
@@ -148,16 +222,13 @@ class MainQtWindow(QtWidgets.QMainWindow):
         # find current RPY, store it, then subtract it from what would otherwise be there
         self.updatePanels('')
 
-    def update_elapsed(self):
-        self.ui.time_elapsed.setText(f'{(float(self.ui.time_elapsed.text()) + self.interval / 86400):.4f}')
-
     def swapCam(self):
         if self.ui.cam2selected.isChecked():
             self.cameras.set_curr2key('tt_cam')
             self.setActiveCam('tt_cam')
             print(f'CAM_STATE: {self.cameras.curr_cam.get_state()}')
             self.cameras.curr_cam.set_state({'center':
-                                             self.curr_simbod.pos.value,
+                                             self.curr_simbod.pos_arr,
                                              # 'distance':
                                              #     self.curr_simbod.radius[0].to(self.model.dist_unit).value * 2,
                                              })
@@ -165,7 +236,7 @@ class MainQtWindow(QtWidgets.QMainWindow):
             self.cameras.set_curr2key('fly_cam')
             print(f'CAM_STATE: {self.cameras.curr_cam.get_state()}')
             self.setActiveCam('fly_cam')
-            self.cameras.curr_cam.set_state({'center': (self.curr_simbod.pos.value +
+            self.cameras.curr_cam.set_state({'center': (self.curr_simbod.pos_arr +
                                                         self.curr_simbod.radius[0].to(self.model.dist_unit).value * 2
                                                         ),
                                              })
@@ -175,14 +246,22 @@ class MainQtWindow(QtWidgets.QMainWindow):
 
             case "[":
                 # lower time warp
-                pass
+                self.controls.scale_warp(0.1)
 
             case "]":
                 # increase time warp
-                pass
+                self.controls.scale_warp(10)
 
-            case "[":
-                pass
+            case "F11":
+                # print and export the frame span statistics
+                print(PROFILER.report())
+                PROFILER.export_json()
+                PROFILER.export_csv()
+
+            case "F12":
+                # toggle a profile capture
+                PROFILER.toggle_capture(PROFILE_MODE, DEF_PROFILE_DIR + "sns_capture.txt")
+                print(f'Profile capture {"started" if PROFILER.is_capturing else "stopped"} ({PROFILE_MODE})...')
 
     @property
     def curr_body_name(self):
@@ -196,7 +275,7 @@ class MainQtWindow(QtWidgets.QMainWindow):
             if self.ui.cam2selected.isChecked():
                 if self.ui.camBox.currentText() == "tt_cam":
                     self.cameras.curr_cam.set_state({'center':
-                                                         self.curr_simbod.pos,
+                                                         self.curr_simbod.pos_arr,
                                                      'distance':
                                                          self.curr_simbod.radius[0].to(self.model.dist_unit).value * 2
                                                      })
@@ -206,11 +285,42 @@ class MainQtWindow(QtWidgets.QMainWindow):
 
     @pyqtSlot(str)
     def updatePanels(self, new_bod_idx):
-        self.refresh_panel('elem_coe_')
-        self.refresh_panel('elem_rv_')
-        self.refresh_panel('elem_pqw_')
+        self.panels.request()
         self.refresh_panel('cam_')
 
+    def _panel_snapshot(self):
+        """
+            Copies what the element panels need from the selected body, on the GUI thread.
+
+        Returns
+        -------
+        key     : tuple     (body name, jd1, jd2), the panel cache key
+        snap    : dict      the argument of sim_workers.panel_data
+        """
+        sb = self.curr_simbod
+        parent = sb.body.parent
+        snap = dict(name=sb.name,
+                    is_primary=sb.is_primary,
+                    r=sb.r_arr.copy(),
+                    v=sb.v_arr.copy(),
+                    rot=np.array(sb.rot, dtype=np.float64),
+                    mu=parent.k.to_value(u.km ** 3 / u.s ** 2) if parent is not None else 0.0,
+                    )
+
+        return (sb.name, *jd_pair(self.model.epoch)), snap
+
+    @pyqtSlot(object)
+    def show_panels(self, data):
+        if data['name'] != self.curr_simbod.name:
+            return
+
+        for panel_key in ('elem_coe_', 'elem_pqw_'):
+            for w, txt in zip(self.controls.widget_group(panel_key), data[panel_key]):
+                w.setText(txt)
+        for w, txt in zip((self.ui.elem_rv_0, self.ui.elem_rv_1, self.ui.elem_rv_3), data['elem_rv_']):
+            w.setText(txt)
+        self.panel_refreshed.emit('elem_')
+
     @pyqtSlot(str)
     def setActiveCam(self, new_cam_id):
         if new_cam_id in self.cameras.cam_ids:
@@ -223,31 +333,52 @@ class MainQtWindow(QtWidgets.QMainWindow):
     def refresh_canvas(self):
         if self.ui.cam2selected.isChecked():
             self.cameras.curr_cam.set_state({'center':
-                                                 self.curr_simbod.pos.to(self.model.dist_unit).value,
+                                                 self.curr_simbod.pos_arr,
                                              # 'distance':
                                              #     self.curr_simbod.radius[0].to(self.model.dist_unit).value * 2
                                              })
 
-        self.visuals.update_vizz(self.model.get_agg_fields(self._vizz_fields2agg))
+        with PROFILER.span('aggregate'):
+            cols = self.model.get_field_columns(self._vizz_fields2cols)
+        self.visuals.update_vizz(cols)
         self.canvas.update_canvas()
         # self.updatePanels('')
 
-    @pyqtSlot()
-    def update_model_epoch(self):
-        self.model.epoch = Time(self.ui.time_sys_epoch.text(), format='jd')
+    def update_model_epoch(self, jd1, jd2):
+        if self.model_proc is not None:
+            self.comm_q.put(('epoch', jd1, jd2))
+            return
+
+        self.scheduler.submit(jd1, jd2)
+        if not self.timer.isActive():       # e.g. a reset while paused, show it on the next pass
+            self.timer.start(0)
+
+    def _step_model(self, jd1, jd2):
+        self.model.epoch = Time(jd1, jd2, format='jd', scale='tdb')
         if not self.model.USE_AUTO_UPDATE_STATE:
             self.model.update_state(self.model.epoch)
 
+    @pyqtSlot()
+    def run_frame(self):
+        """
+            One pass of the model/view loop: advance the clock, bring the model and the visuals
+            up to the latest epoch, then wait for as long as the measured frame cost requires.
+        """
+        self.clock.tick()
+        if self.model_proc is None:
+            self.scheduler.run_frame()
+        if not self.timer_paused:
+            self.timer.start(int(self.scheduler.next_interval))
+
     @pyqtSlot()
     def toggle_play_pause(self):
         if self.timer_paused:
-            self.ui.time_warp.setText(f'{self.tw_hold}')
             self.timer_paused = False
+            self.clock.resume()
             self.timer.start()
-            # self.ui.time_elapsed.setText(f'{(float(self.ui.time_elapsed.text()) + DEFAULT_DT):.4f}')
         else:
-            self.tw_hold = float(self.ui.time_warp.text())
             self.timer_paused = True
+            self.clock.pause()
             self.timer.stop()
 
     @pyqtSlot(str)
@@ -266,38 +397,12 @@ class MainQtWindow(QtWidgets.QMainWindow):
         # show_it(widg_grp)
         curr_cam_id = self.ui.camBox.currentText()
         if self.ui.cam2selected.isChecked():
-            self.cameras.curr_cam.set_state({'center': tuple(self.curr_simbod.pos.value)})
+            self.cameras.curr_cam.set_state({'center': tuple(self.curr_simbod.pos_arr)})
 
         match panel_key:
 
-            case 'elem_coe_':
-                # print("COE!!")
-                if self.curr_simbod.is_primary:
-                    [w.setText("") for w in widg_grp]
-                    for i, w in enumerate(widg_grp):
-                        # print(f'widget #{i}: {w.objectName()} -> {data_set[i]}')
-                        w.setText(str(self.model[self.curr_simbod.name].elem_coe[i].round(4)))
-
-            case 'elem_rv_':
-                # print("RV!!")
-                if self.curr_simbod.is_primary:
-                    [w.setText("") for w in widg_grp]
-
-                else:
-                    self.ui.elem_rv_0.setText(to_vector_str(self.curr_simbod.r.value))
-                    self.ui.elem_rv_1.setText(to_vector_str(self.curr_simbod.v.value))
-                    self.ui.elem_rv_3.setText(to_vector_str(self.curr_simbod.rot,
-                                                            ('RA: ', '\nDEC:', '\nW:  '))
-                                              )
-
-            case 'elem_pqw_':
-                # print("PQW!!")
-                if self.curr_simbod.is_primary:
-                    [w.setText("") for w in widg_grp]
-                else:
-                    for i, w in enumerate(widg_grp):
-                        # print(f'widget #{i}: {w.objectName()} -> {data_set[i]}')
-                        w.setText(str(to_vector_str(self.model[self.curr_simbod.name].elem_pqw[i])))
+            case 'elem_coe_' | 'elem_rv_' | 'elem_pqw_':
+                self.panels.request()       # computed on a worker, shown by show_panels
 
             case 'attr_':
                 # print("ATTR!!")
@@ -364,6 +469,9 @@ def main():
         app = use_app("pyqt5")
         app.create()
 
+    if DO_PROFILE:
+        PROFILER.start_capture(PROFILE_MODE)
+
     sim = MainQtWindow()
     sim.show()
 
@@ -375,8 +483,4 @@ def main():
 
 '''==============================================================================================================='''
 if __name__ == "__main__":
-
-    if DO_PROFILE:
-        cProfile.run('main()', sort='tottime')
-    else:
-        main()
+    main()
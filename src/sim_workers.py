@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+    This module moves the computation of the data panels off the GUI thread.  The elements
+    shown in the panels are derived from a snapshot of the plain state arrays of the selected
+    body (taken on the GUI thread, so the live model is never read from another thread), on a
+    Worker run by a QThreadPool.  Requests are rate limited to a set number per second, only
+    the latest one is kept while a computation is in flight, and the results are cached per
+    (body, epoch) so that a paused or revisited epoch costs nothing.
+"""
+import sys
+import logging
+import traceback
+import numpy as np
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+from datastore import to_vector_str
+
+logging.basicConfig(filename="../logs/sns_workers.log",
+                    level=logging.ERROR,
+                    format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
+                    )
+
+DEF_PANEL_HZ = 10.0             # panel refreshes per second
+DEF_CACHE_SIZE = 256            # (body, epoch) entries kept in the panel cache
+ELEM_TOL = 1e-8                 # below this, an orbit is taken as circular and/or equatorial
+ROT_HDRS = ('RA: ', '\nDEC:', '\nW:  ')
+COE_UNITS = ('km', '', 'deg', 'deg', 'deg', 'deg')
+
+
+class WorkerSignals(QObject):
+    """
+        The signals available from a running Worker.
+
+        finished    : no data
+        error       : tuple (exctype, value, traceback.format_exc())
+        result      : object, the return value of the function
+    """
+    finished = pyqtSignal()
+    error = pyqtSignal(tuple)
+    result = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    """
+        Runs a function with the given arguments on a QThreadPool thread.
+
+    Parameters
+    ----------
+    fn      : callable      the function to run
+    args    :               positional arguments passed to fn
+    kwargs  :               keyword arguments passed to fn
+    """
+    def __init__(self, fn, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception:
+            logging.exception("Worker failed")
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+
+def rv2coe(r, v, mu):
+    """
+        Computes the classical elements and the perifocal frame of an orbit from its state.
+    Parameters
+    ----------
+    r, v    : np.ndarray(3,)    position (km) and velocity (km/s) relative to the attractor
+    mu      : float             gravitational parameter of the attractor (km^3 / s^2)
+
+    Returns
+    -------
+    coe     : tuple             a (km), ecc, inc, raan, argp, nu (deg)
+    pqw     : tuple             the P, Q and W unit vectors of the perifocal frame
+    """
+    r = np.asarray(r, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    r_mag = np.linalg.norm(r)
+    h_vec = np.cross(r, v)
+    h_mag = np.linalg.norm(h_vec)
+    w_vec = h_vec / h_mag
+    e_vec = ((v @ v - mu / r_mag) * r - (r @ v) * v) / mu
+    ecc = np.linalg.norm(e_vec)
+    a = 1.0 / (2.0 / r_mag - v @ v / mu)
+    inc = np.arccos(np.clip(w_vec[2], -1.0, 1.0))
+
+    n_vec = np.array([-h_vec[1], h_vec[0], 0.0])
+    n_mag = np.linalg.norm(n_vec)
+    equatorial = n_mag < ELEM_TOL * h_mag
+    circular = ecc < ELEM_TOL
+    n_hat = np.array([1.0, 0.0, 0.0]) if equatorial else n_vec / n_mag
+    p_vec = n_hat if circular else e_vec / ecc
+    q_vec = np.cross(w_vec, p_vec)
+
+    def _angle(u_vec, x_vec):       # angle from u_vec to x_vec, measured about w_vec
+        return np.arctan2(np.cross(u_vec, x_vec) @ w_vec, u_vec @ x_vec) % (2 * np.pi)
+
+    raan = 0.0 if equatorial else np.arctan2(n_hat[1], n_hat[0]) % (2 * np.pi)
+    argp = 0.0 if circular else _angle(n_hat, p_vec)
+    nu = _angle(p_vec, r)
+
+    return (a, ecc, *np.degrees([inc, raan, argp, nu])), (p_vec, q_vec, w_vec)
+
+
+def panel_data(snap):
+    """
+        Computes and formats the contents of the element panels from a snapshot of a body.
+    Parameters
+    ----------
+    snap    : dict      name, is_primary, r, v, rot and mu of the body
+
+    Returns
+    -------
+    dict    : the widget strings of each panel, keyed by panel key
+    """
+    if snap['is_primary']:
+        return {'name': snap['name'],
+                'elem_coe_': [''] * len(COE_UNITS),
+                'elem_rv_': ['', '', to_vector_str(snap['rot'], ROT_HDRS)],
+                'elem_pqw_': ['', '', ''],
+                }
+
+    coe, pqw = rv2coe(snap['r'], snap['v'], snap['mu'])
+    return {'name': snap['name'],
+            'elem_coe_': [f'{x:.4f} {unit}'.rstrip() for x, unit in zip(coe, COE_UNITS)],
+            'elem_rv_': [to_vector_str(snap['r']),
+                         to_vector_str(snap['v']),
+                         to_vector_str(snap['rot'], ROT_HDRS),
+                         ],
+            'elem_pqw_': [to_vector_str(vec) for vec in pqw],
+            }
+
+
+class PanelUpdater(QObject):
+    """
+        Rate-limited, cached computation of the data panels on a thread pool.
+
+    Parameters
+    ----------
+    snapshot_fn : callable() -> (key, snap)     called on the GUI thread, returns the cache key
+                                                (body name, jd1, jd2) and the snapshot of the body
+    rate_hz     : float                         the most panel refreshes per second
+    """
+    panels_ready = pyqtSignal(object)       # the dict returned by panel_data
+
+    def __init__(self, snapshot_fn, rate_hz=DEF_PANEL_HZ, cache_size=DEF_CACHE_SIZE, parent=None):
+        super(PanelUpdater, self).__init__(parent)
+        self._snapshot_fn = snapshot_fn
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(1)
+        self._in_flight = None
+        self._dirty = False
+        self._throttle = QTimer(self)
+        self._throttle.setSingleShot(True)
+        self._throttle.timeout.connect(self._dispatch)
+        self._rate_hz = None
+        self.rate_hz = rate_hz
+
+    def request(self):
+        """ Asks for the panels of the current body and epoch, at most rate_hz times per second. """
+        self._dirty = True
+        if not self._throttle.isActive():
+            self._throttle.start(0 if self._in_flight is None else self._interval_ms)
+
+    @pyqtSlot()
+    def _dispatch(self):
+        if self._in_flight is not None or not self._dirty:
+            return
+
+        self._dirty = False
+        key, snap = self._snapshot_fn()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.panels_ready.emit(self._cache[key])
+            return
+
+        worker = Worker(panel_data, snap)
+        worker.signals.result.connect(lambda res, k=key: self._store(k, res))
+        worker.signals.finished.connect(self._finished)
+        self._in_flight = key
+        self._pool.start(worker)
+        self._throttle.start(self._interval_ms)     # the next request waits for the rate limit
+
+    def _store(self, key, res):
+        self._cache[key] = res
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        self.panels_ready.emit(res)
+
+    @pyqtSlot()
+    def _finished(self):
+        self._in_flight = None
+        if self._dirty and not self._throttle.isActive():
+            self._dispatch()
+
+    def clear(self):
+        self._cache.clear()
+
+    @property
+    def _interval_ms(self):
+        return int(1000 / self._rate_hz)
+
+    @property
+    def rate_hz(self):
+        return self._rate_hz
+
+    @rate_hz.setter
+    def rate_hz(self, new_rate):
+        self._rate_hz = max(0.1, float(new_rate))
+        self._throttle.setInterval(self._interval_ms)
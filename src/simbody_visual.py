@@ -7,6 +7,7 @@
 # x
 from typing import Dict, Tuple
 
+import math
 import logging
 logging.basicConfig(filename="logs/simbod_viz.log",
                     level=logging.ERROR,
@@ -26,6 +27,33 @@ from vispy.scene.visuals import create_visual_node
 from vispy.geometry.meshdata import MeshData
 from datastore import DEF_TEX_FNAME, _latitude, _oblate_sphere, get_texture_data
 
+LOD_ROWS = (6, 12, 24, 48, 96)      # rows of the sphere mesh at each level of detail (cols = 2 * rows)
+LOD_PIX_PER_SEG = 8.0               # the longest edge of the outline of a body on screen (pixels)
+LOD_DOWN_FACTOR = 2.5               # a level is only swapped for a coarser one when it is this oversized
+
+
+def lod_rows(pix_diam, curr_rows=None):
+    """
+        Selects the level of detail of a body from its apparent diameter.  A level is fine
+        enough when the segments of its outline are at most LOD_PIX_PER_SEG pixels long,
+        (2 * rows segments around the circumference, pi * diameter).  A finer level is taken
+        as soon as it is needed, a coarser one only when the current level is LOD_DOWN_FACTOR
+        times too fine, so that a body near a threshold does not flip between levels.
+        Both arguments can also be arrays, one entry per body.
+
+    Returns
+    -------
+    int or np.ndarray of int    : entries of LOD_ROWS
+    """
+    levels = np.asarray(LOD_ROWS)
+    need = math.pi * np.asarray(pix_diam, dtype=np.float64) / (2 * LOD_PIX_PER_SEG)
+    res = levels[np.minimum(np.searchsorted(levels, need), len(levels) - 1)]
+    if curr_rows is not None:
+        curr = np.asarray(curr_rows)
+        res = np.where((curr >= need) & (need * LOD_DOWN_FACTOR >= curr), curr, res)
+
+    return res if res.ndim else int(res)
+
 
 class PlanetVisual(CompoundVisual):
     """ Visual that displays an oblate sphere with a texture,
@@ -72,26 +100,29 @@ class PlanetVisual(CompoundVisual):
         # self._sb_ref = sim_body
         if body_name:
             self._vizz_data = vizz_data
-            self._tex_data = self._vizz_data['tex_data']
             self._mark = self._vizz_data['body_mark']
             self._base_color = Color(self._vizz_data['body_color'])
             self._body_alpha = self._vizz_data['body_alpha']
             self._track_alpha = self._vizz_data['track_alpha']
             self._radius = self._vizz_data['radius']
-            if texture is None:
-                self._texture_data = self._tex_data
-            else:
-                self._texture_data = texture
+            if texture is None:     # the aggregated fields hold the path of the texture, not the image
+                texture = get_texture_data(self._vizz_data.get('tex_fname', DEF_TEX_FNAME))
+            self._texture_data = texture
 
         else:           # no SimBody provided
             self._radius = [1.0, 1.0, 1.0] * u.km  # default to 1.0
             self._texture_data = get_texture_data(DEF_TEX_FNAME)
 
         self._texture = None
+        self._tex_filter = None
 
         if cols is None:        # auto set cols to 2 * rows
             cols = rows * 2
 
+        self._method = method
+        self._offset = offset
+        self._rows = rows
+        self._lod_data = {}         # (surface_data, mesh_data) of each level built so far, by rows
         if method == 'latitude':
             radius = self._radius
             self._mesh_data = _latitude(rows, cols,
@@ -99,11 +130,7 @@ class PlanetVisual(CompoundVisual):
             # print("Using 'latitude' method...")
         elif method == 'oblate':
             radius = self._radius
-            self._surface_data = _oblate_sphere(rows, cols,
-                                                self._radius, offset)
-            self._mesh_data = MeshData(vertices=self._surface_data['verts'],
-                                       faces=self._surface_data['faces'])
-            self._surface_data['edges'] = self._mesh_data.get_edges()
+            self._surface_data, self._mesh_data = self._build_lod(rows, cols)
 
         self._mesh = MeshVisual(vertices=self._mesh_data.get_vertices(),
                                 faces=self._mesh_data.get_faces(),
@@ -112,6 +139,7 @@ class PlanetVisual(CompoundVisual):
                                 color=color,
                                 shading=shading)
 
+        self._has_border = bool(edge_color)
         if edge_color:
             self._border = MeshVisual(vertices=self._mesh_data.get_vertices(),
                                       faces=self._mesh_data.get_edges(),
@@ -126,6 +154,39 @@ class PlanetVisual(CompoundVisual):
         super(PlanetVisual, self).__init__([v for v in [self._mesh, self._border]])
         self.texture = self._texture_data
 
+    def _build_lod(self, rows, cols=None):
+        if rows not in self._lod_data:
+            surface = _oblate_sphere(rows, cols or rows * 2, self._radius, self._offset)
+            mesh_data = MeshData(vertices=surface['verts'], faces=surface['faces'])
+            surface['edges'] = mesh_data.get_edges()
+            self._lod_data[rows] = (surface, mesh_data)
+
+        return self._lod_data[rows]
+
+    def set_lod(self, rows):
+        """
+            Swaps the sphere mesh for one with the given number of rows, keeping the texture.
+            Each level is built on first use and kept for later swaps.
+        """
+        if rows == self._rows or self._method != 'oblate':
+            return
+
+        self._surface_data, self._mesh_data = self._build_lod(rows)
+        self._mesh.set_data(vertices=self._mesh_data.get_vertices(),
+                            faces=self._mesh_data.get_faces())
+        if self._has_border:
+            self._border.set_data(vertices=self._mesh_data.get_vertices(),
+                                  faces=self._mesh_data.get_edges())
+        if self._tex_filter is not None:
+            self._tex_filter.texcoords = self._surface_data['tcord']
+        self._rows = rows
+        self.update()
+
+    @property
+    def lod(self):
+        """ The number of rows of the sphere mesh shown. """
+        return self._rows
+
     @property
     def mesh(self):
         """The vispy.visuals.MeshVisual that used to fil in."""
@@ -183,11 +244,16 @@ class PlanetVisual(CompoundVisual):
         #                           interpolation='linear',
         #                           wrapping='clamp_to_edge')
         # self._texture.set_data(data=self._texture_data)
-        _filter = TextureFilter(new_data,
-                                self._surface_data['tcord'],
-                                enabled=True,
-                                )
-        self._mesh.attach(_filter)
+        self._texture_data = new_data
+        if self._tex_filter is None:
+            self._tex_filter = TextureFilter(new_data,
+                                             self._surface_data['tcord'],
+                                             enabled=True,
+                                             )
+            self._mesh.attach(self._tex_filter)
+        else:                                   # swap the image, keeping the filter attached
+            self._tex_filter.texture = new_data
+        self.update()
 
     @property
     def mark(self):
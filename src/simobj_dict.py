@@ -1,11 +1,17 @@
 import time
 import numpy as np
+import astropy.units as u
 from psygnal import Signal
-from astropy.coordinates import solar_system_ephemeris
 from astropy.time import Time
 from sim_object import SimObject
 from sim_body import SimBody
 from datastore import SystemDataStore
+from sim_kepler import KeplerPropagator, jd_pair, epoch_td, SEC_PER_DAY
+from sim_nbody import NBodyEngine, SmallBodyField, DEF_MAX_JUMP
+from sim_soi import SOIIndex, soi_radii
+from sim_rotation import IAURotation
+from ephem_cache import set_ephem_source
+from sim_profiler import PROFILER
 from concurrent.futures import ThreadPoolExecutor
 
 
@@ -13,11 +19,11 @@ class SimObjectDict(dict):
 
     has_updated = Signal()
 
-    def __init__(self, epoch=None, data=None, ref_data=SystemDataStore(),
-                 body_names=None, use_multi=False, auto_up=False):
+    def __init__(self, epoch=None, data=None, ref_data=None,
+                 body_names=None, use_multi=False, auto_up=False, use_batch=True, use_nbody=False):
         """ TODO:   """
         super().__init__()
-        solar_system_ephemeris.set("jpl")
+        set_ephem_source("jpl")
         if data:
             self.data = {name: self._validate_sim_obj(simbody)
                          for name, simbody in data.items()}
@@ -30,9 +36,8 @@ class SimObjectDict(dict):
             else:
                 print('Bad <sys_data> input... Reverting to defaults...')
                 ref_data = SystemDataStore()
-
-        # else:
-        #     ref_data = SystemDataStore()
+        else:
+            ref_data = SystemDataStore()
 
         self.ref_data = ref_data
         self._sys_primary = None
@@ -47,12 +52,23 @@ class SimObjectDict(dict):
             self._current_body_names = tuple(self._valid_body_names)
 
         self._body_count = len(self._current_body_names)
-        self._sys_rel_pos = np.zeros((self._body_count, self._body_count),
-                                     dtype=self._vec_type)
-        self._sys_rel_vel = np.zeros((self._body_count, self._body_count),
-                                     dtype=self._vec_type)
-        self._bod_tot_acc = np.zeros((self._body_count,),
-                                     dtype=self._vec_type)
+        self._sys_rel_pos = np.zeros((self._body_count, self._body_count, 3), dtype=np.float64)
+        self._sys_rel_vel = np.zeros((self._body_count, self._body_count, 3), dtype=np.float64)
+        self._bod_tot_acc = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._nbody = None
+        self._nb_pos = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._nb_vel = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._nb_jd = None
+        self._model_jd = None           # the epoch of the last update_state, as (jd1, jd2)
+        self._fields = {}
+        self._soi = None
+        self._state_arr = np.zeros((self._body_count, 3, 3), dtype=np.float64)
+        self._propagator = None
+        self._rotation = None
+        self._parent_idx = np.full((self._body_count,), -1, dtype=np.intp)
+        self._hier_levels = []
+        self._abs_pos = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._abs_valid = False
         if epoch:
             self._sys_epoch = epoch
         else:
@@ -67,6 +83,8 @@ class SimObjectDict(dict):
         self._IS_UPDATING = False
         self._USE_LOCAL_TIMER = False
         self._USE_MULTIPROC = use_multi
+        self._USE_KEPLER_BATCH = use_batch
+        self._USE_NBODY = use_nbody
         self.executor = ThreadPoolExecutor(max_workers=6)
 
     def __setitem__(self, name, sim_obj):
@@ -97,11 +115,9 @@ class SimObjectDict(dict):
         -------
         nothing     : Leaves the model usable with SimBody objects loaded
         """
-        if _body_names is None:
-            self._current_body_names = self._valid_body_names
-        else:
-            self._current_body_names = (n for n in _body_names
-                                        if n in self._valid_body_names)
+        if _body_names is not None:
+            self._current_body_names = tuple([n for n in _body_names
+                                              if n in self._valid_body_names])
 
         # populate the list with SimBody objects
         self.data.clear()
@@ -112,31 +128,275 @@ class SimObjectDict(dict):
         self._body_count = len(self.data)
         # self._sys_primary = [sb for sb in self.data.values() if sb.body.parent is None][0]
         self.set_parentage()
+        self._build_state_array()
         self._IS_POPULATED = True
 
         self.update_state(epoch=self._sys_epoch)
         self._HAS_INIT = True
         # self.set_field_dict()
 
+    def _build_state_array(self):
+        """
+            Allocates the contiguous (N, 3, 3) system state array, binds the state matrix of each
+            SimBody to its row, then loads every body that has an Orbit into the KeplerPropagator
+            and every body that has a tabulated rotation model into the IAURotation.
+        """
+        self._state_arr = np.zeros((self._body_count, 3, 3), dtype=np.float64)
+        [sb.bind_state(self._state_arr[i])
+         for i, sb in enumerate(self.data.values())]
+        self._build_hierarchy()
+
+        self._propagator = None
+        if self._USE_KEPLER_BATCH:
+            idx = [i for i, sb in enumerate(self.data.values()) if sb.has_orbit]
+            self._propagator = KeplerPropagator.from_orbits([sb.orbit for sb in self.data.values()
+                                                             if sb.has_orbit],
+                                                            sys_idx=idx)
+
+        self._rotation = None
+        if all([sb.rot_model for sb in self.data.values()]):
+            self._rotation = IAURotation([sb.rot_model for sb in self.data.values()])
+
+        self._build_nbody()
+        self._soi = None            # built at the first lookup, once the states are known
+
+    def _build_nbody(self):
+        """
+            Creates the NBodyEngine for the loaded bodies.  The relative state and acceleration
+            arrays of the system are views of its work buffers.
+        """
+        _mu_unit = self._dist_unit ** 3 / u.s ** 2
+        self._nbody = NBodyEngine([sb.body.k.to_value(_mu_unit) for sb in self.data.values()])
+        self._sys_rel_pos = self._nbody.rel_pos
+        self._sys_rel_vel = self._nbody.rel_vel
+        self._bod_tot_acc = self._nbody.acc
+        self._nb_pos = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._nb_vel = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._nb_jd = None
+
+    def _build_hierarchy(self):
+        """
+            Stores the body hierarchy as an array of parent indices, and groups the bodies by
+            depth so that the absolute positions of each level are resolved in one vectorized
+            step, parents before their children.
+        """
+        _names = list(self.data.keys())
+        self._parent_idx = np.array([_names.index(sb.body.parent.name)
+                                     if sb.body.parent and sb.body.parent.name in self.data else -1
+                                     for sb in self.data.values()], dtype=np.intp)
+        depth = np.zeros((self._body_count,), dtype=np.intp)
+        anc = self._parent_idx.copy()
+        while np.any(anc >= 0):
+            depth[anc >= 0] += 1
+            anc[anc >= 0] = self._parent_idx[anc[anc >= 0]]
+
+        self._hier_levels = [np.nonzero(depth == lvl)[0] for lvl in range(1, depth.max(initial=0) + 1)]
+        self._abs_pos = np.zeros((self._body_count, 3), dtype=np.float64)
+        self._abs_valid = False
+        [sb.bind_positions(self, i) for i, sb in enumerate(self.data.values())]
+
+    def resolve_positions(self):
+        """
+            Computes the position of every body relative to the system primary, one level of
+            the hierarchy at a time.  The result is kept until the state changes.
+
+        Returns
+        -------
+        np.ndarray(N, 3)    :   absolute positions in dist_unit
+        """
+        if not self._abs_valid:
+            self._abs_pos[self._parent_idx < 0] = 0.0
+            for lvl in self._hier_levels:
+                self._abs_pos[lvl] = self._abs_pos[self._parent_idx[lvl]] + self._state_arr[lvl, 0]
+            self._abs_valid = True
+
+        return self._abs_pos
+
+    def invalidate_positions(self):
+        self._abs_valid = False
+
+    def _resolve_velocities(self, out):
+        out[self._parent_idx < 0] = 0.0
+        for lvl in self._hier_levels:
+            out[lvl] = out[self._parent_idx[lvl]] + self._state_arr[lvl, 1]
+
+        return out
+
+    def _build_soi(self):
+        """
+            Computes the sphere of influence of every body, from the semi-major axis of its
+            orbit, or its current distance to its parent if it has no orbit.
+        """
+        a = np.linalg.norm(self._state_arr[:, 0], axis=1)
+        if self._propagator is not None:
+            a[self._propagator.sys_idx] = self._propagator.a
+        self._soi = SOIIndex(soi_radii(a, self._nbody.mu, self._parent_idx), self._parent_idx)
+
+    def dominant_attractor(self, points, prev=None):
+        """
+            Finds the body whose sphere of influence dominates each of many points.
+
+        Parameters
+        ----------
+        points  : np.ndarray(K, 3)  positions relative to the system primary (dist_unit)
+        prev    : np.ndarray(K,)    optional, the attractors found by the previous call, for hysteresis
+
+        Returns
+        -------
+        np.ndarray(K,)      the index of the attractor of each point, in the order of body_names
+        """
+        if self._soi is None:
+            self._build_soi()
+
+        return self._soi.lookup(points, self.resolve_positions(), prev=prev)
+
+    def resolve_velocities(self):
+        """ The velocities of all bodies relative to the system primary (dist_unit / s). """
+        return self._resolve_velocities(np.zeros((self._body_count, 3), dtype=np.float64))
+
+    def seed_nbody(self, jd):
+        """
+            Takes the current (Keplerian or ephemeris) state as the initial conditions of the
+            N-body integration, in the inertial frame of the primary at that epoch.
+        """
+        self._nb_pos[:] = self.resolve_positions()
+        self._resolve_velocities(self._nb_vel)
+        self._nbody.invalidate()
+        self._nb_jd = jd
+
+    def _step_nbody(self, jd):
+        """
+            Integrates the system from the epoch of the last step to jd, then writes the state
+            of each body relative to its parent back into the state array.
+        """
+        dt = ((jd[0] - self._nb_jd[0]) + (jd[1] - self._nb_jd[1])) * SEC_PER_DAY
+        self._nbody.advance(self._nb_pos, self._nb_vel, dt)
+        self._nb_jd = jd
+        has_parent = self._parent_idx >= 0
+        _par = self._parent_idx[has_parent]
+        self._state_arr[has_parent, 0] = self._nb_pos[has_parent] - self._nb_pos[_par]
+        self._state_arr[has_parent, 1] = self._nb_vel[has_parent] - self._nb_vel[_par]
+        self._state_arr[~has_parent, :2] = 0.0
+
+    def populate_belt(self, name, count, mu=None, seed=None, **kwargs):
+        """
+            Adds a population of small bodies orbiting the primary, which are then advanced with
+            the system at every update_state.
+
+        Parameters
+        ----------
+        name    : str               a key of sim_nbody.BELTS
+        count   : int               the number of particles
+        mu      : float or array    gravitational parameter of the particles, None for massless
+                                    particles, which skips the Barnes-Hut tree altogether
+        kwargs  :                   passed to SmallBodyField (theta, tree_every, max_step, ...)
+
+        Returns
+        -------
+        SmallBodyField
+        """
+        _mu_unit = self._dist_unit ** 3 / u.s ** 2
+        if self._model_jd is None:      # not propagated yet
+            _jd, _major_pos = jd_pair(self._sys_epoch), None
+        else:                           # seeded where the model is, with the bodies where they are
+            _jd, _major_pos = self._model_jd, self.resolve_positions()
+        self._fields[name] = SmallBodyField.from_belt(name, count,
+                                                      self._sys_primary.body.k.to_value(_mu_unit),
+                                                      _jd,
+                                                      seed=seed, mu=mu, major_pos=_major_pos, **kwargs)
+        return self._fields[name]
+
+    def remove_belt(self, name):
+        self._fields.pop(name, None)
+
     def update_state(self, epoch):
         self._base_t = self._t1
-        _tx = time.perf_counter()
+        self._abs_valid = False
+        with PROFILER.span('propagate'):
+            # the epoch is converted to floats once per tick, astropy Time stays at the API boundary
+            jd = jd_pair(epoch)
+            td = epoch_td(jd)
+            self._model_jd = jd
+            if self._USE_NBODY and self._nb_jd is not None and \
+                    abs((jd[0] - self._nb_jd[0]) + (jd[1] - self._nb_jd[1])) * SEC_PER_DAY <= DEF_MAX_JUMP:
+                self._step_nbody(jd)
+                if self._rotation is not None:
+                    [sb.set_epoch(epoch) for sb in self.data.values()]
+                else:
+                    [sb.update_rotation(epoch, td=td) for sb in self.data.values()]
+
+            elif self._propagator is not None:
+                self._propagator.propagate(jd, out=self._state_arr)
+                if self._rotation is not None:
+                    [sb.set_epoch(epoch) if sb.has_orbit else sb.update_state(epoch, td=td)
+                     for sb in self.data.values()]
+                else:
+                    [sb.update_rotation(epoch, td=td) if sb.has_orbit else sb.update_state(epoch, td=td)
+                     for sb in self.data.values()]
+
+            elif self._USE_MULTIPROC:
+                futures = (self.executor.submit(sb.update_state, epoch=epoch, td=td)
+                           for sb in self.data.values())
+                for future in futures:
+                    future.result()
+            else:
+                [sb.update_state(epoch, td=td)
+                 for sb in self.data.values()]
 
-        if self._USE_MULTIPROC:
-            futures = (self.executor.submit(sb.update_state, epoch=epoch)
-                       for sb in self.data.values())
-            for future in futures:
-                future.result()
-        else:
-            [sb.update_state(epoch)
-             for sb in self.data.values()]
+            if self._rotation is not None:       # the rotational elements of all bodies in one pass
+                self._rotation.evaluate(td['T'], td['d'], out=self._state_arr[:, 2])
+
+            if self._USE_NBODY and self._nb_jd != jd:   # first epoch, or too far from the last one
+                self.seed_nbody(jd)
+
+            if self._fields:
+                _major_pos = self.resolve_positions()
+                for field in self._fields.values():
+                    field.advance(jd, _major_pos, self._nbody.mu)
 
         self._t1 = time.perf_counter()
         update_time = self._t1 - self._base_t
-        print(f'\n\t\t> Frame Rate: {1 / update_time:.4f} FPS (1/{update_time:.4f})\n'
-              f'  Model updated in {self._t1 - _tx:.4f} seconds...')
+        PROFILER.mark_frame('model_tick')
         self.has_updated.emit(update_time)
 
+    def propagate_epochs(self, jds, out=None):
+        """
+            Computes the state of every body at each of a series of epochs, in one vectorized
+            pass, without changing the current state of the model.
+
+        Parameters
+        ----------
+        jds     : np.ndarray(K,)            TDB Julian dates
+        out     : np.ndarray(K, N, 3, 3)    optional, the array to write the states into
+
+        Returns
+        -------
+        out     : np.ndarray(K, N, 3, 3)    [r, v, rot] of each body at each epoch, with r and v
+                                            relative to the parent body
+        """
+        jds = np.atleast_1d(np.asarray(jds, dtype=np.float64))
+        if out is None:
+            out = np.zeros((len(jds), self._body_count, 3, 3), dtype=np.float64)
+
+        _simbods = list(self.data.values())
+        propagator = self._propagator
+        if propagator is None:
+            idx = [i for i, sb in enumerate(_simbods) if sb.has_orbit]
+            propagator = KeplerPropagator.from_orbits([_simbods[i].orbit for i in idx], sys_idx=idx)
+        propagator.propagate_epochs(jds, out=out)
+
+        for i, sb in enumerate(_simbods):
+            if not sb.has_orbit:
+                out[:, i, 0], out[:, i, 1] = sb.rv_at_jds(jds)
+            if self._rotation is None:
+                out[:, i, 2] = sb.rot_at_jds(jds)
+
+        if self._rotation is not None:
+            td = epoch_td(jds)
+            self._rotation.evaluate(td['T'], td['d'], out=out[:, :, 2])
+
+        return out
+
     def set_parentage(self):
         self._sys_primary = None
         for sb in self.data.values():
@@ -191,6 +451,54 @@ class SimObjectDict(dict):
     def state(self):
         return [sb.state_matrix for sb in self.data.values()]
 
+    @property
+    def state_array(self):
+        return self._state_arr
+
+    @property
+    def abs_positions(self):
+        """ The positions of all bodies relative to the system primary, resolved once per epoch. """
+        return self.resolve_positions()
+
+    @property
+    def parent_idx(self):
+        return self._parent_idx
+
+    @property
+    def nbody(self):
+        return self._nbody
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def soi_radii(self):
+        if self._soi is None:
+            self._build_soi()
+
+        return self._soi.radii
+
+    @property
+    def use_nbody(self):
+        return self._USE_NBODY
+
+    @use_nbody.setter
+    def use_nbody(self, new_val):
+        """ Switches between Keplerian and N-body propagation, seeding from the current state. """
+        self._USE_NBODY = bool(new_val)
+        self._nb_jd = None          # seeded by the next update_state
+
+    @property
+    def pos_arr(self):
+        """ (N, 3) positions relative to the system primary, as floats in dist_unit """
+        return self.resolve_positions()
+
+    @property
+    def vel_arr(self):
+        """ (N, 3) velocities relative to the parent bodies, as floats in dist_unit / s """
+        return self._state_arr[:, 1]
+
     @property
     def track_data(self):
         return [sb.track_data for sb in self.data.values()]
@@ -1,11 +1,14 @@
 # simsystem.py
 import logging
 import time
+import queue
 import psygnal
+import numpy as np
 from astropy.time import Time, TimeDeltaSec
-from multiprocessing import Queue
+from multiprocessing import Queue, Process
 from simobj_dict import SimObjectDict
-from multiprocessing import shared_memory
+from sim_shmem import StateBuffers, DEF_BUFF_NAME
+from sim_kepler import jd_pair
 # from poliastro.bodies import Body
 # from PyQt5.QtCore import QObject
 
@@ -14,6 +17,10 @@ logging.basicConfig(filename="../logs/sns_sysmod.log",
                     format="%(funcName)s:\t\t%(levelname)s:%(asctime)s:\t%(message)s",
                     )
 
+# fields of get_field_columns() that change with the epoch, all others are cached after the first request
+DYN_FIELDS = ('pos', 'vel', 'rot')
+
+
 # class SystemWrapper(QObject):
 #     def __init__(self, *args, **kwargs):
 #         """
@@ -32,7 +39,7 @@ class SimSystem(SimObjectDict):
     initialized = psygnal.Signal(list)
     panel_data = psygnal.Signal(list, list)
 
-    def __init__(self, comm_q, stat_q, *args, **kwargs):
+    def __init__(self, comm_q=None, stat_q=None, *args, **kwargs):
         """
             Initialize the star system model. Two Queues are passed to provide
             communication with the main process
@@ -52,18 +59,105 @@ class SimSystem(SimObjectDict):
                                   )
         self.comm_q = comm_q
         self.stat_q = stat_q
+        self._static_cols = {}
         self.load_from_names()
         self.update_state(self.epoch)
-
-        self._state_size = self.data['Earth'].state.nbytes
-        self._shmem_0 = shared_memory.SharedMemory(create=True,
-                                                   name="state_buff0",
-                                                   size=self.num_bodies * self._state_size)
-        self._shmem_1 = shared_memory.SharedMemory(create=True,
-                                                   name="state_buff1",
-                                                   size=self.num_bodies * self._state_size)
         self._state_buffers = None
 
+    def load_from_names(self, _body_names: list = None) -> None:
+        super(SimSystem, self).load_from_names(_body_names)
+        self._static_cols = {}
+
+    def open_state_buffers(self, create=True, name=DEF_BUFF_NAME):
+        """
+            Creates (in the model process) or attaches to (in the viewer) the double buffered
+            SharedMemory segments that carry the system state between the processes.
+        """
+        self._state_buffers = StateBuffers(body_count=self.num_bodies, name=name, create=create)
+        if self._state_buffers.body_count != self.num_bodies:
+            raise ValueError(f'>>>ERROR: state buffers hold {self._state_buffers.body_count} bodies, '
+                             f'model has {self.num_bodies}')
+
+        return self._state_buffers
+
+    def close_state_buffers(self):
+        if self._state_buffers is not None:
+            self.attach_state(self._state_arr.copy())
+            self._state_buffers.close()
+            self._state_buffers = None
+
+    def publish_state(self):
+        """
+            Writes the current state into the back buffer and flips the generation counter.
+        Returns
+        -------
+        bool    : False if the viewer has not yet released the back buffer
+        """
+        return self._state_buffers.publish(self._state_arr, jd_pair(self._sys_epoch))
+
+    def poll_state(self):
+        """
+            Viewer side: maps the front buffer if the model has published a new generation.
+            The SimBody objects are re-bound to the rows of the front buffer without copying.
+        Returns
+        -------
+        bool    : True if a new state was attached
+        """
+        res = self._state_buffers.acquire()
+        if res is None:
+            return False
+
+        state, epoch = res
+        self._sys_epoch = Time(*epoch, format='jd', scale='tdb')
+        self.attach_state(state)
+        self.has_updated.emit(0.0)
+
+        return True
+
+    def attach_state(self, state):
+        self._state_arr = state
+        self._abs_valid = False
+        for i, sb in enumerate(self.data.values()):
+            sb.bind_state(state[i], preserve=False)
+            sb.set_epoch(self._sys_epoch)
+
+    def serve(self):
+        """
+            The command loop of the model process.  Pending epoch commands are coalesced so
+            that only the latest requested epoch is propagated and published.
+              ('epoch', jd1, jd2)   : propagate the model to this epoch
+              ('stop',)             : leave the loop
+        """
+        unpublished = False
+        while True:
+            try:
+                cmds = [self.comm_q.get(timeout=0.002 if unpublished else None)]
+            except queue.Empty:
+                cmds = []
+            while True:
+                try:
+                    cmds.append(self.comm_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            new_epoch = None
+            for cmd in cmds:
+                match cmd[0]:
+                    case 'epoch':
+                        new_epoch = (cmd[1], cmd[2])
+
+                    case 'stop':
+                        self.stat_q.put(('stopped',))
+                        return
+
+            if new_epoch is not None:
+                self._sys_epoch = Time(*new_epoch, format='jd', scale='tdb')
+                self.update_state(self._sys_epoch)
+                unpublished = True
+
+            if unpublished:
+                unpublished = not self.publish_state()
+
     def get_agg_fields(self, field_ids):
         # res = {'primary_name': self.system_primary.name}
         res = {}
@@ -75,6 +169,85 @@ class SimSystem(SimObjectDict):
 
         return res
 
+    def get_field_columns(self, field_ids):
+        """
+            Returns a columnar snapshot of the requested fields, each column ordered like
+            body_names.  Numeric fields are NumPy arrays with a leading axis of length N:
+              'pos'         : (N, 3)    positions relative to the system primary (dist_unit)
+              'vel'         : (N, 3)    velocities relative to the parent body (dist_unit / s)
+              'rot'         : (N, 3)    RA, DEC and W rotational elements (deg)
+              'radius'      : (N, 3)    R, R_mean and R_polar (dist_unit)
+              'axes'        : (N, 3, 3) the x, y and z axes of each body
+              'body_color'  : (N, 4)    RGBA with body_alpha applied
+              'is_primary'  : (N,)      bool
+              'parent_idx'  : (N,)      index of the parent body, -1 for the primary
+            Any other field is returned as a tuple of the get_sbod_field() value of each body.
+            Only the DYN_FIELDS are recomputed on each call, the others are cached until
+            invalidate_columns() is called or the bodies are reloaded.
+
+        Parameters
+        ----------
+        field_ids           : iterable of str   The fields to be returned
+
+        Returns
+        -------
+        dict                : field_id -> column
+        """
+        res = {}
+        for f_id in field_ids:
+            if f_id in DYN_FIELDS:
+                res[f_id] = self._dyn_column(f_id)
+            else:
+                if f_id not in self._static_cols:
+                    self._static_cols[f_id] = self._static_column(f_id)
+                res[f_id] = self._static_cols[f_id]
+
+        return res
+
+    def invalidate_columns(self, *field_ids):
+        """ Drops the cached static columns given, or all of them if none are given. """
+        if field_ids:
+            [self._static_cols.pop(f_id, None) for f_id in field_ids]
+        else:
+            self._static_cols.clear()
+
+    def _dyn_column(self, field_id):
+        match field_id:
+            case 'pos':
+                return self.resolve_positions().copy()
+
+            case 'vel':
+                return self._state_arr[:, 1].copy()
+
+            case 'rot':
+                return self._state_arr[:, 2].copy()
+
+    def _static_column(self, field_id):
+        _simbods = list(self.data.values())
+        match field_id:
+            case 'names':
+                return tuple(self.data.keys())
+
+            case 'radius':
+                return np.array([[r.to_value(self._dist_unit) for r in sb.radius] for sb in _simbods])
+
+            case 'axes':
+                return np.array([sb.axes[:3] for sb in _simbods])
+
+            case 'body_color':
+                return np.array([sb.body_color.rgba for sb in _simbods])
+
+            case 'body_alpha' | 'track_alpha':
+                return np.array([self.get_sbod_field(sb, field_id) for sb in _simbods], dtype=np.float64)
+
+            case 'is_primary':
+                return np.array([sb.is_primary for sb in _simbods], dtype=bool)
+
+            case 'parent_idx':
+                return self._parent_idx.copy()
+
+        return tuple([self.get_sbod_field(sb, field_id) for sb in _simbods])
+
     def get_sbod_field(self, _simbod, field_id):
         """
             This method retrieves the values of a particular field for a given SimBody object.
@@ -126,10 +299,13 @@ class SimSystem(SimObjectDict):
                 if _simbod.body.parent:
                     return _simbod.body.parent.name
 
+            case 'tex_fname':
+                return self.ref_data.body_texture_fname(name=_simbod.name)
+
             case 'tex_data':
                 # TODO: Add a condition to check if texture data exists in an existing Planet visual.
                 #       If it exists, return its texture data. Otherwise return the default texture data.
-                return self.ref_data.vizz_data(name=_simbod.name)['tex_data']
+                return self.ref_data.body_texture_data(name=_simbod.name)
 
             # these elements can should live in the viewer
             case 'body_alpha':
@@ -168,6 +344,10 @@ class SimSystem(SimObjectDict):
     def dist_unit(self):
         return self._dist_unit
 
+    @property
+    def state_buffers(self):
+        return self._state_buffers
+
     @property
     def positions(self):
         """
@@ -230,23 +410,39 @@ class SimSystem(SimObjectDict):
         return res
 
 
-'''==============================================================================================================='''
-if __name__ == "__main__":
-    def main():
-        ref_time = time.perf_counter()
+class ModelProcess(Process):
+    """
+        Runs a SimSystem in its own process.  The model is constructed inside the child
+        process, receives commands on comm_q, reports its status on stat_q and exposes its
+        state through the StateBuffers SharedMemory segments.
+    """
+    def __init__(self, comm_q, stat_q, body_names=None, buff_name=DEF_BUFF_NAME, daemon=True):
+        super().__init__()
+        self.daemon = daemon
+        self.comm_q = comm_q
+        self.stat_q = stat_q
+        self.body_names = body_names
+        self.buff_name = buff_name
 
-        model = SimSystem({})
-        model.load_from_names()
-        init_time = time.perf_counter()
+    def run(self):
+        model = SimSystem(self.comm_q, self.stat_q, body_names=self.body_names)
+        model.open_state_buffers(create=True, name=self.buff_name)
+        model.publish_state()
+        self.stat_q.put(('ready', model.body_names))
+        try:
+            model.serve()
+        finally:
+            model.close_state_buffers()
 
-        model.update_state(model.epoch)
-        done_time = time.perf_counter()
 
-        # print(f"Setup time: {((init_time - ref_time) / 1e+09):0.4f} seconds")
-        # print(f'Update time: {((done_time - init_time) / 1e+09):0.4f} seconds')
+'''==============================================================================================================='''
+if __name__ == "__main__":
+    def main():
+        from sim_bench import SimBenchmark
 
-        print(f"Setup time: {(init_time - ref_time)} seconds")
-        print(f'Update time: {(done_time - init_time)} seconds')
+        bench = SimBenchmark()
+        bench.run(warps=(1.0, 86400.0), ticks=60)
+        print(bench.report())
 
 
     main()
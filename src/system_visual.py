@@ -13,15 +13,20 @@ from vispy.scene.visuals import (create_visual_node,
                                  Markers, XYZAxis,
                                  Compound, Polygon)
 # from starsys_data import vec_type
-from simbody_visual import Planet
+from simbody_visual import Planet, LOD_ROWS, lod_rows
+from vispy.gloo import Texture2D
+from instantced_visuals import InstancedPlanets, TrackCollection, DEF_ATLAS_TILE, build_tex_atlas
 from sim_skymap import SkyMap
 from sim_body import SimBody, MIN_FOV
+from datastore import get_texture_data
 from PyQt5.QtCore import pyqtSlot
 from sim_camset import CameraSet
+from sim_profiler import PROFILER
 
 # these quantities can be served from DATASTORE class
 MIN_SYMB_SIZE = 5
 MAX_SYMB_SIZE = 30
+TEX_DOWN_FACTOR = 4         # a texture level is only swapped for a smaller one when it is this oversized
 EDGE_COLOR = Color('red')
 EDGE_COLOR.alpha = 0.6
 ST = trx.STTransform
@@ -50,6 +55,71 @@ _cm_e_alpha = 0.6
 _SCALE_FACTOR = np.array([50.0,] * 3)
 
 
+def rotation_matrices(angles, axes):
+    """
+        Batched equivalent of vispy.util.transforms.rotate(); builds the 4x4 rotation matrix
+        (in vispy's row vector convention) for each angle and axis.
+    Parameters
+    ----------
+    angles  : np.ndarray(N,)        angles of rotation in degrees
+    axes    : np.ndarray(N, 3)      the axis of each rotation
+
+    Returns
+    -------
+    np.ndarray(N, 4, 4)
+    """
+    ang = np.radians(angles)
+    x, y, z = (axes / np.linalg.norm(axes, axis=1)[:, None]).T
+    c, s = np.cos(ang), np.sin(ang)
+    cx, cy, cz = (1 - c) * x, (1 - c) * y, (1 - c) * z
+    res = np.zeros((len(ang), 4, 4), dtype=np.float64)
+    res[:, 0, 0] = cx * x + c
+    res[:, 1, 0] = cy * x - z * s
+    res[:, 2, 0] = cz * x + y * s
+    res[:, 0, 1] = cx * y + z * s
+    res[:, 1, 1] = cy * y + c
+    res[:, 2, 1] = cz * y - x * s
+    res[:, 0, 2] = cx * z - y * s
+    res[:, 1, 2] = cy * z + x * s
+    res[:, 2, 2] = cz * z + c
+    res[:, 3, 3] = 1.0
+
+    return res
+
+
+def translation_matrices(offsets):
+    """ Batched equivalent of vispy.util.transforms.translate(), returns (N, 4, 4). """
+    res = np.tile(np.eye(4, dtype=np.float64), (len(offsets), 1, 1))
+    res[:, 3, :3] = offsets
+
+    return res
+
+
+def model_matrices(rot, pos, axes):
+    """
+        Computes the model matrix of every body at once.  The result for each body is the
+        same matrix that MatrixTransform gives after reset(), rotate() about the z, y and x
+        axes by W, DEC and RA, then translate() to the position.
+    Parameters
+    ----------
+    rot     : np.ndarray(N, 3)      RA, DEC and W of each body (deg)
+    pos     : np.ndarray(N, 3)      position of each body
+    axes    : np.ndarray(N, 3, 3)   x, y and z axes of each body
+
+    Returns
+    -------
+    np.ndarray(N, 4, 4)
+    """
+    # NOTE: MatrixTransform.rotate() takes degrees, but the angles have always been passed
+    #       scaled by pi / 180; that scaling is kept here so the rendered spin is unchanged.
+    _ang = rot * np.pi / 180
+
+    return (rotation_matrices(_ang[:, 2], axes[:, 2]) @
+            rotation_matrices(_ang[:, 1], axes[:, 1]) @
+            rotation_matrices(_ang[:, 0], axes[:, 0]) @
+            translation_matrices(pos))
+
+
 def from_pos(pos, tgt_pos, tgt_R):
     rel_2pos = (pos - tgt_pos)
     dist = np.linalg.norm(rel_2pos)
@@ -70,7 +140,7 @@ def from_pos(pos, tgt_pos, tgt_R):
 class StarSystemVisuals:
     """
     """
-    def __init__(self, body_names=None):
+    def __init__(self, body_names=None, tex_store=None, use_instancing=False):
         """
         Constructs a collection of Visuals that represent entities in the system model,
         updating periodically based upon the quantities propagating in the model.
@@ -80,6 +150,11 @@ class StarSystemVisuals:
         ----------
         body_names   : list of str
             list of SimBody names to make visuals for
+        tex_store    : SystemDataStore
+            source of the texture pyramids, if None the full resolution texture file of each
+            body ('tex_fname') is loaded
+        use_instancing : bool
+            draw all bodies with one InstancedPlanets and all tracks with one TrackCollection
         """
         self._IS_INITIALIZED = False
         self._body_names   = []
@@ -98,11 +173,25 @@ class StarSystemVisuals:
         self._cntr_markers = None
         self._subvizz      = None
         self._agg_cache    = None
+        self._cols         = None      # the latest columns from SimSystem.get_field_columns()
+        self._body_colors  = None      # the 'body_color' column the marker face colors were built from
+        self._face_colors  = None
         self._vizz_data    = None
         self._body_radsets = None
         self.dist_unit     = u.km       # TODO: resolve any confusion with the fucking units...!
         self._last_t       = None
         self._curr_t       = None
+        self._tex_store    = tex_store
+        self._tex_widths   = {}      # the width of the texture level shown on each Planet
+        self._pix_diams    = {}      # the apparent diameter of each body in pixels
+        self._lod_rows     = {}      # the rows of the sphere mesh shown for each Planet
+        self._inst_lods    = None    # the rows of the mesh of each body, when use_instancing is set
+        self._pix_diam_arr = None    # the apparent diameters, ordered like body_names
+        self._is_big       = None    # the bodies drawn as a mesh rather than a marker
+        self._USE_INSTANCING = use_instancing
+        self._inst_planets = None      # InstancedPlanets visual of each level of detail, when use_instancing is set
+        self._inst_tracks  = None      # TrackCollection visual, when use_instancing is set
+        self._track_idx    = None      # index of the body of each track in the TrackCollection
 
         if body_names:
             self._body_names   = [n for n in body_names]
@@ -137,12 +226,16 @@ class StarSystemVisuals:
 
         self._bods_pos = list(self._agg_cache['pos'].values())
 
-        for name in self._body_names:
-            self._generate_planet_viz(body_name=name)
-            print(f'Planet Visual for {name} created...')
-            if name != self._agg_cache['is_primary']:
-                self._generate_trajct_viz(body_name=name)
-                print(f'Trajectory Visual for {name} created...')
+        if self._USE_INSTANCING:
+            self._generate_instanced_viz()
+            print(f'Instanced visuals for {self._body_count} bodies created...')
+        else:
+            for name in self._body_names:
+                self._generate_planet_viz(body_name=name)
+                print(f'Planet Visual for {name} created...')
+                if name != self._agg_cache['is_primary']:
+                    self._generate_trajct_viz(body_name=name)
+                    print(f'Trajectory Visual for {name} created...')
 
         self._generate_marker_viz()
         self._subvizz = dict(sk_map=self._skymap,
@@ -152,6 +245,10 @@ class StarSystemVisuals:
                              tracks=self._tracks,
                              surfcs=self._planets,
                              )
+        if self._USE_INSTANCING:
+            self._subvizz.update(iplnts=self._inst_planets,
+                                 i_trks=self._inst_tracks,
+                                 )
         self._upload2view()
         self._curr_t = time.perf_counter()
         print(f'Visuals generated in {(self._curr_t - self._last_t):.4f} seconds...')
@@ -161,14 +258,20 @@ class StarSystemVisuals:
         """
         viz_dat = {}
         [viz_dat.update({k: v[body_name]}) for k, v in self._agg_cache.items()]     # if list(v.keys())[0] == body_name]
+        texture = None
+        if self._tex_store is not None:     # start with the smallest level, it is swapped as the body grows
+            self._tex_widths[body_name] = self._tex_store.texture_level_width(body_name, 0)
+            texture = self._tex_store.texture_level(body_name, 0)
+        self._lod_rows[body_name] = LOD_ROWS[0]        # refined by _update_lods once the view is known
         plnt = Planet(body_name=body_name,
-                      rows=18,
+                      rows=LOD_ROWS[0],
                       color=Color((1, 1, 1, self._agg_cache['body_alpha'][body_name])),
                       edge_color=Color((0, 0, 0, 0)),  # sb.base_color,
                       parent=self._scene,
                       visible=True,
                       method='oblate',
                       vizz_data=viz_dat,
+                      texture=texture,
                       body_radset=self._agg_cache['radius'][body_name]
                       )
         plnt.transform = trx.MatrixTransform()  # np.eye(4, 4, dtype=np.float64)
@@ -187,9 +290,48 @@ class StarSystemVisuals:
         poly.transform = trx.MatrixTransform()  # np.eye(4, 4, dtype=np.float64)
         self._tracks.update({body_name: poly})
 
+    def _generate_instanced_viz(self):
+        """ Generate an InstancedPlanets visual of all of the bodies for each level of detail,
+            sharing one texture atlas, and a single TrackCollection visual for all of their orbits.
+            Each body is shown by the visual of its current level only, see _update_lods.
+        """
+        radii = np.array([[r.to_value(self.dist_unit) for r in self._agg_cache['radius'][name]]
+                          for name in self._body_names])
+        if self._tex_store is not None:
+            textures = [self._tex_store.texture_level(name, DEF_ATLAS_TILE) for name in self._body_names]
+        else:
+            textures = [get_texture_data(self._agg_cache['tex_fname'][name]) for name in self._body_names]
+        atlas, rects = build_tex_atlas(textures)
+        atlas = (Texture2D(atlas, interpolation='linear'), rects)     # uploaded once for all the levels
+        self._inst_lods = np.full((len(self._body_names),), LOD_ROWS[0])
+        self._inst_planets = {rows: InstancedPlanets(radii=radii,
+                                                     atlas=atlas,
+                                                     rows=rows,
+                                                     shown=self._inst_lods == rows,
+                                                     parent=self._scene,
+                                                     )
+                              for rows in LOD_ROWS}
+
+        self._track_idx = np.array([idx for idx, name in enumerate(self._body_names)
+                                    if not self._agg_cache['is_primary'][name] and
+                                    self._agg_cache['track_data'][name] is not None], dtype=np.intp)
+        t_colors = []
+        for idx in self._track_idx:
+            t_color = Color(self._agg_cache['body_color'][self._body_names[idx]])
+            t_color.alpha = self._agg_cache['track_alpha'][self._body_names[idx]]
+            t_colors.append(t_color.rgba)
+        self._inst_tracks = TrackCollection(tracks=[self._agg_cache['track_data'][self._body_names[idx]]
+                                                    for idx in self._track_idx],
+                                            colors=np.array(t_colors),
+                                            parent=self._scene,
+                                            )
+
     def _generate_marker_viz(self):
         # put init of markers into a method
-        self._symbols = [pl.mark for pl in self._planets.values()]
+        if self._USE_INSTANCING:
+            self._symbols = [self._agg_cache['body_mark'][name] for name in self._body_names]
+        else:
+            self._symbols = [pl.mark for pl in self._planets.values()]
         self._plnt_markers = Markers(parent=self._scene, **DEF_MARKS_INIT)  # a single instance of Markers
         # self._cntr_markers = Markers(parent=self._scene,
         #                              symbol=['+' for _ in range(self._body_count)],
@@ -208,82 +350,66 @@ class StarSystemVisuals:
         self._IS_INITIALIZED = True
 
     @pyqtSlot(dict)
-    def update_vizz(self, agg_data):
+    def update_vizz(self, cols):
         """
-            Collects needed fields from model, calculates transforms and applies them to the visuals
+            Applies a columnar snapshot of the model to the visuals.
+        Parameters
+        ----------
+        cols    : dict      The output of SimSystem.get_field_columns(), ordered like body_names,
+                            with at least 'pos', 'rot', 'axes', 'radius', 'is_primary',
+                            'parent_idx' and 'body_color'
+
         Returns
         -------
         Has no return value, but updates the transforms for the Planet and Polygon visuals,
         also, updates the positions and sizes of the Markers icons.
         """
-        self._last_t = self._curr_t
-        self._symbol_sizes = self.get_symb_sizes()  # update symbol sizes based upon FOV of body
-        _p_face_colors = []
-        # _c_face_colors = []
-        _edge_colors = []
-
-        self._agg_cache = agg_data
-
-        self._bods_pos = list(self._agg_cache['pos'].values())
-
-        for sb_name in self._body_names:                                                    # <--
-            x_ax = self._agg_cache['axes'][sb_name][0]
-            y_ax = self._agg_cache['axes'][sb_name][1]
-            z_ax = self._agg_cache['axes'][sb_name][2]
-            RA   = self._agg_cache['rot'][sb_name][0]
-            DEC  = self._agg_cache['rot'][sb_name][1]
-            W    = self._agg_cache['rot'][sb_name][2]
-            pos  = self._agg_cache['pos'][sb_name]
-            parent = self._agg_cache['parent_name'][sb_name]
-            is_primary = self._agg_cache['is_primary'][sb_name]
-
-            if self._planets[sb_name].visible:
-                xform = self._planets[sb_name].transform
-                xform.reset()
-                xform.rotate(W * np.pi / 180, z_ax)
-                xform.rotate(DEC * np.pi / 180, y_ax)
-                xform.rotate(RA * np.pi / 180, x_ax)
-                # if not is_primary:
-                #     xform.scale(_SCALE_FACTOR)
-
-                xform.translate(pos.value)
-                self._planets[sb_name].transform = xform
-
-            if not is_primary:
-                self._tracks[sb_name].transform.reset()
-                self._tracks[sb_name].transform.translate(self._agg_cache['pos'][parent].value)
-
-            # TODO: these do not require updating unless they change...
-            _pf_clr = Color(self._agg_cache['body_color'][sb_name])
-            _pf_clr.alpha = self._agg_cache['body_alpha'][sb_name]
-            # _cf_clr = _pf_clr
-            _p_face_colors.append(_pf_clr)
-            # _c_face_colors.append(_cf_clr)
-
-        self._plnt_markers.set_data(pos=np.array(self._bods_pos),
-                                    face_color=ColorArray(_p_face_colors),
-                                    edge_color=Color([1, 0, 0, _pm_e_alpha]),
-                                    size=self._symbol_sizes,
-                                    symbol=self._symbols,
-                                    )
-        # self._cntr_markers.set_data(pos=np.array(self._bods_pos),
-        #                             face_color=ColorArray(_c_face_colors),
-        #                             edge_color=[0, 1, 0, _cm_e_alpha],
-        #                             size=MIN_SYMB_SIZE,
-        #                             symbol=['diamond' for _ in range(self._body_count)],                  # <--
-        #                             )
+        with PROFILER.span('transforms'):
+            self._cols = cols
+            self._bods_pos = cols['pos']
+            self._symbol_sizes = self.get_symb_sizes()  # update symbol sizes based upon FOV of body
+            self._update_tex_levels()
+            self._update_lods()
+
+            plnt_mats = model_matrices(cols['rot'], self._bods_pos, cols['axes'])
+            if self._USE_INSTANCING:
+                for inst in self._inst_planets.values():
+                    if inst.shown.any():
+                        inst.set_model_matrices(plnt_mats)
+                self._inst_tracks.set_offsets(self._bods_pos[cols['parent_idx'][self._track_idx]])
+            else:
+                trk_mats = translation_matrices(self._bods_pos[cols['parent_idx']])
+                for idx, sb_name in enumerate(self._body_names):                                # <--
+                    if self._planets[sb_name].visible:
+                        self._planets[sb_name].transform.matrix = plnt_mats[idx]
+
+                    if not cols['is_primary'][idx]:
+                        self._tracks[sb_name].transform.matrix = trk_mats[idx]
+
+            if self._body_colors is not cols['body_color']:     # the static columns are cached by the model
+                self._body_colors = cols['body_color']
+                self._face_colors = ColorArray(self._body_colors)
+
+            self._plnt_markers.set_data(pos=self._bods_pos,
+                                        face_color=self._face_colors,
+                                        edge_color=Color([1, 0, 0, _pm_e_alpha]),
+                                        size=self._symbol_sizes,
+                                        symbol=self._symbols,
+                                        )
+            # self._cntr_markers.set_data(pos=np.array(self._bods_pos),
+            #                             face_color=ColorArray(_c_face_colors),
+            #                             edge_color=[0, 1, 0, _cm_e_alpha],
+            #                             size=MIN_SYMB_SIZE,
+            #                             symbol=['diamond' for _ in range(self._body_count)],                  # <--
+            #                             )
         self._scene.update()
-        self._curr_t = time.perf_counter()
-        update_time = self._curr_t - self._last_t
-        print(f'Visuals updated in {update_time:.4f} seconds...')
         logging.info("\nSYMBOL SIZES :\t%s", self._symbol_sizes)
-        logging.info("VISUAL UPDATE TIME :\t%s", update_time)
         # logging.info("\nCAM_REL_DIST :\n%s", [np.linalg.norm(rel_pos) for rel_pos in self._pos_rel2cam])
 
     def get_symb_sizes(self, obs_cam=None):
         """
-            Calculates the s=ize in pixels at which a SimBody will appear in the view from
-            the perspective of a specified camera.
+            Calculates the size in pixels at which each SimBody will appear in the view from
+            the perspective of a specified camera, using the 'pos' and 'radius' columns.
         Parameters
         ----------
         obs_cam :  A Camera object from which the apparent sizes are measured
@@ -298,29 +424,71 @@ class StarSystemVisuals:
         if not obs_cam:
             obs_cam = self._curr_camera
 
-        symb_sizes = []
-        sb_name: str
-        for sb_name in self._body_names:                                                       # <--
-            body_fov = from_pos(obs_cam.center,
-                                self._agg_cache['pos'][sb_name].value,
-                                self._agg_cache['radius'][sb_name][0],
-                                )['fov']
-            pix_diam = 0
-            raw_diam = math.ceil(self._scene.parent.size[0] * body_fov / obs_cam.fov)                # <--
-
-            if raw_diam < MIN_SYMB_SIZE:
-                pix_diam = MIN_SYMB_SIZE
-            elif raw_diam < MAX_SYMB_SIZE:
-                pix_diam = raw_diam
-            elif raw_diam >= MAX_SYMB_SIZE:
-                pix_diam = 0
-                self._planets[sb_name].visible = True
-            else:
-                self._planets[sb_name].visible = False
+        dist = np.linalg.norm(np.asarray(obs_cam.center) - self._cols['pos'], axis=1)
+        body_fov = np.where(dist < 1e-09, MIN_FOV,
+                            np.arctan(self._cols['radius'][:, 0] / np.maximum(dist, 1e-09)))
+        raw_diam = np.ceil(self._scene.parent.size[0] * body_fov / obs_cam.fov).astype(int)     # <--
+        self._pix_diams = dict(zip(self._body_names, raw_diam))
+        self._pix_diam_arr = raw_diam
+        self._is_big = raw_diam >= MAX_SYMB_SIZE
 
-            symb_sizes.append(pix_diam)
+        symb_sizes = np.where(raw_diam < MIN_SYMB_SIZE, MIN_SYMB_SIZE,
+                              np.where(raw_diam < MAX_SYMB_SIZE, raw_diam, 0))
+        for sb_name, big in zip(self._body_names, self._is_big):
+            if sb_name in self._planets:        # the marker takes over when the body is small
+                self._planets[sb_name].visible = bool(big)
 
-        return np.array(symb_sizes)
+        return symb_sizes
+
+    def _update_tex_levels(self):
+        """
+            Selects the level of each texture pyramid from the apparent size of the body.
+            A level is wide enough when it has a texel per pixel around the circumference
+            of the body, (width ~ pi * diameter).  A larger level is swapped in as soon as
+            it is needed, a smaller one only when the current level is TEX_DOWN_FACTOR times
+            too large, so that a body near a threshold does not flip between levels.
+        """
+        if self._tex_store is None or self._USE_INSTANCING:
+            return
+
+        for sb_name, plnt in self._planets.items():
+            if not plnt.visible or sb_name not in self._pix_diams:
+                continue
+
+            need = math.pi * self._pix_diams[sb_name]
+            curr = self._tex_widths.get(sb_name, 0)
+            if need > curr or need * TEX_DOWN_FACTOR < curr:
+                width = self._tex_store.texture_level_width(sb_name, need)
+                if width != curr:
+                    plnt.texture = self._tex_store.texture_level(sb_name, width)
+                    self._tex_widths[sb_name] = width
+                    logging.info("Texture of %s set to %s pixels wide", sb_name, width)
+
+    def _update_lods(self):
+        """
+            Selects the sphere mesh of each visible Planet from the apparent size of the body,
+            see simbody_visual.lod_rows for the thresholds and their hysteresis.  When instancing,
+            each body is moved to the InstancedPlanets of its level, and hidden from all of them
+            while it is drawn as a marker.
+        """
+        if self._USE_INSTANCING:
+            self._inst_lods = lod_rows(self._pix_diam_arr, self._inst_lods)
+            for rows, inst in self._inst_planets.items():
+                shown = self._is_big & (self._inst_lods == rows)
+                if not np.array_equal(shown, inst.shown):
+                    inst.shown = shown
+            return
+
+        for sb_name, plnt in self._planets.items():
+            if not plnt.visible or sb_name not in self._pix_diams:
+                continue
+
+            curr = self._lod_rows.get(sb_name)
+            rows = lod_rows(self._pix_diams[sb_name], curr)
+            if rows != curr:
+                plnt.set_lod(rows)
+                self._lod_rows[sb_name] = rows
+                logging.info("Mesh of %s set to %s rows", sb_name, rows)
 
     @staticmethod
     def _check_simbods(simbods=None):
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+    The modules of src/ are imported by bare name, as the application does.  A handler is put
+    on the root logger first, so that their logging.basicConfig() calls do not open log files
+    relative to the directory pytest is run from.
+"""
+import os
+import sys
+import logging
+
+logging.getLogger().addHandler(logging.NullHandler())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_ephem import ChebyshevEphem, cheb_basis
+
+AU_KM = 1.495978707e+08
+JD0 = 2460000.5
+N_DAY = 2 * np.pi / 365.25          # rad / day
+
+
+def circular(jds):
+    jds = np.asarray(jds, dtype=np.float64)
+    return AU_KM * np.stack([np.cos(N_DAY * jds), np.sin(N_DAY * jds), 0.1 * np.sin(2 * N_DAY * jds)], axis=-1)
+
+
+def circular_vel(jds):
+    jds = np.asarray(jds, dtype=np.float64)
+    return AU_KM * N_DAY / 86400.0 * np.stack([-np.sin(N_DAY * jds), np.cos(N_DAY * jds),
+                                               0.2 * np.cos(2 * N_DAY * jds)], axis=-1)
+
+
+def test_cheb_basis_matches_cosines():
+    x = np.linspace(-1.0, 1.0, 11)
+    T, dT = cheb_basis(x, 6)
+
+    np.testing.assert_allclose(T, np.cos(np.outer(np.arccos(x), np.arange(7))), atol=1e-12)
+    np.testing.assert_allclose(dT[:, 2], 4 * x)
+
+
+@pytest.mark.parametrize('seg_days, degree, tol', [(32.0, 12, 1e-11), (16.0, 8, 1e-9)])
+def test_fit_error_against_sampled_function(seg_days, degree, tol):
+    table = ChebyshevEphem.from_function(circular, JD0, 365.0, seg_days, degree)
+    jds = np.linspace(table.jd_start, table.jd_end, 2001)
+    r, v = table.rv(jds)
+
+    assert table.jd_end - table.jd_start >= 365.0
+    assert np.abs(r - circular(jds)).max() < tol * AU_KM
+    assert np.abs(v - circular_vel(jds)).max() < 1e+3 * tol * AU_KM * N_DAY / 86400.0
+
+
+def test_scalar_and_split_epochs():
+    table = ChebyshevEphem.from_function(circular, JD0, 100.0, 32.0)
+    r, v = table.rv((JD0, 40.25))
+
+    assert r.shape == v.shape == (3,)
+    np.testing.assert_allclose(r, table.rv(JD0 + 40.25)[0], rtol=1e-12)
+    assert table.covers(JD0 + 40.25)
+    assert not table.covers(JD0 - 1.0)
+
+
+def test_extend_matches_a_table_built_over_the_full_span():
+    full = ChebyshevEphem.from_function(circular, JD0 - 64.0, 6 * 32.0 - 16.0, 32.0)
+    table = ChebyshevEphem.from_function(circular, JD0, 63.0, 32.0)
+    grown = table.extend(circular, JD0 - 40.0, JD0 + 100.0)
+
+    assert grown.jd_start == full.jd_start
+    assert grown.n_segments == full.n_segments == 6
+    np.testing.assert_allclose(grown.coeffs, full.coeffs, rtol=1e-12, atol=1e-6)
+    assert grown.extend(circular, JD0, JD0 + 10.0) is grown
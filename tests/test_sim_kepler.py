@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_kepler import KeplerPropagator, absolute_positions, solve_kepler_elliptic, solve_kepler_hyperbolic
+from sim_cowell import EnsemblePropagator
+
+MU_SUN = 1.32712440018e+11
+AU_KM = 1.495978707e+08
+JD0 = (2460000.5, 0.0)
+
+
+def elements(ecc, nu=0.3):
+    """ One orbit of perihelion 1 AU, either elliptic or hyperbolic. """
+    a = AU_KM / (1.0 - ecc)
+    return dict(a=a, ecc=ecc, inc=0.4, raan=1.1, argp=-0.7, nu=nu, mu=MU_SUN, epoch=JD0)
+
+
+@pytest.mark.parametrize('ecc', [0.0, 0.6, 0.99])
+def test_solve_kepler_elliptic(ecc):
+    M = np.linspace(-10.0, 10.0, 201)
+    E = solve_kepler_elliptic(M, np.full_like(M, ecc))
+
+    err = np.remainder(E - ecc * np.sin(E) - M + np.pi, 2 * np.pi) - np.pi     # E is reduced to one turn
+    np.testing.assert_allclose(err, 0.0, atol=1e-11)
+
+
+@pytest.mark.parametrize('ecc', [1.01, 1.5, 5.0])
+def test_solve_kepler_hyperbolic(ecc):
+    M = np.linspace(-50.0, 50.0, 201)
+    F = solve_kepler_hyperbolic(M, np.full_like(M, ecc))
+
+    np.testing.assert_allclose(ecc * np.sinh(F) - F, M, atol=1e-9, rtol=1e-12)
+
+
+@pytest.mark.parametrize('ecc', [0.2, 1.5])
+def test_state_at_epoch_matches_elements(ecc):
+    elem = elements(ecc)
+    kp = KeplerPropagator()
+    kp.set_elements(**elem)
+    r, v = kp.propagate(JD0)[0, :2]
+    p = abs(elem['a']) * abs(1.0 - ecc ** 2)
+
+    assert np.linalg.norm(r) == pytest.approx(p / (1.0 + ecc * np.cos(elem['nu'])), rel=1e-12)
+    assert np.dot(v, v) / 2 - MU_SUN / np.linalg.norm(r) == pytest.approx(-MU_SUN / (2 * elem['a']), rel=1e-10)
+
+
+@pytest.mark.parametrize('ecc, days', [(0.2, 200.0), (0.6, 500.0), (1.5, 200.0)])
+def test_propagation_matches_cowell(ecc, days):
+    """ The analytic state after some days against a numerical integration of the state at epoch. """
+    kp = KeplerPropagator()
+    kp.set_elements(**elements(ecc))
+    y0 = kp.propagate(JD0)[:, :2].reshape((1, 6))
+    epoch = (JD0[0], JD0[1] + days)
+
+    _, states = EnsemblePropagator(y0, JD0, MU_SUN, rtol=1e-12, atol=1e-6).propagate(epoch)
+    r, v = kp.propagate(epoch)[0, :2]
+    np.testing.assert_allclose(r, states[-1, 0, :3], rtol=0, atol=1e-8 * np.linalg.norm(r))
+    np.testing.assert_allclose(v, states[-1, 0, 3:], rtol=0, atol=1e-8 * np.linalg.norm(v))
+
+
+def test_elliptic_round_trip_over_a_period():
+    elem = elements(0.6)
+    kp = KeplerPropagator()
+    kp.set_elements(**elem)
+    period = 2 * np.pi * np.sqrt(elem['a'] ** 3 / MU_SUN) / 86400.0
+    states = kp.propagate_epochs((np.full(3, JD0[0]), np.array([0.0, period, -3 * period])))
+
+    np.testing.assert_allclose(states[1], states[0], rtol=0, atol=1e-6 * AU_KM)
+    np.testing.assert_allclose(states[2], states[0], rtol=0, atol=1e-6 * AU_KM)
+
+
+def test_hyperbolic_round_trip_through_periapsis():
+    """ A hyperbolic orbit is symmetric about periapsis, out and back take the same time. """
+    elem = elements(1.5, nu=0.0)
+    kp = KeplerPropagator()
+    kp.set_elements(**elem)
+    days = 150.0
+    states = kp.propagate_epochs((np.full(2, JD0[0]), np.array([-days, days])))
+    r_in, r_out = states[0, 0, 0], states[1, 0, 0]
+    peri = kp.propagate(JD0)[0, 0]
+    peri_dir = peri / np.linalg.norm(peri)
+
+    assert np.linalg.norm(r_in) == pytest.approx(np.linalg.norm(r_out), rel=1e-12)
+    assert np.dot(r_in, peri_dir) == pytest.approx(np.dot(r_out, peri_dir), rel=1e-12)
+    np.testing.assert_allclose(r_in + r_out, 2 * np.dot(r_out, peri_dir) * peri_dir, atol=1e-6)
+
+
+def test_parabolic_orbit_is_rejected():
+    kp = KeplerPropagator()
+    with pytest.raises(ValueError):
+        kp.set_elements(**dict(elements(0.0), ecc=1.0))
+
+
+def test_propagate_writes_rows_by_sys_idx():
+    kp = KeplerPropagator()
+    kp.set_elements(**dict(elements(0.2), epoch=JD0), sys_idx=[2])
+    state = np.zeros((3, 3, 3))
+    kp.propagate(JD0, out=state)
+
+    assert not state[:2].any()
+    np.testing.assert_array_equal(state[2, :2], kp.propagate(JD0)[0, :2])
+
+
+def test_absolute_positions():
+    """ The primary is at the origin, a moon adds the position of its planet. """
+    r = np.array([[[0.0, 0.0, 1.0], [10.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 5.0]]])
+    parent_idx = np.array([-1, 0, 1, 0])
+
+    np.testing.assert_allclose(absolute_positions(r, parent_idx),
+                               [[[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [10.0, 1.0, 0.0], [0.0, 0.0, 5.0]]])
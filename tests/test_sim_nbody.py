@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_nbody import NBodyEngine, SmallBodyField, belt_elements, AU_KM
+from sim_cowell import EnsemblePropagator
+
+MU_SUN = 1.32712440018e+11
+MU_JUP = 1.26686534e+08
+JD0 = (2460000.5, 0.0)
+
+
+class StaticPerturbers:
+    """ Perturbers held at fixed positions relative to the central body. """
+    def __init__(self, pos, mu):
+        self._pos = np.asarray(pos, dtype=np.float64)
+        self.mu = np.asarray(mu, dtype=np.float64)
+
+    def __call__(self, jds):
+        return np.broadcast_to(self._pos, (len(jds),) + self._pos.shape)
+
+
+def test_engine_accelerations_match_direct_sum():
+    rng = np.random.default_rng(3)
+    pos = rng.normal(size=(12, 3)) * 1e+6
+    mu = rng.uniform(1.0, 1e+5, 12)
+    engine = NBodyEngine(mu)
+    acc = engine.accelerations(pos).copy()
+    expected = np.zeros_like(pos)
+    for i in range(len(pos)):
+        for j in range(len(pos)):
+            if i != j:
+                d = pos[j] - pos[i]
+                expected[i] += mu[j] * d / np.linalg.norm(d) ** 3
+
+    np.testing.assert_allclose(acc, expected, rtol=1e-12)
+
+
+def test_engine_conserves_energy():
+    pos = np.array([[0.0, 0.0, 0.0], [AU_KM, 0.0, 0.0]])
+    vel = np.array([[0.0, 0.0, 0.0], [0.0, np.sqrt(MU_SUN / AU_KM), 0.0]])
+    engine = NBodyEngine([MU_SUN, 398600.4418], max_step=3600.0)
+    e0 = engine.energy(pos, vel)
+    engine.advance(pos, vel, 365.25 * 86400.0)
+
+    assert abs(engine.energy(pos, vel) / e0 - 1.0) < 1e-8
+
+
+def test_field_matches_cowell_with_perturber():
+    """ A belt perturbed by a nearby Jupiter, in the frame of the Sun, against the Cowell ensemble. """
+    field = SmallBodyField(belt_elements('Asteroid Belt', 20, seed=7), MU_SUN, JD0, max_step=600.0)
+    y0 = np.hstack([field.pos, field.vel])
+    major_pos = np.array([[0.0, 0.0, 0.0], [3.5 * AU_KM, 0.0, 0.0]])
+    major_mu = np.array([MU_SUN, MU_JUP])
+    days = 20.0
+
+    field.advance((JD0[0], JD0[1] + days), major_pos, major_mu)
+    ens = EnsemblePropagator(y0, JD0, MU_SUN, StaticPerturbers(major_pos[1:], major_mu[1:]),
+                             rtol=1e-12, atol=1e-9)
+    _, states = ens.propagate((JD0[0], JD0[1] + days))
+    kepler = EnsemblePropagator(y0, JD0, MU_SUN, rtol=1e-12, atol=1e-9)
+    _, unperturbed = kepler.propagate((JD0[0], JD0[1] + days))
+
+    err = np.linalg.norm(field.pos - states[-1, :, :3], axis=1)
+    perturbation = np.linalg.norm(states[-1, :, :3] - unperturbed[-1, :, :3], axis=1)
+    assert np.all(err < 1e-3 * perturbation)
+
+
+@pytest.mark.parametrize('theta', [0.0, 0.5])
+def test_field_self_gravity_uses_tree(theta):
+    field = SmallBodyField(belt_elements('Asteroid Belt', 200, seed=1), MU_SUN, JD0,
+                           mu=1e-3, theta=theta, tree_every=1)
+    acc = field.accelerations(np.zeros((1, 3)), np.array([MU_SUN])).copy()
+    kepler = -MU_SUN * field.pos / np.linalg.norm(field.pos, axis=1)[:, None] ** 3
+
+    assert np.any(acc != kepler)
+    np.testing.assert_allclose(acc, kepler, rtol=1e-6)
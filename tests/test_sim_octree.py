@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_octree import BarnesHutTree
+
+
+def sources(seed=5):
+    """ A wide cloud and a dense clump, so that the tree has both deep and shallow branches. """
+    rng = np.random.default_rng(seed)
+    pos = np.vstack([rng.normal(size=(300, 3)) * 1e+6, rng.normal(size=(200, 3)) * 1e+5 + 3e+6])
+    return pos, rng.uniform(1.0, 10.0, len(pos))
+
+
+def direct_sum(pos, mu):
+    d = pos[None, :, :] - pos[:, None, :]
+    r2 = np.einsum('ijk,ijk->ij', d, d)
+    np.fill_diagonal(r2, np.inf)
+    return np.einsum('j,ijk->ik', mu, d / r2[..., None] ** 1.5)
+
+
+def relative_errors(tree, pos, mu):
+    expected = direct_sum(pos, mu)
+    return np.linalg.norm(tree.accelerations(pos) - expected, axis=1) / np.linalg.norm(expected, axis=1)
+
+
+def test_zero_opening_angle_is_exact():
+    pos, mu = sources()
+    tree = BarnesHutTree(theta=0.0)
+    tree.build(pos, mu)
+
+    assert relative_errors(tree, pos, mu).max() < 1e-12
+
+
+@pytest.mark.parametrize('theta', [0.3, 0.5])
+def test_matches_direct_sum_within_opening_angle(theta):
+    """ The monopole error of an accepted node is of order theta ** 2. """
+    pos, mu = sources()
+    tree = BarnesHutTree(theta=theta)
+    tree.build(pos, mu)
+    err = relative_errors(tree, pos, mu)
+
+    assert err.max() < theta ** 2
+    assert np.median(err) < theta ** 2 / 10
+
+
+def test_error_shrinks_with_opening_angle():
+    pos, mu = sources()
+    errs = []
+    for theta in (0.8, 0.5, 0.3):
+        tree = BarnesHutTree(theta=theta)
+        tree.build(pos, mu)
+        errs.append(np.median(relative_errors(tree, pos, mu)))
+
+    assert errs[0] > errs[1] > errs[2]
+
+
+def test_refit_keeps_exact_sums():
+    """ After the sources move, a refit tree walked with theta = 0 still gives the direct sum. """
+    pos, mu = sources()
+    tree = BarnesHutTree(theta=0.0, rebuild_every=100)
+    tree.build(pos, mu)
+    moved = pos + np.random.default_rng(9).normal(size=pos.shape) * 3e+5
+    tree.update(moved)
+
+    assert relative_errors(tree, moved, mu).max() < 1e-12
+
+
+def test_chunked_walk_matches_single_walk():
+    pos, mu = sources()
+    tree = BarnesHutTree(theta=0.5)
+    tree.build(pos, mu)
+
+    np.testing.assert_allclose(tree.accelerations(pos, chunk=37), tree.accelerations(pos), rtol=1e-12)
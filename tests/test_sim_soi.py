@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_soi import SOIIndex, soi_radii, SOI_HYSTERESIS
+
+AU_KM = 1.495978707e+08
+# Sun, Earth, Moon, Mars
+MU = np.array([1.32712440018e+11, 398600.4418, 4902.8, 42828.37])
+A = np.array([0.0, AU_KM, 384400.0, 1.523679 * AU_KM])
+PARENT_IDX = np.array([-1, 0, 1, 0])
+BODY_POS = np.array([[0.0, 0.0, 0.0], [AU_KM, 0.0, 0.0], [AU_KM + 384400.0, 0.0, 0.0], [0.0, A[3], 0.0]])
+
+
+def test_soi_radii():
+    radii = soi_radii(A, MU, PARENT_IDX)
+
+    assert np.isinf(radii[0])
+    assert radii[1] == pytest.approx(9.25e+5, rel=1e-2)       # the usual 925 000 km
+    assert radii[2] == pytest.approx(6.6e+4, rel=2e-2)
+    assert radii[3] == pytest.approx(5.77e+5, rel=1e-2)
+
+
+def test_lookup_descends_the_hierarchy():
+    index = SOIIndex(soi_radii(A, MU, PARENT_IDX), PARENT_IDX)
+    points = np.array([[2 * AU_KM, 0.0, 0.0],                  # deep space
+                       [AU_KM, 5e+5, 0.0],                     # near the Earth
+                       [AU_KM + 384400.0 + 1e+4, 0.0, 0.0],    # near the Moon
+                       [1e+4, A[3], 0.0],                      # near Mars
+                       [AU_KM + 384400.0, 0.0, 1e+5],          # near the Moon, outside its sphere
+                       ])
+
+    np.testing.assert_array_equal(index.lookup(points, BODY_POS), [0, 1, 2, 3, 1])
+    np.testing.assert_array_equal(index.lookup(points, BODY_POS, chunk=2), [0, 1, 2, 3, 1])
+
+
+def test_lookup_hysteresis():
+    """ Just outside a sphere, an object that was inside stays, one that was not stays out. """
+    radii = soi_radii(A, MU, PARENT_IDX)
+    index = SOIIndex(radii, PARENT_IDX)
+    just_out = BODY_POS[1] + [0.0, radii[1] * (1 + SOI_HYSTERESIS / 2), 0.0]
+    well_out = BODY_POS[1] + [0.0, radii[1] * (1 + 2 * SOI_HYSTERESIS), 0.0]
+    points = np.array([just_out, just_out, well_out])
+
+    np.testing.assert_array_equal(index.lookup(points, BODY_POS), [0, 0, 0])
+    np.testing.assert_array_equal(index.lookup(points, BODY_POS, prev=np.array([1, 0, 1])), [1, 0, 0])
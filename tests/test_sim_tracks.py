@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sim_tracks import sample_track, track_anomalies, TrackCache, MIN_POINTS, MAX_POINTS
+
+AU_KM = 1.495978707e+08
+
+
+def chord_errors(pts):
+    """ The distance of the midpoint of each chord of a closed planar track from the curve. """
+    pts = np.asarray(pts, dtype=np.float64)
+    nxt = np.roll(pts, -1, axis=0)
+    mid_r = np.linalg.norm((pts + nxt) / 2, axis=1)
+    # on a circle, the arc midpoint is at the radius of the end points
+    return np.linalg.norm(pts, axis=1) - mid_r
+
+
+@pytest.mark.parametrize('pix_tol, view_px', [(0.5, 2048), (0.1, 2048), (0.5, 8192)])
+def test_circular_point_count(pix_tol, view_px):
+    """ A circle filling the view needs 2 pi sqrt(R / (8 tol)) points, with tol = pix_tol * 2R / view_px. """
+    pts = sample_track(AU_KM, 0.0, 0.3, 0.2, 0.1, pix_tol=pix_tol, view_px=view_px)
+
+    assert len(pts) == int(np.ceil(2 * np.pi * np.sqrt(view_px / (16 * pix_tol))))
+    assert chord_errors(pts).max() < 1.01 * pix_tol * 2 * AU_KM / view_px
+
+
+def test_point_count_limits():
+    assert len(sample_track(AU_KM, 0.0, 0.0, 0.0, 0.0, pix_tol=1000.0)) == MIN_POINTS
+    assert len(sample_track(AU_KM, 0.0, 0.0, 0.0, 0.0, pix_tol=1e-6)) == MAX_POINTS
+
+
+def test_eccentric_track_is_denser_where_it_bends():
+    """ The chords at the apsides (curvature a / b^2) are shorter than at the ends of the minor axis (b / a^2). """
+    a, ecc = AU_KM, 0.9
+    pts = sample_track(a, ecc, 0.0, 0.0, 0.0).astype(np.float64)
+    chords = np.linalg.norm(np.roll(pts, -1, axis=0) - pts, axis=1)
+    r = np.linalg.norm(pts, axis=1)
+    b_a = np.sqrt(1 - ecc ** 2)
+
+    assert chords[r.argmin()] == pytest.approx(chords[np.abs(r - a).argmin()] * b_a ** 1.5, rel=0.1)
+
+
+def test_hyperbolic_track_is_open():
+    pts = sample_track(-AU_KM, 1.5, 0.0, 0.0, 0.0)
+    r = np.linalg.norm(pts.astype(np.float64), axis=1)
+
+    assert MIN_POINTS <= len(pts) <= MAX_POINTS
+    assert r.argmin() in (len(r) // 2 - 1, len(r) // 2)
+    assert r[0] == pytest.approx(r[-1], rel=1e-6)
+
+
+def test_cache_shares_tracks():
+    cache = TrackCache()
+    first = cache.track(AU_KM, 0.1, 0.2, 0.3, 0.4)
+
+    assert cache.track(AU_KM * (1 + 1e-12), 0.1, 0.2, 0.3, 0.4) is first
+    assert cache.track(AU_KM, 0.2, 0.2, 0.3, 0.4) is not first
+    assert not first.flags.writeable
+    assert cache.stats == dict(tracks=2, hits=1, misses=2)